@@ -4,6 +4,10 @@ from django.conf import settings
 from pyVerein.urls import urlpatterns
 import re
 from django.http import HttpResponseRedirect
+from account.models import User
+from utils.middleware import request_stats, QueryCountMiddleware
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory
 
 # Credit: Douglas @ https://stackoverflow.com/a/35760156/9652454
 def get_urls(urlpatterns, parent=''):
@@ -60,4 +64,38 @@ class AppTestMethods(TestCase):
                 except AssertionError as e:
                     res = resolve(url)
                     e.args = (e.args[0] + '\n Url %s:%s is not enforcing login!' % (res.namespace, res.url_name),)
-                    raise 
\ No newline at end of file
+                    raise 
+
+    def test_request_statistics(self):
+        "Request statistics should be recorded per view and only be visible for staff users"
+        request_stats.clear()
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        self.client.login(username='temp', password='temppass')
+
+        response = self.client.get(reverse('app:request_statistics'))
+        self.assertEqual(response.status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        self.client.get(reverse('account:login'))
+        response = self.client.get(reverse('app:request_statistics'))
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()
+        self.assertEqual(stats['account:login']['requests'], 1)
+        self.assertEqual(stats['app:request_statistics']['requests'], 1)
+        self.assertIn('queries_avg', stats['account:login'])
+
+    def test_request_statistics_streaming(self):
+        "Queries of streamed responses should be recorded when the content is consumed"
+        request_stats.clear()
+
+        def stream():
+            yield str(User.objects.count())
+
+        request = RequestFactory().get('/')
+        request.resolver_match = resolve(reverse('account:login'))
+        response = QueryCountMiddleware(lambda request: StreamingHttpResponse(stream()))(request)
+        self.assertEqual(request_stats.summary(), {})
+
+        self.assertEqual(b''.join(response.streaming_content), b'0')
+        self.assertEqual(request_stats.summary()['account:login']['queries_max'], 1)
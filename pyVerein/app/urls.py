@@ -8,4 +8,5 @@ app_name = 'app'
 # Set url-patterns
 urlpatterns = [
     path('', views.index, name='index'),
+    path('request_statistics/', views.request_statistics, name='request_statistics'),
 ]
@@ -1,19 +1,21 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render
 from django.contrib import messages
+from django.http import JsonResponse, HttpResponseForbidden
 from django.db.models import Count, Sum
 from members.models import Member
 from finance.models import Transaction, CostCenter, CostObject
 from dynamic_preferences.registries import global_preferences_registry
 from django.db.models import Q
+from utils.middleware import request_stats, get_query_budget
 
 # Create your views here.
 @login_required
 def index(request):
     global_preferences = global_preferences_registry.manager()
 
-    members = [member.pk for member in Member.objects.all() if not member.is_terminated()]
-    divisions = Member.objects.filter(pk__in=members).values('division__name').annotate(members=Count('id'))
+    members = Member.objects.active()
+    divisions = members.values('division__name').annotate(members=Count('id'))
 
     bank_account_pref = global_preferences['Dashboard__bank_accounts'].split(',')
     bank_accounts = Transaction.objects.filter(account__in=bank_account_pref).order_by('account__number').values('account__name').annotate(debit=Sum('debit'), credit=Sum('credit'))
@@ -22,4 +24,17 @@ def index(request):
 
     cost_object = CostObject.objects.order_by('number').values('name').annotate(debit=Sum('transaction__debit', filter=Q(transaction__accounting_year=global_preferences['Finance__accounting_year'])), credit=Sum('transaction__credit', filter=Q(transaction__accounting_year=global_preferences['Finance__accounting_year'])))
 
-    return render(request, 'app/dashboard.html', {'divisions': divisions, 'bank_accounts': bank_accounts, 'cost_center': cost_center, 'cost_object': cost_object, 'member_count': len(members)})
+    return render(request, 'app/dashboard.html', {'divisions': divisions, 'bank_accounts': bank_accounts, 'cost_center': cost_center, 'cost_object': cost_object, 'member_count': members.count()})
+
+@login_required
+def request_statistics(request):
+    """
+    Returns the rolling query and timing statistics per view for staff users
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    summary = request_stats.summary()
+    for view_name, stats in summary.items():
+        stats['query_budget'] = get_query_budget(view_name)
+    return JsonResponse(summary)
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class FinanceConfig(AppConfig):
     name = 'finance'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals
+        # Cached trial balances depend on accounts and transactions
+        from utils.signals import connect_version_signals
+        from .models import Account, Transaction
+        connect_version_signals([Account, Transaction])
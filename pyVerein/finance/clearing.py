@@ -0,0 +1,97 @@
+"""
+Clearing of open items on debitor and creditor accounts
+"""
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils.timezone import now
+from django.utils.translation import ugettext_lazy as _
+from decimal import Decimal
+from utils.models import bulk_create_history, ModelVersion
+from .models import Account, AccountBalance, NumberSequence, Transaction
+
+# Maximum number of ids per IN clause
+CHUNK_SIZE = 500
+
+class ClearingError(Exception):
+    """
+    Raised if transactions can not be cleared
+    """
+
+def lock_transactions(**filters):
+    """
+    Returns the transactions matching filters, locked until the surrounding transaction ends
+    """
+    return list(Transaction.objects.select_for_update().filter(**filters).order_by('pk'))
+
+def clear_transactions(pks, user=None):
+    """
+    Clear the given open items of one debitor or creditor account with one clearing number.
+    The items have to balance. Returns the clearing number.
+    """
+    try:
+        pks = sorted(set(int(pk) for pk in pks))
+    except (TypeError, ValueError):
+        raise ClearingError(_('Invalid transaction'))
+    if not pks:
+        raise ClearingError(_('No transactions selected'))
+
+    with db_transaction.atomic():
+        transactions = []
+        for start in range(0, len(pks), CHUNK_SIZE):
+            transactions += lock_transactions(pk__in=pks[start:start + CHUNK_SIZE])
+
+        if len(transactions) != len(pks):
+            raise ClearingError(_('Transaction not found'))
+        if any(transaction.clearing_number is not None for transaction in transactions):
+            raise ClearingError(_('Transaction is already cleared'))
+        if len({transaction.account_id for transaction in transactions}) != 1:
+            raise ClearingError(_('Transactions belong to different accounts'))
+        if not Account.objects.filter(pk=transactions[0].account_id, account_type__in=(Account.DEBITOR, Account.CREDITOR)).exists():
+            raise ClearingError(_('Only debitor and creditor accounts can be cleared'))
+        debit = sum((transaction.debit or Decimal(0) for transaction in transactions), Decimal(0))
+        credit = sum((transaction.credit or Decimal(0) for transaction in transactions), Decimal(0))
+        if debit != credit:
+            raise ClearingError(_('Transactions do not balance'))
+
+        clearing_number = NumberSequence.objects.reserve(NumberSequence.CLEARING)
+        set_clearing_number(transactions, clearing_number, user)
+
+    return clearing_number
+
+def reset_clearing(clearing_number, user=None):
+    """
+    Reset the clearing of all transactions with the given clearing number. Returns the number of reset transactions.
+    """
+    with db_transaction.atomic():
+        transactions = lock_transactions(clearing_number=clearing_number)
+        set_clearing_number(transactions, None, user)
+
+    return len(transactions)
+
+def set_clearing_number(transactions, clearing_number, user=None):
+    """
+    Update the clearing number of the locked transactions, their account balances and history
+    """
+    if not transactions:
+        return
+
+    previous_states = [transaction.get_balance_state() for transaction in transactions]
+    modified_at = now()
+    pks = [transaction.pk for transaction in transactions]
+    for start in range(0, len(pks), CHUNK_SIZE):
+        Transaction.objects.filter(pk__in=pks[start:start + CHUNK_SIZE]).update(**{
+            'clearing_number': clearing_number,
+            'modified_at': modified_at,
+            settings.AUTHOR_UPDATED_BY_FIELD_NAME: user,
+        })
+    for transaction in transactions:
+        transaction.clearing_number = clearing_number
+        transaction.modified_at = modified_at
+        setattr(transaction, settings.AUTHOR_UPDATED_BY_FIELD_NAME, user)
+        transaction._balance_state = transaction.get_balance_state()
+
+    # The update does not send signals
+    AccountBalance.objects.book_states(previous_states, sign=-1)
+    AccountBalance.objects.add_transactions(transactions)
+    bulk_create_history(Transaction, transactions, '~', user=user)
+    ModelVersion.objects.bump(Transaction)
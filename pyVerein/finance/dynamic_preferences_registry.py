@@ -28,4 +28,60 @@ class AccountingYear(StringPreference):
     section = finance
     name = 'accounting_year'
     default = ''
-    verbose_name = "Acounting year"
\ No newline at end of file
+    verbose_name = "Acounting year"
+
+# Register input for CSV statement delimiter
+@global_preferences_registry.register
+class CSVDelimiter(StringPreference):
+    section = finance
+    name = 'csv_delimiter'
+    default = ';'
+    verbose_name = "CSV statement delimiter"
+
+# Register input for CSV statement date format
+@global_preferences_registry.register
+class CSVDateFormat(StringPreference):
+    section = finance
+    name = 'csv_date_format'
+    default = '%d.%m.%Y'
+    verbose_name = "CSV statement date format"
+
+# Register input for CSV statement columns
+@global_preferences_registry.register
+class CSVColumns(StringPreference):
+    section = finance
+    name = 'csv_columns'
+    default = 'date=Buchungstag,amount=Betrag,name=Beguenstigter/Zahlungspflichtiger,iban=Kontonummer/IBAN,reference=Mandatsreferenz,text=Verwendungszweck'
+    verbose_name = "CSV statement columns (field=column, separated by comma)"
+
+# Register input for SEPA creditor name
+@global_preferences_registry.register
+class SEPACreditorName(StringPreference):
+    section = finance
+    name = 'sepa_creditor_name'
+    default = ''
+    verbose_name = "SEPA creditor name"
+
+# Register input for SEPA creditor identifier
+@global_preferences_registry.register
+class SEPACreditorId(StringPreference):
+    section = finance
+    name = 'sepa_creditor_id'
+    default = ''
+    verbose_name = "SEPA creditor identifier"
+
+# Register input for SEPA creditor IBAN
+@global_preferences_registry.register
+class SEPACreditorIBAN(StringPreference):
+    section = finance
+    name = 'sepa_creditor_iban'
+    default = ''
+    verbose_name = "SEPA creditor IBAN"
+
+# Register input for SEPA creditor BIC
+@global_preferences_registry.register
+class SEPACreditorBIC(StringPreference):
+    section = finance
+    name = 'sepa_creditor_bic'
+    default = ''
+    verbose_name = "SEPA creditor BIC"
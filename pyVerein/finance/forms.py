@@ -7,6 +7,7 @@ from django import forms
 from django.utils.translation import ugettext_lazy as _
 # Import Accountmodel
 from .models import Account, CostCenter, CostObject, Transaction, VirtualAccount
+from .statements import FORMATS
 
 class PersonalAccountCreateForm(forms.ModelForm):
     """
@@ -146,6 +147,23 @@ class TransactionEditForm(forms.ModelForm):
             'cost_object': forms.TextInput(),
         }
 
+class StatementImportForm(forms.Form):
+    """
+    Formclass for bank statement imports
+    """
+    # Choices for file encoding
+    ENCODINGS = (
+        ('utf-8-sig', 'UTF-8'),
+        ('cp1252', 'Windows-1252'),
+    )
+
+    statement = forms.FileField()
+    file_format = forms.ChoiceField(choices=FORMATS)
+    encoding = forms.ChoiceField(choices=ENCODINGS)
+    bank_account = forms.ModelChoiceField(queryset=Account.objects.filter(account_type=Account.ASSET))
+    # Account of lines without known counterparty, these lines are skipped if not set
+    fallback_account = forms.ModelChoiceField(queryset=Account.objects.filter(account_type__in=(Account.DEBITOR, Account.CREDITOR)), required=False)
+
 class VirtualAccountCreateForm(forms.ModelForm):
     """
     Formclass for creating virtual accounts
@@ -0,0 +1,25 @@
+"""
+Management command to rebuild and verify the account balance ledger
+"""
+from django.core.management.base import BaseCommand, CommandError
+from finance.models import AccountBalance
+
+class Command(BaseCommand):
+    help = 'Rebuilds the account balances from the transactions and verifies them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify-only', action='store_true', dest='verify_only', help='Only verify the balances without rebuilding them')
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            AccountBalance.objects.rebuild()
+            self.stdout.write('Account balances rebuilt.')
+
+        mismatches = AccountBalance.objects.verify()
+        for (account, accounting_year, cleared), expected, stored in mismatches:
+            self.stderr.write('Account {} year {} cleared {}: expected debit/credit {}/{}, stored {}/{}'.format(
+                account, accounting_year, cleared, expected[0], expected[1], stored[0], stored[1]))
+        if mismatches:
+            raise CommandError('{} account balances do not match the transactions.'.format(len(mismatches)))
+
+        self.stdout.write(self.style.SUCCESS('Account balances verified.'))
@@ -0,0 +1,152 @@
+"""
+Matching engine, which proposes groups of open items of debitor and creditor accounts for clearing
+"""
+from collections import defaultdict, namedtuple
+from itertools import combinations
+from django.db import transaction as db_transaction
+from utils.models import get_batch_size
+from .clearing import clear_transactions, ClearingError
+from .models import Account, ClearingProposal, Transaction
+
+# Maximum number of items with the same document number proposed together
+DOCUMENT_SIZE = 10
+# Maximum number of items of a subset sum proposal
+SUBSET_SIZE = 4
+# Maximum number of oldest open items per account and sign searched for subset sums
+SUBSET_CANDIDATES = 30
+
+# Open item with its amount in cents, positive for debit and negative for credit
+OpenItem = namedtuple('OpenItem', ['pk', 'account', 'document_number', 'amount'])
+
+def get_open_items(accounts=None):
+    """
+    Returns the open items of all debitor and creditor accounts, or the given accounts, by account, oldest first
+    """
+    transactions = Transaction.objects.filter(clearing_number=None, account__account_type__in=(Account.DEBITOR, Account.CREDITOR))
+    if accounts is not None:
+        transactions = transactions.filter(account__in=accounts)
+
+    items = defaultdict(list)
+    for pk, account, document_number, debit, credit in transactions.order_by('date', 'pk').values_list('pk', 'account', 'document_number', 'debit', 'credit').iterator():
+        amount = int(((debit or 0) - (credit or 0)) * 100)
+        if amount:
+            items[account].append(OpenItem(pk, account, document_number, amount))
+    return items
+
+def match_items(items, rejected=()):
+    """
+    Returns the proposals for the open items of one account as list of (rule, items).
+    Every item is proposed once, groups with a key in rejected are skipped.
+    """
+    proposals = []
+    used = set()
+
+    def propose(rule, group):
+        if ClearingProposal.get_key(item.pk for item in group) in rejected:
+            return False
+        proposals.append((rule, group))
+        used.update(item.pk for item in group)
+        return True
+
+    # Items with the same document number, e.g. a claim and its reversal
+    by_document = defaultdict(list)
+    for item in items:
+        if item.document_number:
+            by_document[item.document_number].append(item)
+    for group in by_document.values():
+        if 1 < len(group) <= DOCUMENT_SIZE and sum(item.amount for item in group) == 0:
+            propose(ClearingProposal.DOCUMENT, group)
+
+    # Pairs with the same amount, indexed by amount
+    by_amount = defaultdict(list)
+    for item in items:
+        if item.pk not in used:
+            by_amount[item.amount].append(item)
+    for item in items:
+        if item.pk in used or item.amount < 0:
+            continue
+        for other in by_amount[-item.amount]:
+            if other.pk not in used and propose(ClearingProposal.PAIR, [item, other]):
+                break
+
+    # One item against up to SUBSET_SIZE - 1 items of the other sign, the last one looked up by amount
+    remaining = [item for item in items if item.pk not in used]
+    for item in remaining:
+        if item.pk in used:
+            continue
+        candidates = [other for other in remaining if other.pk not in used and (other.amount > 0) != (item.amount > 0)][:SUBSET_CANDIDATES]
+        by_amount = defaultdict(list)
+        for other in candidates:
+            by_amount[other.amount].append(other)
+        find_subset(item, candidates, by_amount, propose)
+
+    return proposals
+
+def find_subset(item, candidates, by_amount, propose):
+    """
+    Propose item with the first combination of candidates, which clears it. Returns whether a proposal was made.
+    """
+    for size in range(1, SUBSET_SIZE - 1):
+        for combination in combinations(candidates, size):
+            rest = -item.amount - sum(other.amount for other in combination)
+            for last in by_amount.get(rest, ()):
+                if last not in combination and propose(ClearingProposal.SUBSET, [item] + list(combination) + [last]):
+                    return True
+    return False
+
+def update_proposals(accounts=None):
+    """
+    Replace the open proposals by proposals for the current open items of all debitor and creditor accounts,
+    or the given accounts. Rejected proposals are not proposed again. Returns the number of open proposals.
+    """
+    with db_transaction.atomic():
+        proposals = ClearingProposal.objects.all()
+        if accounts is not None:
+            proposals = proposals.filter(account__in=accounts)
+        proposals.filter(state=ClearingProposal.OPEN).delete()
+        rejected = set(proposals.filter(state=ClearingProposal.REJECTED).values_list('key', flat=True))
+
+        groups = {}
+        for account, items in get_open_items(accounts).items():
+            for rule, group in match_items(items, rejected):
+                key = ClearingProposal.get_key(item.pk for item in group)
+                groups[key] = (account, rule, group)
+        if not groups:
+            return 0
+
+        new_proposals = [ClearingProposal(account_id=account, key=key, rule=rule) for key, (account, rule, group) in groups.items()]
+        ClearingProposal.objects.bulk_create(new_proposals, batch_size=get_batch_size(ClearingProposal, new_proposals, 500))
+
+        # bulk_create does not set primary keys on every database
+        Item = ClearingProposal.transactions.through
+        items = [
+            Item(clearingproposal_id=pk, transaction_id=item.pk)
+            for key, pk in proposals.filter(state=ClearingProposal.OPEN).values_list('key', 'pk').iterator()
+            for item in groups[key][2]
+        ]
+        Item.objects.bulk_create(items, batch_size=get_batch_size(Item, items, 500))
+
+    return len(groups)
+
+def accept_proposals(pks, user=None):
+    """
+    Clear the transactions of the given open proposals and delete the proposals.
+    Returns the number of cleared proposals and the number of proposals, which could not be cleared anymore.
+    """
+    cleared = failed = 0
+    proposals = list(ClearingProposal.objects.filter(pk__in=pks, state=ClearingProposal.OPEN))
+    for proposal in proposals:
+        try:
+            clear_transactions(proposal.get_transaction_pks(), user=user)
+            cleared += 1
+        except ClearingError:
+            # Items were changed or cleared since matching
+            failed += 1
+    ClearingProposal.objects.filter(pk__in=[proposal.pk for proposal in proposals]).delete()
+    return cleared, failed
+
+def reject_proposals(pks):
+    """
+    Reject the given open proposals, so they are not proposed again
+    """
+    return ClearingProposal.objects.filter(pk__in=pks, state=ClearingProposal.OPEN).update(state=ClearingProposal.REJECTED)
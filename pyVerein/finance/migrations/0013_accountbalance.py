@@ -0,0 +1,50 @@
+# Generated by Django 2.1.15 on 2026-10-18 06:43
+
+from django.db import migrations, models
+from django.db.models import Sum, Case, When, Value, BooleanField
+import django.db.models.deletion
+
+
+def populate_balances(apps, schema_editor):
+    Transaction = apps.get_model('finance', 'Transaction')
+    AccountBalance = apps.get_model('finance', 'AccountBalance')
+
+    rows = Transaction.objects.annotate(
+        cleared=Case(When(clearing_number=None, then=Value(False)), default=Value(True), output_field=BooleanField())
+    ).values('account', 'accounting_year', 'cleared').annotate(debit_sum=Sum('debit'), credit_sum=Sum('credit')).order_by()
+
+    AccountBalance.objects.bulk_create([
+        AccountBalance(
+            account_id=row['account'],
+            accounting_year=row['accounting_year'],
+            cleared=row['cleared'],
+            debit=row['debit_sum'] or 0,
+            credit=row['credit_sum'] or 0
+        ) for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0012_auto_20190426_1834'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('accounting_year', models.IntegerField(blank=True, null=True)),
+                ('cleared', models.BooleanField(default=False)),
+                ('debit', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('credit', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='finance.Account')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='accountbalance',
+            unique_together={('account', 'accounting_year', 'cleared')},
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.1.15 on 2026-10-18 06:46
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def seed_sequences(apps, schema_editor):
+    Transaction = apps.get_model('finance', 'Transaction')
+    NumberSequence = apps.get_model('finance', 'NumberSequence')
+    GlobalPreferenceModel = apps.get_model('dynamic_preferences', 'GlobalPreferenceModel')
+
+    # Internal and clearing number sequences always exist, so they are never created concurrently
+    sequences = [
+        NumberSequence(name='INT', last_value=Transaction.objects.aggregate(Max('internal_number'))['internal_number__max'] or 0),
+        NumberSequence(name='CLE', last_value=Transaction.objects.aggregate(Max('clearing_number'))['clearing_number__max'] or 0),
+    ]
+
+    reset_prefix = GlobalPreferenceModel.objects.filter(section='Finance', name='reset_prefix').values_list('raw_value', flat=True).first()
+    transactions = Transaction.objects.filter(document_number_generated=True).exclude(accounting_year=None)
+    if reset_prefix:
+        transactions = transactions.exclude(document_number__startswith=reset_prefix)
+    for row in transactions.values('accounting_year').annotate(max_document_number=Max('document_number')).order_by():
+        sequences.append(NumberSequence(name='DOC', accounting_year=row['accounting_year'], last_value=int(row['max_document_number'][2:])))
+
+    NumberSequence.objects.bulk_create(sequences)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0013_accountbalance'),
+        ('dynamic_preferences', '0004_move_user_model'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(choices=[('DOC', 'Document number'), ('INT', 'Internal number'), ('CLE', 'Clearing number')], max_length=3)),
+                ('accounting_year', models.IntegerField(blank=True, null=True)),
+                ('last_value', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='numbersequence',
+            unique_together={('name', 'accounting_year')},
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
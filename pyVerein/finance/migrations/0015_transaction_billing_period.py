@@ -0,0 +1,92 @@
+# Generated by Django 2.1.15 on 2026-10-18 06:51
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import translation
+import django.db.models.deletion
+
+
+# Number of billing periods per accounting year
+PERIODS = {'YEA': 1, 'HAL': 2, 'QUA': 4, 'MON': 12}
+
+
+def link_subscription_transactions(apps, schema_editor):
+    """
+    Best-effort backfill of the billing keys from the transaction texts generated by the subscription task
+    """
+    Transaction = apps.get_model('finance', 'Transaction')
+    Member = apps.get_model('members', 'Member')
+    Subscription = apps.get_model('members', 'Subscription')
+
+    members = list(Member.objects.exclude(membership_number=None).exclude(membership_number=''))
+    subscriptions = list(Subscription.objects.all())
+    if not members or not subscriptions:
+        return
+
+    texts = {}
+    for language, _name in settings.LANGUAGES:
+        with translation.override(language):
+            text = translation.gettext('Subscription - {subscription_name} - {membership_number} - {last_name}, {first_name}')
+        for member in members:
+            for subscription in subscriptions:
+                texts.setdefault(text.format(subscription_name=subscription.name, membership_number=member.membership_number, last_name=member.last_name, first_name=member.first_name), (member, subscription))
+
+    transactions = {}
+    for transaction in Transaction.objects.filter(reset=False, credit__isnull=False).exclude(accounting_year=None).order_by('date', 'pk').iterator():
+        if transaction.text in texts:
+            member, subscription = texts[transaction.text]
+            transactions.setdefault((member, subscription, transaction.accounting_year), []).append(transaction)
+
+    for (member, subscription, accounting_year), billed in transactions.items():
+        periods = PERIODS.get(subscription.payment_frequency)
+        # The task bills the remaining periods of a year, so existing postings belong to the last periods
+        for period, transaction in zip(range(periods - len(billed) + 1, periods + 1) if periods else [None] * len(billed), billed):
+            if period is not None and period < 1:
+                continue
+            Transaction.objects.filter(pk=transaction.pk).update(member=member, subscription=subscription, billing_period=period)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0021_auto_20190417_1439'),
+        ('finance', '0014_numbersequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicaltransaction',
+            name='billing_period',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='historicaltransaction',
+            name='member',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='members.Member'),
+        ),
+        migrations.AddField(
+            model_name='historicaltransaction',
+            name='subscription',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='members.Subscription'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='billing_period',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='member',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='members.Member'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='subscription',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='members.Subscription'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='transaction',
+            unique_together={('member', 'subscription', 'accounting_year', 'billing_period')},
+        ),
+        migrations.RunPython(link_subscription_transactions, migrations.RunPython.noop),
+    ]
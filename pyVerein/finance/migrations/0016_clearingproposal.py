@@ -0,0 +1,34 @@
+# Generated by Django 2.1.15 on 2026-10-18 07:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0015_transaction_billing_period'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClearingProposal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('rule', models.CharField(choices=[('DOC', 'Same document number'), ('PAI', 'Same amount'), ('SUB', 'Sum of amounts')], max_length=3)),
+                ('state', models.CharField(choices=[('OPE', 'Open'), ('REJ', 'Rejected')], default='OPE', max_length=3)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='clearing_proposals', to='finance.Account')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='transaction',
+            index_together={('account', 'clearing_number')},
+        ),
+        migrations.AddField(
+            model_name='clearingproposal',
+            name='transactions',
+            field=models.ManyToManyField(related_name='clearing_proposals', to='finance.Transaction'),
+        ),
+    ]
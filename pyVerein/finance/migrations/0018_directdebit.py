@@ -0,0 +1,35 @@
+# Generated by Django 2.1.15 on 2026-10-18 07:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0017_importedstatementline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectDebit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.CharField(max_length=35, unique=True)),
+                ('collection_date', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='historicaltransaction',
+            name='direct_debit',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='finance.DirectDebit'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='direct_debit',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='finance.DirectDebit'),
+        ),
+    ]
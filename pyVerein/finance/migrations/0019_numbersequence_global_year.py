@@ -0,0 +1,36 @@
+# Generated by Django 2.1.15 on 2026-10-18 08:21
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def set_global_year(apps, schema_editor):
+    Transaction = apps.get_model('finance', 'Transaction')
+    NumberSequence = apps.get_model('finance', 'NumberSequence')
+
+    # Rows created concurrently with a NULL year are merged into one row per sequence
+    seeds = {
+        'INT': Transaction.objects.aggregate(Max('internal_number'))['internal_number__max'] or 0,
+        'CLE': Transaction.objects.aggregate(Max('clearing_number'))['clearing_number__max'] or 0,
+    }
+    for name, seed in seeds.items():
+        sequences = NumberSequence.objects.filter(name=name, accounting_year=None)
+        last_value = max([seed] + list(sequences.values_list('last_value', flat=True)))
+        sequences.delete()
+        NumberSequence.objects.create(name=name, accounting_year=0, last_value=last_value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0018_directdebit'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_global_year, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='numbersequence',
+            name='accounting_year',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.1.15 on 2026-10-18 08:40
+
+from django.db import migrations
+from django.db.models import Min
+
+
+def set_once_billing_period(apps, schema_editor):
+    Transaction = apps.get_model('finance', 'Transaction')
+
+    # Subscriptions paid once were billed without period. One posting per member, subscription and year keeps the period 0.
+    billed = Transaction.objects.filter(subscription__isnull=False, billing_period=None)
+    pks = [row['pk__min'] for row in billed.values('member', 'subscription', 'accounting_year').annotate(Min('pk')).order_by()]
+    for start in range(0, len(pks), 500):
+        Transaction.objects.filter(pk__in=pks[start:start + 500]).update(billing_period=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0019_numbersequence_global_year'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_once_billing_period, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,9 @@
-from django.db import models
+from django.db import models, IntegrityError, transaction as db_transaction
 # Import localization
 from django.utils.translation import ugettext_lazy as _
 from author.decorators import with_author
-from django.db.models import Q
+from django.db.models import Q, F, Sum, Max, Case, When, Value, BooleanField
+from decimal import Decimal
 from utils.models import ModelBase
 
 @with_author
@@ -72,6 +73,11 @@ class Transaction(ModelBase):
     """
     Transaction model.
     """
+    class Meta:
+        unique_together = (('member', 'subscription', 'accounting_year', 'billing_period'),)
+        # Open items are looked up per account
+        index_together = (('account', 'clearing_number'),)
+
     # Account
     account = models.ForeignKey(Account, on_delete=models.PROTECT)
 
@@ -103,6 +109,60 @@ class Transaction(ModelBase):
     # Accounting year
     accounting_year = models.IntegerField(blank=True, null=True)
 
+    # Member the transaction was billed to
+    member = models.ForeignKey('members.Member', on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    # Billed subscription
+    subscription = models.ForeignKey('members.Subscription', on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    # Billed period of the subscription within the accounting year, starting with 1, or 0 for subscriptions paid once
+    billing_period = models.PositiveSmallIntegerField(blank=True, null=True)
+    # SEPA direct debit, which collects the transaction
+    direct_debit = models.ForeignKey('DirectDebit', on_delete=models.SET_NULL, blank=True, null=True, related_name='transactions')
+
+    # Fields, which make up the balance state, as attribute names
+    BALANCE_FIELDS = ('account_id', 'accounting_year', 'clearing_number', 'debit', 'credit')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the loaded balance state to book deltas on save
+        """
+        instance = super(Transaction, cls).from_db(db, field_names, values)
+        # Deferred fields are loaded on access, which would load the instance again
+        if not instance.get_deferred_fields().intersection(cls.BALANCE_FIELDS):
+            instance._balance_state = instance.get_balance_state()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        """
+        Remember the reloaded balance state, so later saves book their deltas against the database values
+        """
+        super(Transaction, self).refresh_from_db(using, fields)
+        if self.get_deferred_fields().intersection(self.BALANCE_FIELDS):
+            return
+        state = self.get_balance_state()
+        previous_state = getattr(self, '_balance_state', None)
+        if fields is None or previous_state is None:
+            self._balance_state = state
+        else:
+            # Values of fields, which were not reloaded, are still booked as before
+            fields = {self._meta.get_field(field).attname for field in fields}
+            self._balance_state = tuple(
+                value if name in fields else previous_value
+                for name, value, previous_value in zip(self.BALANCE_FIELDS, state, previous_state)
+            )
+
+    def get_balance_state(self):
+        """
+        Returns the balance key and amounts of this transaction as (account, accounting_year, cleared, debit, credit)
+        """
+        return (
+            self.account_id,
+            int(self.accounting_year) if self.accounting_year not in (None, '') else None,
+            self.clearing_number is not None,
+            self._meta.get_field('debit').to_python(self.debit) or Decimal(0),
+            self._meta.get_field('credit').to_python(self.credit) or Decimal(0),
+        )
+
     def is_cleared(self):
         """
         Returns whether the transaction was cleared
@@ -113,6 +173,266 @@ class Transaction(ModelBase):
 
         return True
 
+class AccountBalanceManager(models.Manager):
+    """
+    Manager for maintaining the account balance ledger
+    """
+
+    def book(self, account_id, accounting_year, cleared, debit, credit):
+        """
+        Add the given debit and credit amounts to the balance row
+        """
+        if not debit and not credit:
+            return
+        balances = self.filter(account_id=account_id, accounting_year=accounting_year, cleared=cleared)
+        if balances.update(debit=F('debit') + debit, credit=F('credit') + credit):
+            return
+        try:
+            with db_transaction.atomic():
+                self.create(account_id=account_id, accounting_year=accounting_year, cleared=cleared, debit=debit, credit=credit)
+        except IntegrityError:
+            # Row was created concurrently
+            balances.update(debit=F('debit') + debit, credit=F('credit') + credit)
+
+    def book_states(self, states, sign=1):
+        """
+        Book a list of balance states, summed up per balance row
+        """
+        deltas = {}
+        for account_id, accounting_year, cleared, debit, credit in states:
+            key = (account_id, accounting_year, cleared)
+            debit_sum, credit_sum = deltas.get(key, (Decimal(0), Decimal(0)))
+            deltas[key] = (debit_sum + debit, credit_sum + credit)
+        for (account_id, accounting_year, cleared), (debit, credit) in deltas.items():
+            self.book(account_id, accounting_year, cleared, sign * debit, sign * credit)
+
+    def add_transactions(self, transactions):
+        """
+        Book transactions which were saved without signals, e.g. by bulk_create
+        """
+        self.book_states([transaction.get_balance_state() for transaction in transactions])
+
+    def totals(self, account, accounting_year=None, cleared=None):
+        """
+        Returns the debit and credit sums of an account
+        """
+        balances = self.filter(account=account)
+        if accounting_year is not None:
+            balances = balances.filter(accounting_year=accounting_year)
+        if cleared is not None:
+            balances = balances.filter(cleared=cleared)
+        sums = balances.aggregate(debit_sum=Sum('debit'), credit_sum=Sum('credit'))
+        return (sums['debit_sum'] or Decimal(0), sums['credit_sum'] or Decimal(0))
+
+    def calculate(self):
+        """
+        Returns the balances calculated from the transactions
+        """
+        rows = Transaction.objects.annotate(
+            cleared=Case(When(clearing_number=None, then=Value(False)), default=Value(True), output_field=BooleanField())
+        ).values('account', 'accounting_year', 'cleared').annotate(debit_sum=Sum('debit'), credit_sum=Sum('credit')).order_by()
+
+        return {
+            (row['account'], row['accounting_year'], row['cleared']): (row['debit_sum'] or Decimal(0), row['credit_sum'] or Decimal(0))
+            for row in rows
+        }
+
+    def rebuild(self):
+        """
+        Recreate all balance rows from the transactions
+        """
+        with db_transaction.atomic():
+            self.all().delete()
+            self.bulk_create([
+                AccountBalance(account_id=account_id, accounting_year=accounting_year, cleared=cleared, debit=debit, credit=credit)
+                for (account_id, accounting_year, cleared), (debit, credit) in self.calculate().items()
+            ])
+
+    def verify(self):
+        """
+        Returns a list of (key, expected, stored) tuples for all balance rows not matching the transactions
+        """
+        expected = self.calculate()
+        stored = {
+            (balance.account_id, balance.accounting_year, balance.cleared): (balance.debit, balance.credit)
+            for balance in self.all()
+        }
+        mismatches = []
+        for key in set(expected) | set(stored):
+            expected_value = expected.get(key, (Decimal(0), Decimal(0)))
+            stored_value = stored.get(key, (Decimal(0), Decimal(0)))
+            if expected_value != stored_value:
+                mismatches.append((key, expected_value, stored_value))
+        return mismatches
+
+class AccountBalance(models.Model):
+    """
+    Debit and credit sums per account, accounting year and clearing state.
+    Maintained on every save of a transaction.
+    """
+    class Meta:
+        unique_together = (('account', 'accounting_year', 'cleared'),)
+
+    # Account
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='balances')
+    # Accounting year
+    accounting_year = models.IntegerField(blank=True, null=True)
+    # Are the summed transactions cleared
+    cleared = models.BooleanField(default=False)
+
+    # Debit sum
+    debit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Credit sum
+    credit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    objects = AccountBalanceManager()
+
+class NumberSequenceManager(models.Manager):
+    """
+    Manager for allocating numbers from sequences
+    """
+
+    def reserve(self, name, accounting_year=None, count=1):
+        """
+        Reserve count consecutive numbers and return the first one.
+        The sequence row stays locked until the surrounding transaction is committed,
+        so numbers of rolled back postings are handed out again.
+        """
+        if name != NumberSequence.DOCUMENT:
+            accounting_year = NumberSequence.GLOBAL
+        with db_transaction.atomic():
+            try:
+                sequence = self.select_for_update().get(name=name, accounting_year=accounting_year)
+            except NumberSequence.DoesNotExist:
+                try:
+                    with db_transaction.atomic():
+                        self.create(name=name, accounting_year=accounting_year, last_value=self.get_seed(name, accounting_year))
+                except IntegrityError:
+                    # Sequence was created concurrently
+                    pass
+                sequence = self.select_for_update().get(name=name, accounting_year=accounting_year)
+
+            first_value = sequence.last_value + 1
+            sequence.last_value += count
+            sequence.save(update_fields=['last_value'])
+        return first_value
+
+    def get_seed(self, name, accounting_year=None):
+        """
+        Returns the highest number already used in the transactions for a new sequence
+        """
+        if name == NumberSequence.INTERNAL:
+            return Transaction.objects.aggregate(Max('internal_number'))['internal_number__max'] or 0
+        if name == NumberSequence.CLEARING:
+            return Transaction.objects.aggregate(Max('clearing_number'))['clearing_number__max'] or 0
+
+        # Generated document numbers consist of the last two digits of the year and the sequence number
+        from dynamic_preferences.registries import global_preferences_registry
+        reset_prefix = global_preferences_registry.manager()['Finance__reset_prefix']
+        transactions = Transaction.objects.filter(document_number_generated=True, accounting_year=accounting_year)
+        if reset_prefix:
+            transactions = transactions.exclude(document_number__startswith=reset_prefix)
+        max_document_number = transactions.aggregate(Max('document_number'))['document_number__max']
+        return int(max_document_number[2:]) if max_document_number else 0
+
+class NumberSequence(models.Model):
+    """
+    Sequence of the last allocated document, internal or clearing number
+    """
+    class Meta:
+        unique_together = (('name', 'accounting_year'),)
+
+    # Choices for sequence name
+    DOCUMENT = 'DOC'
+    INTERNAL = 'INT'
+    CLEARING = 'CLE'
+    SEQUENCE_NAMES = (
+        (DOCUMENT, _('Document number')),
+        (INTERNAL, _('Internal number')),
+        (CLEARING, _('Clearing number')),
+    )
+    # Accounting year of sequences, which are not restarted every year
+    GLOBAL = 0
+    # Sequence name
+    name = models.CharField(choices=SEQUENCE_NAMES, max_length=3)
+    # Accounting year of document numbers, GLOBAL for internal and clearing numbers.
+    # The year is never NULL, so the unique constraint also covers global sequences.
+    accounting_year = models.IntegerField(default=0)
+    # Last allocated number
+    last_value = models.IntegerField(default=0)
+
+    objects = NumberSequenceManager()
+
+class ImportedStatementLine(models.Model):
+    """
+    Bank statement line, which was posted by the statement import
+    """
+    # Hash of the bank account and the line data
+    key = models.CharField(max_length=64, unique=True)
+    # Internal number of the posted receipt
+    internal_number = models.IntegerField()
+    # Imported at
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class DirectDebit(models.Model):
+    """
+    SEPA direct debit collection of open debitor items
+    """
+    # Message id of the pain.008 file
+    message_id = models.CharField(max_length=35, unique=True)
+    # Requested collection date
+    collection_date = models.DateField()
+    # Number of collected transactions
+    count = models.IntegerField(default=0)
+    # Sum of the collected amounts
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Created at
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class ClearingProposal(models.Model):
+    """
+    Group of open items proposed for clearing by the matching engine
+    """
+    # Choices for matching rule
+    DOCUMENT = 'DOC'
+    PAIR = 'PAI'
+    SUBSET = 'SUB'
+    RULES = (
+        (DOCUMENT, _('Same document number')),
+        (PAIR, _('Same amount')),
+        (SUBSET, _('Sum of amounts')),
+    )
+    # Choices for state
+    OPEN = 'OPE'
+    REJECTED = 'REJ'
+    STATES = (
+        (OPEN, _('Open')),
+        (REJECTED, _('Rejected')),
+    )
+
+    # Account
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='clearing_proposals')
+    # Proposed transactions
+    transactions = models.ManyToManyField(Transaction, related_name='clearing_proposals')
+    # Sorted primary keys of the proposed transactions, to recognize rejected proposals
+    key = models.CharField(max_length=255, unique=True)
+    # Matching rule
+    rule = models.CharField(choices=RULES, max_length=3)
+    # State
+    state = models.CharField(choices=STATES, max_length=3, default=OPEN)
+    # Created at
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def get_key(pks):
+        """
+        Returns the key of a proposal for the given transaction primary keys
+        """
+        return ','.join(str(pk) for pk in sorted(pks))
+
+    def get_transaction_pks(self):
+        return [int(pk) for pk in self.key.split(',')]
+
 @with_author
 class ClosureTransaction(ModelBase):
     """
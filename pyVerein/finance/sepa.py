@@ -0,0 +1,220 @@
+"""
+SEPA direct debit collection of open debitor items as pain.008 file
+"""
+import os
+import re
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+from xml.sax.saxutils import escape, quoteattr
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils.timezone import now
+from django.utils.translation import ugettext_lazy as _
+from dynamic_preferences.registries import global_preferences_registry
+from members.models import Member
+from utils.models import bulk_create_history, ModelVersion
+from .models import Account, DirectDebit, Transaction
+
+# Maximum number of ids per IN clause
+CHUNK_SIZE = 500
+
+# Sequence types of the mandates
+FIRST = 'FRST'
+RECURRING = 'RCUR'
+
+# pain.008 namespace
+NAMESPACE = 'urn:iso:std:iso:20022:tech:xsd:pain.008.001.02'
+
+# Open debitor item of a member with direct debit mandate
+DirectDebitItem = namedtuple('DirectDebitItem', ['pk', 'document_number', 'text', 'amount', 'member', 'name', 'iban', 'bic', 'mandate_reference', 'mandate_date'])
+
+class SEPAError(Exception):
+    """
+    Raised if a direct debit can not be created
+    """
+
+def is_valid_iban(iban):
+    """
+    Returns whether iban has a valid format and checksum (ISO 13616, mod 97)
+    """
+    iban = re.sub(r'\s', '', iban or '').upper()
+    if not re.match(r'^[A-Z]{2}\d{2}[A-Z0-9]{11,30}$', iban):
+        return False
+    digits = ''.join(str(int(char, 36)) for char in iban[4:] + iban[:4])
+    return int(digits) % 97 == 1
+
+def get_direct_debit_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'protected', 'directdebits')
+
+def get_direct_debit_filepath(direct_debit):
+    return os.path.join(get_direct_debit_dir(), '{}.xml'.format(direct_debit.message_id))
+
+def get_creditor():
+    """
+    Returns name, creditor identifier, IBAN and BIC of the club from the preferences.
+    Raises SEPAError if they are not configured.
+    """
+    global_preferences = global_preferences_registry.manager()
+    name = global_preferences['Finance__sepa_creditor_name']
+    creditor_id = global_preferences['Finance__sepa_creditor_id']
+    iban = re.sub(r'\s', '', global_preferences['Finance__sepa_creditor_iban']).upper()
+    bic = global_preferences['Finance__sepa_creditor_bic'].strip()
+    if not name or not creditor_id:
+        raise SEPAError(_('SEPA creditor name and identifier are not configured'))
+    if not is_valid_iban(iban):
+        raise SEPAError(_('SEPA creditor IBAN is invalid'))
+    return name, creditor_id, iban, bic
+
+def get_items():
+    """
+    Returns the open, not yet collected debit items of all members paying by direct debit
+    """
+    items = Transaction.objects.filter(
+        account__account_type=Account.DEBITOR, clearing_number=None, direct_debit=None, debit__gt=0,
+        member__payment_method=Member.DEBIT
+    ).order_by('member', 'pk').values_list(
+        'pk', 'document_number', 'text', 'debit', 'member', 'member__first_name', 'member__last_name',
+        'member__iban', 'member__bic', 'member__debit_reference', 'member__debit_mandate_at'
+    )
+    return [
+        DirectDebitItem(pk, document_number, text, amount, member, '{} {}'.format(first_name, last_name).strip(), re.sub(r'\s', '', iban or '').upper(), (bic or '').strip(), reference, mandate_date)
+        for pk, document_number, text, amount, member, first_name, last_name, iban, bic, reference, mandate_date in items.iterator()
+    ]
+
+def validate_items(items):
+    """
+    Returns the valid items and the invalid items with their error. IBANs shared by several items are checked once.
+    """
+    valid_ibans = {}
+    valid = []
+    invalid = []
+    for item in items:
+        if item.iban not in valid_ibans:
+            valid_ibans[item.iban] = is_valid_iban(item.iban)
+        if not valid_ibans[item.iban]:
+            invalid.append((item, _('Invalid IBAN')))
+        elif not item.mandate_reference or not item.mandate_date:
+            invalid.append((item, _('Missing mandate')))
+        else:
+            valid.append(item)
+    return valid, invalid
+
+def get_sequence_types(items):
+    """
+    Returns the items grouped by sequence type. Mandates are used the first time, if no item of the member was collected before.
+    """
+    collected_members = set(Transaction.objects.filter(direct_debit__isnull=False, member__isnull=False).order_by().values_list('member', flat=True).distinct())
+    groups = {}
+    for item in items:
+        groups.setdefault(RECURRING if item.member in collected_members else FIRST, []).append(item)
+    return groups
+
+def text(value, length):
+    return escape(str(value or '')[:length])
+
+def get_agent(bic):
+    if bic:
+        return '<FinInstnId><BIC>{}</BIC></FinInstnId>'.format(text(bic, 11))
+    return '<FinInstnId><Othr><Id>NOTPROVIDED</Id></Othr></FinInstnId>'
+
+def iterate_xml(direct_debit, groups, creditor):
+    """
+    Yield the pain.008 document of the grouped items piece by piece
+    """
+    name, creditor_id, iban, bic = creditor
+    items = [item for group in groups.values() for item in group]
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<Document xmlns={}><CstmrDrctDbtInitn>\n'.format(quoteattr(NAMESPACE))
+    yield '<GrpHdr><MsgId>{}</MsgId><CreDtTm>{}</CreDtTm><NbOfTxs>{}</NbOfTxs><CtrlSum>{:.2f}</CtrlSum><InitgPty><Nm>{}</Nm></InitgPty></GrpHdr>\n'.format(
+        text(direct_debit.message_id, 35), now().strftime('%Y-%m-%dT%H:%M:%S'), len(items), sum(item.amount for item in items), text(name, 70))
+    for sequence_type, group in sorted(groups.items()):
+        yield '<PmtInf><PmtInfId>{}</PmtInfId><PmtMtd>DD</PmtMtd><BtchBookg>true</BtchBookg><NbOfTxs>{}</NbOfTxs><CtrlSum>{:.2f}</CtrlSum>'.format(
+            text('{}-{}'.format(direct_debit.message_id, sequence_type), 35), len(group), sum(item.amount for item in group))
+        yield '<PmtTpInf><SvcLvl><Cd>SEPA</Cd></SvcLvl><LclInstrm><Cd>CORE</Cd></LclInstrm><SeqTp>{}</SeqTp></PmtTpInf>'.format(sequence_type)
+        yield '<ReqdColltnDt>{}</ReqdColltnDt><Cdtr><Nm>{}</Nm></Cdtr><CdtrAcct><Id><IBAN>{}</IBAN></Id></CdtrAcct><CdtrAgt>{}</CdtrAgt><ChrgBr>SLEV</ChrgBr>'.format(
+            direct_debit.collection_date.isoformat(), text(name, 70), iban, get_agent(bic))
+        yield '<CdtrSchmeId><Id><PrvtId><Othr><Id>{}</Id><SchmeNm><Prtry>SEPA</Prtry></SchmeNm></Othr></PrvtId></Id></CdtrSchmeId>\n'.format(text(creditor_id, 35))
+        for item in group:
+            yield (
+                '<DrctDbtTxInf><PmtId><EndToEndId>{}</EndToEndId></PmtId><InstdAmt Ccy="EUR">{:.2f}</InstdAmt>'
+                '<DrctDbtTx><MndtRltdInf><MndtId>{}</MndtId><DtOfSgntr>{}</DtOfSgntr></MndtRltdInf></DrctDbtTx>'
+                '<DbtrAgt>{}</DbtrAgt><Dbtr><Nm>{}</Nm></Dbtr><DbtrAcct><Id><IBAN>{}</IBAN></Id></DbtrAcct>'
+                '<RmtInf><Ustrd>{}</Ustrd></RmtInf></DrctDbtTxInf>\n'
+            ).format(
+                text(item.document_number or 'NOTPROVIDED', 35), item.amount, text(item.mandate_reference, 35), item.mandate_date.isoformat(),
+                get_agent(item.bic), text(item.name, 70), item.iban, text(item.text, 140))
+        yield '</PmtInf>\n'
+    yield '</CstmrDrctDbtInitn></Document>\n'
+
+def write_file(direct_debit, groups, creditor):
+    """
+    Stream the pain.008 file of direct_debit to disk
+    """
+    os.makedirs(get_direct_debit_dir(), exist_ok=True)
+    filepath = get_direct_debit_filepath(direct_debit)
+    temp_filepath = '{}.{}.tmp'.format(filepath, uuid.uuid4())
+    try:
+        with open(temp_filepath, 'w', encoding='utf8') as file:
+            file.writelines(iterate_xml(direct_debit, groups, creditor))
+        os.replace(temp_filepath, filepath)
+    finally:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+
+def set_direct_debit(pks, direct_debit, user=None):
+    """
+    Assign the transactions to direct_debit, or release them if direct_debit is None, and record the history.
+    Raises SEPAError if a transaction was collected or cleared concurrently.
+    """
+    for start in range(0, len(pks), CHUNK_SIZE):
+        chunk = pks[start:start + CHUNK_SIZE]
+        transactions = Transaction.objects.filter(pk__in=chunk)
+        if direct_debit is not None:
+            # Items cleared or collected since they were read are not collected
+            transactions = transactions.filter(direct_debit=None, clearing_number=None)
+        if transactions.update(direct_debit=direct_debit, modified_at=now(), **{settings.AUTHOR_UPDATED_BY_FIELD_NAME: user}) != len(chunk):
+            raise SEPAError(_('Transactions were collected concurrently'))
+        # The update does not send signals
+        bulk_create_history(Transaction, Transaction.objects.filter(pk__in=chunk), '~', user=user)
+    ModelVersion.objects.bump(Transaction)
+
+def create_direct_debit(collection_date, user=None):
+    """
+    Collect all open debit items of members with direct debit mandate. Returns the direct debit, or None if there
+    were no valid items, and the invalid items with their error.
+    """
+    creditor = get_creditor()
+    direct_debit = None
+    try:
+        with db_transaction.atomic():
+            valid, invalid = validate_items(get_items())
+            if not valid:
+                return None, invalid
+
+            direct_debit = DirectDebit.objects.create(
+                message_id='{}-{}'.format(now().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:12]),
+                collection_date=collection_date,
+                count=len(valid),
+                total=sum((item.amount for item in valid), Decimal(0)),
+            )
+            groups = get_sequence_types(valid)
+            set_direct_debit([item.pk for item in valid], direct_debit, user)
+            write_file(direct_debit, groups, creditor)
+    except Exception:
+        # The file of a rolled back direct debit must not be submitted
+        if direct_debit is not None and os.path.exists(get_direct_debit_filepath(direct_debit)):
+            os.remove(get_direct_debit_filepath(direct_debit))
+        raise
+
+    return direct_debit, invalid
+
+def cancel_direct_debit(direct_debit, user=None):
+    """
+    Release the transactions of a direct debit, which was not submitted, and delete it with its file
+    """
+    with db_transaction.atomic():
+        set_direct_debit(list(direct_debit.transactions.values_list('pk', flat=True)), None, user)
+        direct_debit.delete()
+    if os.path.exists(get_direct_debit_filepath(direct_debit)):
+        os.remove(get_direct_debit_filepath(direct_debit))
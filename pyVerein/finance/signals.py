@@ -0,0 +1,27 @@
+"""
+Signal handlers for finance app
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Transaction, AccountBalance
+
+@receiver(post_save, sender=Transaction)
+def book_transaction_balance(sender, instance, created, **kwargs):
+    """
+    Update account balances with the changes of the saved transaction
+    """
+    state = instance.get_balance_state()
+    previous_state = getattr(instance, '_balance_state', None)
+    if not created and previous_state is not None:
+        if previous_state == state:
+            return
+        AccountBalance.objects.book_states([previous_state], sign=-1)
+    AccountBalance.objects.book_states([state])
+    instance._balance_state = state
+
+@receiver(post_delete, sender=Transaction)
+def unbook_transaction_balance(sender, instance, **kwargs):
+    """
+    Remove the deleted transaction from the account balances
+    """
+    AccountBalance.objects.book_states([getattr(instance, '_balance_state', instance.get_balance_state())], sign=-1)
@@ -0,0 +1,384 @@
+"""
+Import of bank statements in CAMT.053, MT940 and CSV format
+"""
+import csv
+import datetime
+import hashlib
+import io
+import re
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from xml.etree.ElementTree import iterparse
+from django.db import transaction as db_transaction
+from django.utils.translation import ugettext_lazy as _
+from dynamic_preferences.registries import global_preferences_registry
+from members.models import Member
+from utils.models import bulk_create_with_history
+from utils.views import generate_document_numbers, generate_internal_numbers
+from .models import Account, AccountBalance, ImportedStatementLine, Transaction
+
+# Statement formats
+CAMT053 = 'camt053'
+MT940 = 'mt940'
+CSV = 'csv'
+FORMATS = (
+    (CAMT053, _('CAMT.053 (XML)')),
+    (MT940, _('MT940')),
+    (CSV, _('CSV')),
+)
+
+# Maximum number of unmatched lines returned by the import
+UNMATCHED_SHOWN = 500
+
+# Statement line, amount is positive for incoming and negative for outgoing payments
+StatementLine = namedtuple('StatementLine', ['date', 'amount', 'name', 'iban', 'reference', 'text'])
+
+def normalize_iban(iban):
+    return re.sub(r'\s', '', iban or '').upper()
+
+def parse_amount(value):
+    """
+    Returns the decimal of an amount with decimal comma or point
+    """
+    value = value.strip().replace(' ', '').lstrip('+')
+    if ',' in value:
+        value = value.replace('.', '').replace(',', '.')
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(_('Invalid amount: {}').format(value))
+
+def get_local_name(element):
+    return element.tag.rsplit('}', 1)[-1]
+
+def find(element, *path):
+    """
+    Returns the first descendant of element with the given local names, regardless of the XML namespace
+    """
+    for name in path:
+        if element is None:
+            return None
+        element = next((child for child in element if get_local_name(child) == name), None)
+    return element
+
+def find_text(element, *path):
+    element = find(element, *path)
+    if element is None:
+        return ''
+    return ''.join(element.itertext()).strip()
+
+def parse_camt053(file):
+    """
+    Yield the booked lines of a CAMT.053 statement. Entries are removed after parsing, so memory stays bounded.
+    """
+    statement = None
+    for event, element in iterparse(file, events=('start', 'end')):
+        name = get_local_name(element)
+        if event == 'start':
+            if name == 'Stmt':
+                statement = element
+            continue
+        if name != 'Ntry':
+            continue
+
+        # Pending entries are not booked yet
+        if find_text(element, 'Sts') in ('', 'BOOK'):
+            yield from parse_camt053_entry(element)
+        element.clear()
+        if statement is not None:
+            statement.remove(element)
+
+def parse_camt053_entry(entry):
+    """
+    Yield one line per transaction of an entry, batch bookings contain several transactions
+    """
+    sign = -1 if find_text(entry, 'CdtDbtInd') == 'DBIT' else 1
+    date = find_text(entry, 'BookgDt', 'Dt') or find_text(entry, 'BookgDt', 'DtTm')[:10] or find_text(entry, 'ValDt', 'Dt')
+    date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+    entry_details = find(entry, 'NtryDtls')
+    details = [child for child in entry_details if get_local_name(child) == 'TxDtls'] if entry_details is not None else []
+    if len(details) <= 1:
+        amounts = [find_text(entry, 'Amt')]
+    else:
+        amounts = [find_text(detail, 'AmtDtls', 'TxAmt', 'Amt') or find_text(detail, 'Amt') for detail in details]
+    details = details or [None]
+
+    # Counterparty is the debitor of incoming and the creditor of outgoing payments
+    party, party_account = ('Cdtr', 'CdtrAcct') if sign < 0 else ('Dbtr', 'DbtrAcct')
+    for detail, amount in zip(details, amounts):
+        parties = find(detail, 'RltdPties') if detail is not None else None
+        name = find_text(parties, party, 'Nm') or find_text(parties, party, 'Pty', 'Nm')
+        remittance = find(detail, 'RmtInf') if detail is not None else None
+        text = ' '.join(find_text(child) for child in (remittance if remittance is not None else []) if get_local_name(child) == 'Ustrd')
+        yield StatementLine(
+            date=date,
+            amount=sign * parse_amount(amount),
+            name=name,
+            iban=normalize_iban(find_text(parties, party_account, 'Id', 'IBAN')),
+            reference=find_text(detail, 'Refs', 'MndtId') if detail is not None else '',
+            text=text or find_text(entry, 'AddtlNtryInf'),
+        )
+
+# MT940 statement line, e.g. 1901020102CR100,00NTRF
+MT940_LINE_PATTERN = re.compile(r'^(?P<date>\d{6})(?P<entry_date>\d{4})?(?P<mark>R?[CD])[A-Z]?(?P<amount>\d+,\d*)')
+# MT940 information subfield, e.g. ?20SVWZ+Subscription
+MT940_SUBFIELD_PATTERN = re.compile(r'\?(\d\d)')
+# SEPA keyword of the mandate reference
+MANDATE_PATTERN = re.compile(r'MREF\+\s*(\S+)')
+
+def iterate_mt940_fields(lines):
+    """
+    Yield the (tag, value) fields of MT940 lines, joining continuation lines
+    """
+    tag, value = None, []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        match = re.match(r'^:(\w+):(.*)$', line)
+        if match or line.startswith('-'):
+            if tag:
+                yield tag, '\n'.join(value)
+            tag, value = (match.group(1), [match.group(2)]) if match else (None, [])
+        elif tag:
+            value.append(line)
+    if tag:
+        yield tag, '\n'.join(value)
+
+def parse_mt940_information(information):
+    """
+    Returns name, IBAN, mandate reference and text of a :86: field, structured or unstructured
+    """
+    information = information.replace('\n', '')
+    parts = MT940_SUBFIELD_PATTERN.split(information)
+    if len(parts) < 3:
+        return '', '', '', information.strip()
+
+    subfields = {}
+    for code, value in zip(parts[1::2], parts[2::2]):
+        subfields.setdefault(code, []).append(value)
+    text = ''.join(''.join(subfields.get(str(code), [])) for code in list(range(20, 30)) + list(range(60, 64)))
+    mandate = MANDATE_PATTERN.search(text)
+    iban = ''.join(subfields.get('31', []))
+    return (
+        ''.join(subfields.get('32', []) + subfields.get('33', [])).strip(),
+        normalize_iban(iban) if re.match(r'^[A-Za-z]{2}\d\d', iban) else '',
+        mandate.group(1) if mandate else '',
+        text.strip(),
+    )
+
+def parse_mt940(file, encoding='utf-8-sig'):
+    """
+    Yield the lines of a MT940 statement
+    """
+    line = None
+    for tag, value in iterate_mt940_fields(io.TextIOWrapper(file, encoding=encoding, errors='replace')):
+        if tag == '61':
+            if line:
+                yield line
+            match = MT940_LINE_PATTERN.match(value)
+            if not match:
+                raise ValueError(_('Invalid statement line: {}').format(value))
+            # Reversals of credits are debits and vice versa
+            sign = 1 if match.group('mark') in ('C', 'RD') else -1
+            line = StatementLine(
+                date=datetime.datetime.strptime(match.group('date'), '%y%m%d').date(),
+                amount=sign * parse_amount(match.group('amount')),
+                name='', iban='', reference='', text='',
+            )
+        elif tag == '86' and line:
+            name, iban, reference, text = parse_mt940_information(value)
+            yield line._replace(name=name, iban=iban, reference=reference, text=text)
+            line = None
+    if line:
+        yield line
+
+def get_csv_columns():
+    """
+    Returns the CSV column of every statement line field as configured in the preferences, e.g. date=Buchungstag
+    """
+    columns = {}
+    for item in global_preferences_registry.manager()['Finance__csv_columns'].split(','):
+        field, sep, column = item.partition('=')
+        if sep:
+            columns[field.strip()] = column.strip()
+    return columns
+
+def parse_csv(file, encoding='utf-8-sig'):
+    """
+    Yield the lines of a CSV statement with a header row, configured by the preferences
+    """
+    global_preferences = global_preferences_registry.manager()
+    columns = get_csv_columns()
+    if 'date' not in columns or 'amount' not in columns:
+        raise ValueError(_('CSV columns for date and amount are not configured'))
+
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding=encoding, errors='replace', newline=''), delimiter=global_preferences['Finance__csv_delimiter'] or ';')
+    for row in reader:
+        if not row.get(columns['date']):
+            continue
+        try:
+            date = datetime.datetime.strptime(row[columns['date']].strip(), global_preferences['Finance__csv_date_format']).date()
+        except ValueError:
+            raise ValueError(_('Invalid date in line {}').format(reader.line_num))
+        yield StatementLine(
+            date=date,
+            amount=parse_amount(row.get(columns['amount']) or ''),
+            name=(row.get(columns.get('name')) or '').strip(),
+            iban=normalize_iban(row.get(columns.get('iban'))),
+            reference=(row.get(columns.get('reference')) or '').strip(),
+            text=(row.get(columns.get('text')) or '').strip(),
+        )
+
+PARSERS = {
+    CAMT053: lambda file, encoding: parse_camt053(file),
+    MT940: parse_mt940,
+    CSV: parse_csv,
+}
+
+def parse_statement(file, file_format, encoding='utf-8-sig'):
+    """
+    Yield the lines of the statement file in the given format
+    """
+    return PARSERS[file_format](file, encoding)
+
+class CounterpartyIndex:
+    """
+    Lookup of the debitor accounts of members by IBAN and direct debit reference, built with one query per source
+    """
+    def __init__(self):
+        accounts = self.get_member_accounts()
+        self.by_iban = {}
+        self.by_reference = {}
+        for member, iban, reference in Member.objects.values_list('pk', 'iban', 'debit_reference').iterator():
+            account = accounts.get(member)
+            if account is None:
+                continue
+            if iban:
+                self.add(self.by_iban, normalize_iban(iban), account)
+            if reference:
+                self.add(self.by_reference, reference.strip().upper(), account)
+
+    @staticmethod
+    def add(index, key, account):
+        # Keys of several accounts, e.g. the IBAN of a family, are ambiguous
+        index[key] = account if index.get(key, account) == account else None
+
+    @staticmethod
+    def get_member_accounts():
+        """
+        Returns the debitor account of every member, which was billed before, otherwise the debitor account of its subscriptions
+        """
+        accounts = dict(Member.subscription.through.objects.filter(subscription__debitor_account__isnull=False).values_list('member', 'subscription__debitor_account').iterator())
+        billed = Transaction.objects.filter(member__isnull=False, account__account_type=Account.DEBITOR).order_by().values_list('member', 'account').distinct()
+        accounts.update(billed.iterator())
+        return accounts
+
+    def match(self, line):
+        """
+        Returns the account number of the counterparty of line or None
+        """
+        if line.reference and self.by_reference.get(line.reference.upper()):
+            return self.by_reference[line.reference.upper()]
+        for token in re.findall(r'[\w/+.-]+', line.text.upper()):
+            if self.by_reference.get(token):
+                return self.by_reference[token]
+        return self.by_iban.get(line.iban)
+
+def get_line_keys(lines, bank_account):
+    """
+    Yield (key, line) for every line. Identical lines within one statement are counted, so they get different keys.
+    """
+    occurrences = {}
+    for line in lines:
+        data = '|'.join(str(value) for value in (bank_account.pk,) + tuple(line))
+        occurrences[data] = occurrences.get(data, 0) + 1
+        yield hashlib.sha256('{}|{}'.format(data, occurrences[data]).encode('utf8')).hexdigest(), line
+
+class StatementImport:
+    """
+    Posts the lines of a bank statement as receipts between the bank account and the counterparty in chunks
+    """
+    def __init__(self, bank_account, fallback_account=None, user=None, chunk_size=500):
+        self.bank_account = bank_account
+        self.fallback_account = fallback_account
+        self.user = user
+        self.chunk_size = chunk_size
+        accounting_year = global_preferences_registry.manager()['Finance__accounting_year']
+        self.accounting_year = accounting_year if accounting_year else None
+        self.index = CounterpartyIndex()
+        self.imported = 0
+        self.duplicates = 0
+        self.unmatched = 0
+        self.unmatched_lines = []
+
+    def run(self, lines):
+        """
+        Import all lines in one database transaction and return the result
+        """
+        with db_transaction.atomic():
+            chunk = []
+            for key, line in get_line_keys(lines, self.bank_account):
+                if not line.amount:
+                    continue
+                chunk.append((key, line))
+                if len(chunk) == self.chunk_size:
+                    self.post(chunk)
+                    chunk = []
+            self.post(chunk)
+
+        return {
+            'imported': self.imported,
+            'duplicates': self.duplicates,
+            'unmatched': self.unmatched,
+            'unmatched_lines': self.unmatched_lines,
+        }
+
+    def post(self, chunk):
+        """
+        Post the new lines of chunk, which could be matched to a counterparty
+        """
+        existing = set(ImportedStatementLine.objects.filter(key__in=[key for key, line in chunk]).values_list('key', flat=True))
+        receipts = []
+        for key, line in chunk:
+            if key in existing:
+                self.duplicates += 1
+                continue
+            account = self.index.match(line) or (self.fallback_account.pk if self.fallback_account else None)
+            if account is None:
+                self.unmatched += 1
+                if len(self.unmatched_lines) < UNMATCHED_SHOWN:
+                    self.unmatched_lines.append(line)
+                continue
+            receipts.append((key, line, account))
+        if not receipts:
+            return
+
+        document_numbers = generate_document_numbers(len(receipts))
+        internal_numbers = generate_internal_numbers(len(receipts))
+        transactions = []
+        for (key, line, account), document_number, internal_number in zip(receipts, document_numbers, internal_numbers):
+            text = ' - '.join(value for value in (line.name, line.text) if value)[:255] or str(_('Bank statement'))
+            amount = abs(line.amount)
+            incoming = line.amount > 0
+            transactions.append(self.create_transaction(self.bank_account.pk, line.date, text, document_number, internal_number, debit=amount if incoming else None, credit=None if incoming else amount))
+            transactions.append(self.create_transaction(account, line.date, text, document_number, internal_number, debit=None if incoming else amount, credit=amount if incoming else None))
+
+        created = bulk_create_with_history(Transaction, transactions, user=self.user, batch_size=len(transactions), refetch=Transaction.objects.filter(internal_number__in=internal_numbers))
+        AccountBalance.objects.add_transactions(created)
+        ImportedStatementLine.objects.bulk_create([
+            ImportedStatementLine(key=key, internal_number=internal_number)
+            for (key, line, account), internal_number in zip(receipts, internal_numbers)
+        ], batch_size=self.chunk_size)
+        self.imported += len(receipts)
+
+    def create_transaction(self, account, date, text, document_number, internal_number, debit=None, credit=None):
+        return Transaction(
+            account_id=account,
+            date=date,
+            text=text,
+            debit=debit,
+            credit=credit,
+            document_number=document_number,
+            document_number_generated=True,
+            internal_number=internal_number,
+            accounting_year=self.accounting_year,
+        )
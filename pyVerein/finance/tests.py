@@ -1,10 +1,34 @@
 from django.test import TestCase
+from django.db import IntegrityError, transaction as db_transaction
+from unittest import mock
+import io
 from account.models import User
 from django.urls import reverse
 from django.contrib.auth.models import Permission
 from datetime import date
-from .models import Account, CostObject, CostCenter, Transaction, VirtualAccount
+from .models import Account, CostObject, CostCenter, Transaction, VirtualAccount, AccountBalance, NumberSequence, ClearingProposal
+from utils.views import generate_document_number, generate_document_numbers, generate_internal_number, generate_clearing_number
 from dynamic_preferences.registries import global_preferences_registry
+from django.core.management import call_command
+from decimal import Decimal
+from utils.testing import QueryBudgetTestMixin
+from .clearing import clear_transactions, reset_clearing, ClearingError
+from .matching import update_proposals, accept_proposals, reject_proposals
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from tasks.models import Job
+from members.models import Member, Subscription
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .statements import parse_statement, StatementImport, CAMT053, MT940, CSV
+from .trial_balance import get_trial_balance, get_totals
+from .sepa import is_valid_iban, create_direct_debit, cancel_direct_debit, get_direct_debit_filepath, get_direct_debit_dir, write_file, SEPAError, NAMESPACE
+from . import sepa
+from .models import DirectDebit
+from tempfile import mkdtemp
+from shutil import rmtree
+from xml.etree import ElementTree
+import os
+from tasks.jobs import run_next_job
 
 class AccountTestMethods(TestCase):
     def setUp(self):
@@ -621,6 +645,49 @@ class TransactionTestMethods(TestCase):
         response = self.client.get(reverse('finance:transaction_list'))
         self.assertEqual(response.status_code, 200)
   
+    def test_transaction_data_permission(self):
+        "User should only access transaction data api if view permission is set"
+
+        user = User.objects.get(username='temp')
+
+        response = self.client.get(reverse('finance:transaction_data'))
+        self.assertEqual(response.status_code, 403)
+
+        user.user_permissions.add(Permission.objects.get(codename='view_transaction'))
+
+        response = self.client.get(reverse('finance:transaction_data'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_transaction_data_paging(self):
+        "Transaction data api should filter, search and page in the database"
+
+        user = User.objects.get(username='temp')
+        user.user_permissions.add(Permission.objects.get(codename='view_transaction'))
+        debitor = Account.objects.get(number='10000')
+        for i in range(15):
+            Transaction.objects.create(account=debitor, date=date.today(), document_number='2{:04d}'.format(i), text='page', debit=1, internal_number=i + 2, accounting_year=date.today().year)
+
+        response = self.client.get(reverse('finance:transaction_data'), {'draw': 3, 'start': 10, 'length': 10, 'order[0][column]': 1, 'order[0][dir]': 'asc'})
+        data = response.json()
+        self.assertEqual(data['draw'], 3)
+        self.assertEqual(data['recordsTotal'], 15)
+        self.assertEqual(len(data['data']), 5)
+        self.assertEqual(data['data'][0]['document_number'], '20010')
+
+        response = self.client.get(reverse('finance:transaction_data'), {'year': 0, 'search[value]': '12345'})
+        data = response.json()
+        self.assertEqual(data['recordsTotal'], 16)
+        self.assertEqual(data['recordsFiltered'], 1)
+
+        for i in range(100):
+            Transaction.objects.create(account=debitor, date=date.today(), document_number='3{:04d}'.format(i), text='page', debit=1, internal_number=i + 100, accounting_year=date.today().year)
+        for length in (-1, 1000):
+            response = self.client.get(reverse('finance:transaction_data'), {'length': length})
+            self.assertEqual(len(response.json()['data']), 100)
+
+        response = self.client.get(reverse('finance:transaction_data'), {'year': 'x'})
+        self.assertEqual(response.status_code, 400)
+
     def test_transaction_detail_permission(self):
         "User should only access transaction detail if view permission is set"
 
@@ -860,4 +927,822 @@ class VirtualAccountTestMethods(TestCase):
 
         user.user_permissions.add(Permission.objects.get(codename='view_virtualaccount'))
         response = self.client.get(reverse('finance:virtual_account_create'))
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        self.assertEqual(response.status_code, 200)
+
+class AccountBalanceTestMethods(TestCase):
+    def setUp(self):
+        # Create user
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        user.first_name = 'temp_first'
+        user.last_name = 'temp_last'
+        user.save()
+
+        # login with user
+        self.client.login(username='temp', password='temppass')
+
+        # Create accounts
+        Account.objects.create(number='10000', name='TempDebitor', account_type=Account.DEBITOR)
+        Account.objects.create(number='40000', name='TempIncome', account_type=Account.INCOME)
+
+        global_preferences_registry.manager()['Finance__accounting_year'] = str(date.today().year)
+
+        Transaction.objects.create(account_id='10000', date=date.today(), document_number='1', text='document', debit=100, internal_number=1, accounting_year=2018)
+        Transaction.objects.create(account_id='40000', date=date.today(), document_number='1', text='document', credit=100, internal_number=1, accounting_year=2018)
+        Transaction.objects.create(account_id='10000', date=date.today(), document_number='2', text='document', debit=23.45, internal_number=2, accounting_year=2019)
+        Transaction.objects.create(account_id='40000', date=date.today(), document_number='2', text='document', credit=23.45, internal_number=2, accounting_year=2019)
+
+    def test_balance_booked_on_save(self):
+        "Balances should be updated when transactions are created, changed and deleted"
+
+        self.assertEqual(AccountBalance.objects.totals('10000'), (Decimal('123.45'), Decimal(0)))
+        self.assertEqual(AccountBalance.objects.totals('40000', accounting_year=2019), (Decimal(0), Decimal('23.45')))
+
+        transaction = Transaction.objects.get(account='10000', accounting_year=2019)
+        transaction.debit = Decimal('30.00')
+        transaction.save()
+        self.assertEqual(AccountBalance.objects.totals('10000', accounting_year=2019), (Decimal('30.00'), Decimal(0)))
+
+        transaction.delete()
+        self.assertEqual(AccountBalance.objects.totals('10000'), (Decimal('100.00'), Decimal(0)))
+        self.assertEqual(AccountBalance.objects.verify(), [])
+
+    def test_balance_booked_after_refresh(self):
+        "Balances should stay correct for instances, which were reloaded or saved several times"
+
+        transaction = Transaction.objects.get(account='10000', accounting_year=2019)
+        Transaction.objects.filter(pk=transaction.pk).update(debit=Decimal('50.00'))
+        AccountBalance.objects.rebuild()
+        transaction.refresh_from_db()
+        transaction.debit = Decimal('30.00')
+        transaction.save()
+        transaction.debit = Decimal('40.00')
+        transaction.save()
+        self.assertEqual(AccountBalance.objects.totals('10000', accounting_year=2019), (Decimal('40.00'), Decimal(0)))
+
+        Transaction.objects.filter(pk=transaction.pk).update(credit=Decimal('5.00'))
+        AccountBalance.objects.rebuild()
+        transaction.refresh_from_db(fields=['credit'])
+        transaction.accounting_year = 2018
+        transaction.save()
+        self.assertEqual(AccountBalance.objects.verify(), [])
+
+    def test_balance_booked_on_clearing(self):
+        "Cleared transactions should be moved to the cleared balance"
+
+        transaction = Transaction.objects.get(account='10000', accounting_year=2018)
+        transaction.clearing_number = 1
+        transaction.save()
+
+        self.assertEqual(AccountBalance.objects.totals('10000', cleared=False), (Decimal('23.45'), Decimal(0)))
+        self.assertEqual(AccountBalance.objects.totals('10000', cleared=True), (Decimal('100.00'), Decimal(0)))
+        self.assertEqual(AccountBalance.objects.verify(), [])
+
+    def test_balance_booked_on_reset(self):
+        "Resetting a receipt should balance the accounts"
+
+        user = User.objects.get(username='temp')
+        user.user_permissions.add(Permission.objects.get(codename='view_transaction'))
+        user.user_permissions.add(Permission.objects.get(codename='add_transaction'))
+        user.user_permissions.add(Permission.objects.get(codename='change_transaction'))
+
+        self.client.get(reverse('finance:transaction_reset', args={1}))
+
+        self.assertEqual(AccountBalance.objects.totals('10000', accounting_year=2018), (Decimal('100.00'), Decimal('100.00')))
+        self.assertEqual(AccountBalance.objects.verify(), [])
+
+    def test_debitor_detail_sums(self):
+        "Debitor detail should show the sums from the balances"
+
+        user = User.objects.get(username='temp')
+        user.user_permissions.add(Permission.objects.get(codename='view_debitor'))
+
+        response = self.client.get(reverse('finance:debitor_detail', args={'10000'}))
+        self.assertEqual(response.context['debit_sum'], Decimal('123.45'))
+        self.assertEqual(response.context['saldo'], Decimal('123.45'))
+
+    def test_rebuild_balances(self):
+        "Rebuild command should restore damaged balances"
+
+        AccountBalance.objects.filter(account='10000').update(debit=0)
+        self.assertEqual(len(AccountBalance.objects.verify()), 2)
+
+        call_command('rebuild_balances', stdout=io.StringIO())
+        self.assertEqual(AccountBalance.objects.verify(), [])
+        self.assertEqual(AccountBalance.objects.totals('10000'), (Decimal('123.45'), Decimal(0)))
+
+class NumberSequenceTestMethods(TestCase):
+    def setUp(self):
+        global_preferences_registry.manager()['Finance__accounting_year'] = '2019'
+
+        account = Account.objects.create(number='10000', name='TempDebitor', account_type=Account.DEBITOR)
+        Transaction.objects.create(account=account, date=date.today(), document_number='1900041', document_number_generated=True, text='document', debit=1, internal_number=7, clearing_number=3, accounting_year=2019)
+        # Global sequences are created by the migrations, missing sequences are seeded from the transactions
+        NumberSequence.objects.filter(accounting_year=NumberSequence.GLOBAL).delete()
+
+    def test_sequences_seeded_from_transactions(self):
+        "New sequences should continue after the numbers already used"
+
+        self.assertEqual(generate_document_number(), '1900042')
+        self.assertEqual(generate_internal_number(), 8)
+        self.assertEqual(generate_clearing_number(), 4)
+
+    def test_sequences_are_gap_free(self):
+        "Sequences should hand out consecutive numbers and reserve blocks"
+
+        self.assertEqual(generate_document_numbers(3), ['1900042', '1900043', '1900044'])
+        self.assertEqual(generate_document_number(), '1900045')
+        self.assertEqual(NumberSequence.objects.reserve(NumberSequence.INTERNAL, count=10), 8)
+        self.assertEqual(generate_internal_number(), 18)
+
+    def test_global_sequences_are_unique(self):
+        "Internal and clearing number sequences should exist once, so concurrent first use can not create them twice"
+
+        generate_internal_number()
+        with self.assertRaises(IntegrityError):
+            with db_transaction.atomic():
+                NumberSequence.objects.create(name=NumberSequence.INTERNAL, accounting_year=NumberSequence.GLOBAL)
+
+    def test_sequences_per_accounting_year(self):
+        "Document numbers should restart for a new accounting year"
+
+        global_preferences_registry.manager()['Finance__accounting_year'] = '2020'
+        self.assertEqual(generate_document_number(), '2000001')
+
+class QueryBudgetTestMethods(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        # Create user
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        user.first_name = 'temp_first'
+        user.last_name = 'temp_last'
+        user.save()
+        for codename in ['view_creditor', 'view_debitor', 'view_impersonal', 'view_transaction']:
+            user.user_permissions.add(Permission.objects.get(codename=codename))
+
+        # login with user
+        self.client.login(username='temp', password='temppass')
+
+        global_preferences_registry.manager()['Finance__accounting_year'] = '2019'
+
+        self.creditor = Account.objects.create(number='70000', name='Creditor', account_type=Account.CREDITOR)
+        self.debitor = Account.objects.create(number='10000', name='Debitor', account_type=Account.DEBITOR)
+        self.impersonal = Account.objects.create(number='40000', name='Income', account_type=Account.INCOME)
+        cost_center = CostCenter.objects.create(number='100', name='Center')
+        cost_object = CostObject.objects.create(number='200', name='Object')
+        for i in range(20):
+            Transaction.objects.create(account=self.debitor, date=date(2019, 1, 1), text='Claim', debit=Decimal(i), internal_number=1, accounting_year=2019)
+            Transaction.objects.create(account=self.impersonal, date=date(2019, 1, 1), text='Claim', credit=Decimal(i), cost_center=cost_center, cost_object=cost_object, internal_number=1, accounting_year=2019)
+            Transaction.objects.create(account=self.creditor, date=date(2019, 1, 1), text='Liability', credit=Decimal(i), internal_number=2, accounting_year=2019)
+
+    def test_account_query_budgets(self):
+        "Account views should stay within their query budget"
+
+        self.assertQueryBudget('finance:creditor_list')
+        self.assertQueryBudget('finance:creditor_detail', kwargs={'pk': self.creditor.pk})
+        self.assertQueryBudget('finance:debitor_list')
+        self.assertQueryBudget('finance:debitor_detail', kwargs={'pk': self.debitor.pk})
+        self.assertQueryBudget('finance:impersonal_list')
+        self.assertQueryBudget('finance:impersonal_detail', kwargs={'pk': self.impersonal.pk})
+
+    def test_transaction_query_budgets(self):
+        "Transaction views should stay within their query budget"
+
+        self.assertQueryBudget('finance:transaction_list')
+        self.assertQueryBudget('finance:transaction_data', data={'draw': 1, 'start': 0, 'length': 10})
+        response = self.assertQueryBudget('finance:transaction_detail', kwargs={'internal_number': 1})
+        self.assertEqual(response.status_code, 200)
+
+class ClearingTestMethods(TestCase):
+    def setUp(self):
+        # Create user
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        user.first_name = 'temp_first'
+        user.last_name = 'temp_last'
+        user.save()
+        for codename in ['view_transaction', 'add_transaction', 'change_transaction']:
+            user.user_permissions.add(Permission.objects.get(codename=codename))
+        self.user = user
+
+        # login with user
+        self.client.login(username='temp', password='temppass')
+
+        self.debitor = Account.objects.create(number='10000', name='Debitor', account_type=Account.DEBITOR)
+        self.income = Account.objects.create(number='40000', name='Income', account_type=Account.INCOME)
+        self.claim = Transaction.objects.create(account=self.debitor, date=date(2019, 1, 1), text='Claim', debit=Decimal('30.00'), internal_number=1, accounting_year=2019)
+        self.payment = Transaction.objects.create(account=self.debitor, date=date(2019, 1, 2), text='Payment', credit=Decimal('30.00'), internal_number=2, accounting_year=2019)
+        self.revenue = Transaction.objects.create(account=self.income, date=date(2019, 1, 1), text='Claim', credit=Decimal('30.00'), internal_number=1, accounting_year=2019)
+
+    def test_clear_transactions(self):
+        "Balanced open items should be cleared with one clearing number"
+
+        clearing_number = clear_transactions([self.claim.pk, str(self.payment.pk)], user=self.user)
+
+        self.assertEqual(Transaction.objects.filter(clearing_number=clearing_number).count(), 2)
+        self.assertEqual(AccountBalance.objects.verify(), [])
+        self.assertEqual(AccountBalance.objects.totals('10000', cleared=True), (Decimal('30.00'), Decimal('30.00')))
+        self.assertEqual(AccountBalance.objects.totals('10000', cleared=False), (Decimal(0), Decimal(0)))
+        history = self.claim.history.first()
+        self.assertEqual(history.clearing_number, clearing_number)
+        self.assertEqual(history.history_type, '~')
+        self.assertEqual(history.history_user, self.user)
+
+    def test_clear_transactions_rejected(self):
+        "Unbalanced, foreign, cleared or unknown items should not be cleared"
+
+        with self.assertRaises(ClearingError):
+            clear_transactions([self.claim.pk])
+        with self.assertRaises(ClearingError):
+            clear_transactions([self.claim.pk, self.revenue.pk])
+        with self.assertRaises(ClearingError):
+            clear_transactions([self.claim.pk, 0])
+        with self.assertRaises(ClearingError):
+            clear_transactions(['x'])
+        clear_transactions([self.claim.pk, self.payment.pk])
+        with self.assertRaises(ClearingError):
+            clear_transactions([self.claim.pk, self.payment.pk])
+
+        self.assertEqual(Transaction.objects.filter(clearing_number__isnull=False).count(), 2)
+
+    def test_reset_clearing(self):
+        "Reset should open all items of the clearing again"
+
+        clearing_number = clear_transactions([self.claim.pk, self.payment.pk])
+
+        self.assertEqual(reset_clearing(clearing_number, user=self.user), 2)
+        self.assertFalse(Transaction.objects.filter(clearing_number__isnull=False).exists())
+        self.assertEqual(AccountBalance.objects.verify(), [])
+        self.assertEqual(self.payment.history.count(), 3)
+
+    def test_clear_transactions_query_count(self):
+        "Clearing should not query per transaction"
+
+        def create_items(count):
+            pks = []
+            for i in range(count):
+                pks.append(Transaction.objects.create(account=self.debitor, date=date(2019, 1, 1), text='Claim', debit=Decimal(1), internal_number=3, accounting_year=2019).pk)
+                pks.append(Transaction.objects.create(account=self.debitor, date=date(2019, 1, 1), text='Payment', credit=Decimal(1), internal_number=3, accounting_year=2019).pk)
+            return pks
+
+        # Seed the clearing number sequence
+        clear_transactions([self.claim.pk, self.payment.pk])
+        few_items = create_items(2)
+        many_items = create_items(20)
+        with CaptureQueriesContext(connection) as few:
+            clear_transactions(few_items)
+        with CaptureQueriesContext(connection) as many:
+            clear_transactions(many_items)
+        self.assertEqual(len(many), len(few))
+
+    def test_clear_views(self):
+        "Clearing views should clear balanced items and report errors"
+
+        response = self.client.post(reverse('finance:clear_transactions'), {'transactions[]': [self.claim.pk]})
+        self.assertFalse(response.json()['success'])
+        self.assertFalse(Transaction.objects.filter(clearing_number__isnull=False).exists())
+
+        response = self.client.post(reverse('finance:clear_transactions'), {'transactions[]': [self.claim.pk, self.payment.pk]})
+        self.assertTrue(response.json()['success'])
+        self.claim.refresh_from_db()
+        self.assertIsNotNone(self.claim.clearing_number)
+
+        response = self.client.post(reverse('finance:reset_cleared_transactions'), {'clearing_number': self.claim.clearing_number})
+        self.assertTrue(response.json()['success'])
+        self.assertFalse(Transaction.objects.filter(clearing_number__isnull=False).exists())
+
+class MatchingTestMethods(TestCase):
+    def setUp(self):
+        # Create user
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        user.first_name = 'temp_first'
+        user.last_name = 'temp_last'
+        user.save()
+        for codename in ['view_transaction', 'add_transaction', 'change_transaction']:
+            user.user_permissions.add(Permission.objects.get(codename=codename))
+
+        # login with user
+        self.client.login(username='temp', password='temppass')
+
+        self.debitor = Account.objects.create(number='10000', name='Debitor', account_type=Account.DEBITOR)
+        self.creditor = Account.objects.create(number='70000', name='Creditor', account_type=Account.CREDITOR)
+        self.income = Account.objects.create(number='40000', name='Income', account_type=Account.INCOME)
+
+    def create(self, account, debit=None, credit=None, document_number=None):
+        return Transaction.objects.create(account=account, date=date(2019, 1, 1), text='Item', document_number=document_number, debit=debit, credit=credit, accounting_year=2019).pk
+
+    def get_proposals(self):
+        return {proposal.key: proposal.rule for proposal in ClearingProposal.objects.filter(state=ClearingProposal.OPEN)}
+
+    def test_match_rules(self):
+        "Documents, equal amounts and sums of amounts should be proposed"
+
+        document = [self.create(self.debitor, debit=Decimal('10.00'), document_number='1900001'), self.create(self.debitor, credit=Decimal('10.00'), document_number='1900001')]
+        pair = [self.create(self.debitor, debit=Decimal('25.00')), self.create(self.debitor, credit=Decimal('25.00'))]
+        subset = [self.create(self.debitor, debit=Decimal('30.00')), self.create(self.debitor, debit=Decimal('12.50')), self.create(self.debitor, credit=Decimal('42.50'))]
+        creditor = [self.create(self.creditor, credit=Decimal('5.00')), self.create(self.creditor, debit=Decimal('5.00'))]
+        self.create(self.debitor, debit=Decimal('99.00'))
+        self.create(self.income, credit=Decimal('10.00'))
+
+        self.assertEqual(update_proposals(), 4)
+        self.assertEqual(self.get_proposals(), {
+            ClearingProposal.get_key(document): ClearingProposal.DOCUMENT,
+            ClearingProposal.get_key(pair): ClearingProposal.PAIR,
+            ClearingProposal.get_key(subset): ClearingProposal.SUBSET,
+            ClearingProposal.get_key(creditor): ClearingProposal.PAIR,
+        })
+        proposal = ClearingProposal.objects.get(key=ClearingProposal.get_key(subset))
+        self.assertEqual(sorted(proposal.transactions.values_list('pk', flat=True)), sorted(subset))
+
+    def test_accept_and_reject(self):
+        "Accepted proposals should be cleared and rejected proposals not proposed again"
+
+        pair = [self.create(self.debitor, debit=Decimal('25.00')), self.create(self.debitor, credit=Decimal('25.00'))]
+        other = [self.create(self.debitor, debit=Decimal('7.00')), self.create(self.debitor, credit=Decimal('7.00'))]
+        update_proposals()
+
+        reject_proposals([ClearingProposal.objects.get(key=ClearingProposal.get_key(other)).pk])
+        self.assertEqual(accept_proposals([ClearingProposal.objects.get(key=ClearingProposal.get_key(pair)).pk]), (1, 0))
+        self.assertEqual(Transaction.objects.filter(pk__in=pair, clearing_number__isnull=False).count(), 2)
+        self.assertEqual(AccountBalance.objects.verify(), [])
+
+        self.assertEqual(update_proposals(), 0)
+        self.assertEqual(ClearingProposal.objects.filter(state=ClearingProposal.REJECTED).count(), 1)
+
+    def test_stale_proposal(self):
+        "Proposals of changed items should be dropped on accept"
+
+        pair = [self.create(self.debitor, debit=Decimal('25.00')), self.create(self.debitor, credit=Decimal('25.00'))]
+        update_proposals()
+        clear_transactions(pair)
+
+        self.assertEqual(accept_proposals(ClearingProposal.objects.values_list('pk', flat=True)), (0, 1))
+        self.assertFalse(ClearingProposal.objects.exists())
+
+    def test_match_query_count(self):
+        "Matching should not query per account or item"
+
+        def create_pairs(count):
+            for i in range(count):
+                account = Account.objects.create(number=str(11000 + Account.objects.count()), name='Debitor', account_type=Account.DEBITOR)
+                self.create(account, debit=Decimal(i + 1))
+                self.create(account, credit=Decimal(i + 1))
+
+        # Both runs replace existing proposals
+        create_pairs(2)
+        update_proposals()
+        with CaptureQueriesContext(connection) as few:
+            update_proposals()
+        create_pairs(20)
+        update_proposals()
+        with CaptureQueriesContext(connection) as many:
+            update_proposals()
+        self.assertEqual(len(many), len(few))
+
+    def test_proposal_views(self):
+        "Proposal views should start matching and update the selected proposals"
+
+        pair = [self.create(self.debitor, debit=Decimal('25.00')), self.create(self.debitor, credit=Decimal('25.00'))]
+
+        response = self.client.post(reverse('finance:clearing_match'))
+        self.assertRedirects(response, reverse('finance:clearing_proposals'), fetch_redirect_response=False)
+        self.assertTrue(Job.objects.filter(name='match_open_items').exists())
+        run_next_job()
+
+        response = self.client.get(reverse('finance:clearing_proposals'))
+        self.assertEqual(len(response.context['proposals']), 1)
+
+        proposal = ClearingProposal.objects.get()
+        response = self.client.post(reverse('finance:clearing_proposals_update'), {'proposals': [proposal.pk], 'action': 'accept'})
+        self.assertRedirects(response, reverse('finance:clearing_proposals'), fetch_redirect_response=False)
+        self.assertEqual(Transaction.objects.filter(pk__in=pair, clearing_number__isnull=False).count(), 2)
+
+        response = self.client.post(reverse('finance:clearing_proposals_update'), {'proposals': ['x'], 'action': 'accept'})
+        self.assertEqual(response.status_code, 400)
+
+CAMT053_STATEMENT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02">
+  <BkToCstmrStmt>
+    <Stmt>
+      <Ntry>
+        <Amt Ccy="EUR">30.00</Amt>
+        <CdtDbtInd>CRDT</CdtDbtInd>
+        <Sts>BOOK</Sts>
+        <BookgDt><Dt>2019-01-02</Dt></BookgDt>
+        <NtryDtls>
+          <TxDtls>
+            <Refs><MndtId>MANDATE-1</MndtId></Refs>
+            <RltdPties>
+              <Dbtr><Nm>Max Mustermann</Nm></Dbtr>
+              <DbtrAcct><Id><IBAN>DE89370400440532013000</IBAN></Id></DbtrAcct>
+            </RltdPties>
+            <RmtInf><Ustrd>Subscription 2019</Ustrd></RmtInf>
+          </TxDtls>
+        </NtryDtls>
+      </Ntry>
+      <Ntry>
+        <Amt Ccy="EUR">12.50</Amt>
+        <CdtDbtInd>DBIT</CdtDbtInd>
+        <Sts>BOOK</Sts>
+        <BookgDt><Dt>2019-01-03</Dt></BookgDt>
+        <NtryDtls>
+          <TxDtls>
+            <RltdPties>
+              <Cdtr><Nm>Hardware store</Nm></Cdtr>
+              <CdtrAcct><Id><IBAN>DE02120300000000202051</IBAN></Id></CdtrAcct>
+            </RltdPties>
+            <RmtInf><Ustrd>Invoice 4711</Ustrd></RmtInf>
+          </TxDtls>
+        </NtryDtls>
+      </Ntry>
+      <Ntry>
+        <Amt Ccy="EUR">99.00</Amt>
+        <CdtDbtInd>CRDT</CdtDbtInd>
+        <Sts>PDNG</Sts>
+        <BookgDt><Dt>2019-01-04</Dt></BookgDt>
+      </Ntry>
+    </Stmt>
+  </BkToCstmrStmt>
+</Document>
+"""
+
+MT940_STATEMENT = b""":20:STARTUMSE
+:25:10020030/1234567
+:28C:00001/001
+:60F:C190101EUR1000,00
+:61:1901020102CR30,00NTRFNONREF
+:86:166?00GUTSCHRIFT?20EREF+NOTPROVIDED?21SVWZ+Subscription 2019?31DE89 3704 0044 0532 0130
+00?32Max Mustermann
+:61:1901030103DR12,50NTRFNONREF
+:86:Invoice 4711
+:62F:C190103EUR1017,50
+-
+"""
+
+CSV_STATEMENT = """Buchungstag;Betrag;Beguenstigter/Zahlungspflichtiger;Kontonummer/IBAN;Mandatsreferenz;Verwendungszweck
+02.01.2019;30,00;Max Mustermann;;MANDATE-1;Subscription 2019
+03.01.2019;-1.012,50;Hardware store;DE02120300000000202051;;Invoice 4711
+""".encode('cp1252')
+
+class StatementTestMethods(TestCase):
+    def setUp(self):
+        # Create user
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        user.first_name = 'temp_first'
+        user.last_name = 'temp_last'
+        user.save()
+        for codename in ['view_transaction', 'add_transaction']:
+            user.user_permissions.add(Permission.objects.get(codename=codename))
+        self.user = user
+
+        # login with user
+        self.client.login(username='temp', password='temppass')
+
+        global_preferences_registry.manager()['Finance__accounting_year'] = '2019'
+
+        self.bank = Account.objects.create(number='18000', name='Bank', account_type=Account.ASSET)
+        self.debitor = Account.objects.create(number='10000', name='Debitor', account_type=Account.DEBITOR)
+        self.creditor = Account.objects.create(number='70000', name='Creditor', account_type=Account.CREDITOR)
+        subscription = Subscription.objects.create(name='Subscription', amount=30, debitor_account=self.debitor)
+        member = Member.objects.create(first_name='Max', last_name='Mustermann', iban='DE89 3704 0044 0532 0130 00', debit_reference='MANDATE-1')
+        member.subscription.add(subscription)
+
+    def test_parse_camt053(self):
+        "CAMT.053 entries should be parsed with counterparty and booking direction"
+
+        lines = list(parse_statement(io.BytesIO(CAMT053_STATEMENT), CAMT053))
+
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0].date, date(2019, 1, 2))
+        self.assertEqual(lines[0].amount, Decimal('30.00'))
+        self.assertEqual(lines[0].name, 'Max Mustermann')
+        self.assertEqual(lines[0].iban, 'DE89370400440532013000')
+        self.assertEqual(lines[0].reference, 'MANDATE-1')
+        self.assertEqual(lines[0].text, 'Subscription 2019')
+        self.assertEqual(lines[1].amount, Decimal('-12.50'))
+        self.assertEqual(lines[1].name, 'Hardware store')
+
+    def test_parse_mt940(self):
+        "MT940 lines should be parsed with structured information"
+
+        lines = list(parse_statement(io.BytesIO(MT940_STATEMENT), MT940))
+
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0].amount, Decimal('30.00'))
+        self.assertEqual(lines[0].iban, 'DE89370400440532013000')
+        self.assertEqual(lines[0].name, 'Max Mustermann')
+        self.assertEqual(lines[0].text, 'EREF+NOTPROVIDEDSVWZ+Subscription 2019')
+        self.assertEqual(lines[1].date, date(2019, 1, 3))
+        self.assertEqual(lines[1].amount, Decimal('-12.50'))
+        self.assertEqual(lines[1].text, 'Invoice 4711')
+
+    def test_parse_csv(self):
+        "CSV lines should be parsed with the configured columns"
+
+        lines = list(parse_statement(io.BytesIO(CSV_STATEMENT), CSV, 'cp1252'))
+
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0].reference, 'MANDATE-1')
+        self.assertEqual(lines[1].amount, Decimal('-1012.50'))
+        self.assertEqual(lines[1].iban, 'DE02120300000000202051')
+
+    def test_import_statement(self):
+        "Matched lines should be posted as balanced receipts once"
+
+        result = StatementImport(self.bank, user=self.user).run(parse_statement(io.BytesIO(CAMT053_STATEMENT), CAMT053))
+
+        self.assertEqual((result['imported'], result['duplicates'], result['unmatched']), (1, 0, 1))
+        self.assertEqual(result['unmatched_lines'][0].name, 'Hardware store')
+        self.assertEqual(AccountBalance.objects.totals('18000'), (Decimal('30.00'), Decimal(0)))
+        self.assertEqual(AccountBalance.objects.totals('10000'), (Decimal(0), Decimal('30.00')))
+        self.assertEqual(AccountBalance.objects.verify(), [])
+        receipt = Transaction.objects.filter(account=self.debitor)
+        self.assertEqual(receipt.get().text, 'Max Mustermann - Subscription 2019')
+        self.assertEqual(receipt.get().history.count(), 1)
+
+        result = StatementImport(self.bank, fallback_account=self.creditor, user=self.user).run(parse_statement(io.BytesIO(CAMT053_STATEMENT), CAMT053))
+
+        self.assertEqual((result['imported'], result['duplicates'], result['unmatched']), (1, 1, 0))
+        self.assertEqual(AccountBalance.objects.totals('70000'), (Decimal('12.50'), Decimal(0)))
+        self.assertEqual(Transaction.objects.count(), 4)
+
+    def test_import_query_count(self):
+        "Import should not query per line"
+
+        def get_statement(count, offset):
+            lines = ['Buchungstag;Betrag;Beguenstigter/Zahlungspflichtiger;Kontonummer/IBAN;Mandatsreferenz;Verwendungszweck']
+            lines += ['02.01.2019;{},00;Max Mustermann;DE89370400440532013000;;Line {}'.format(i + 1, i) for i in range(offset, offset + count)]
+            return io.BytesIO('\n'.join(lines).encode('utf8'))
+
+        # Seed the number sequences
+        StatementImport(self.bank).run(parse_statement(get_statement(1, 0), CSV))
+        with CaptureQueriesContext(connection) as queries:
+            StatementImport(self.bank).run(parse_statement(get_statement(100, 1), CSV))
+        # Only the inserts are split into batches by the database limits
+        self.assertLess(len(queries), 40)
+        self.assertEqual(Transaction.objects.filter(account=self.bank).count(), 101)
+
+    def test_import_view(self):
+        "Import view should post the uploaded statement and report errors"
+
+        response = self.client.get(reverse('finance:transaction_import'))
+        self.assertEqual(response.status_code, 200)
+
+        statement = SimpleUploadedFile('statement.sta', MT940_STATEMENT)
+        response = self.client.post(reverse('finance:transaction_import'), {'statement': statement, 'file_format': MT940, 'encoding': 'utf-8-sig', 'bank_account': self.bank.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result']['imported'], 1)
+        self.assertEqual(Transaction.objects.filter(account=self.debitor).count(), 1)
+
+        statement = SimpleUploadedFile('statement.xml', b'<Document>')
+        response = self.client.post(reverse('finance:transaction_import'), {'statement': statement, 'file_format': CAMT053, 'encoding': 'utf-8-sig', 'bank_account': self.bank.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('result', response.context)
+
+class DirectDebitTestMethods(TestCase):
+    def setUp(self):
+        # Create user
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        user.first_name = 'temp_first'
+        user.last_name = 'temp_last'
+        user.save()
+        for codename in ['view_directdebit', 'add_directdebit', 'delete_directdebit']:
+            user.user_permissions.add(Permission.objects.get(codename=codename))
+        self.user = user
+
+        # login with user
+        self.client.login(username='temp', password='temppass')
+
+        self.temp_dir = mkdtemp()
+        global_preferences = global_preferences_registry.manager()
+        global_preferences['Finance__sepa_creditor_name'] = 'Club & Co'
+        global_preferences['Finance__sepa_creditor_id'] = 'DE98ZZZ09999999999'
+        global_preferences['Finance__sepa_creditor_iban'] = 'DE02 1203 0000 0000 2020 51'
+        global_preferences['Finance__sepa_creditor_bic'] = ''
+
+        self.debitor = Account.objects.create(number='10000', name='Debitor', account_type=Account.DEBITOR)
+        self.member = Member.objects.create(first_name='Max', last_name='Mustermann', payment_method=Member.DEBIT, iban='DE89 3704 0044 0532 0130 00', bic='COBADEFFXXX', debit_reference='MANDATE-1', debit_mandate_at=date(2018, 1, 1))
+        invalid = Member.objects.create(first_name='Erika', last_name='Mustermann', payment_method=Member.DEBIT, iban='DE89370400440532013001', debit_reference='MANDATE-2', debit_mandate_at=date(2018, 1, 1))
+        remitter = Member.objects.create(first_name='Hans', last_name='Mustermann', payment_method=Member.REMITTANCE)
+        self.claim = Transaction.objects.create(account=self.debitor, date=date(2019, 1, 1), text='Subscription', document_number='1900001', debit=Decimal('30.00'), member=self.member, accounting_year=2019)
+        Transaction.objects.create(account=self.debitor, date=date(2019, 1, 1), text='Subscription', document_number='1900002', debit=Decimal('30.00'), member=invalid, accounting_year=2019)
+        Transaction.objects.create(account=self.debitor, date=date(2019, 1, 1), text='Subscription', document_number='1900003', debit=Decimal('30.00'), member=remitter, accounting_year=2019)
+        Transaction.objects.create(account=self.debitor, date=date(2019, 1, 1), text='Paid', document_number='1900004', debit=Decimal('30.00'), member=self.member, clearing_number=1, accounting_year=2019)
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def test_is_valid_iban(self):
+        "IBAN checksums should be validated"
+
+        self.assertTrue(is_valid_iban('DE89 3704 0044 0532 0130 00'))
+        self.assertTrue(is_valid_iban('GB82WEST12345698765432'))
+        self.assertFalse(is_valid_iban('DE89370400440532013001'))
+        self.assertFalse(is_valid_iban('DE89'))
+        self.assertFalse(is_valid_iban(None))
+
+    def test_create_direct_debit(self):
+        "Open items of members with valid mandate should be collected once"
+
+        with self.settings(MEDIA_ROOT=self.temp_dir):
+            direct_debit, invalid = create_direct_debit(date(2019, 2, 1), user=self.user)
+
+            self.assertEqual((direct_debit.count, direct_debit.total), (1, Decimal('30.00')))
+            self.assertEqual([item.document_number for item, error in invalid], ['1900002'])
+            self.claim.refresh_from_db()
+            self.assertEqual(self.claim.direct_debit, direct_debit)
+            self.assertEqual(self.claim.history.first().history_user, self.user)
+
+            namespaces = {'p': NAMESPACE}
+            document = ElementTree.parse(get_direct_debit_filepath(direct_debit))
+            self.assertEqual(document.findtext('p:CstmrDrctDbtInitn/p:GrpHdr/p:CtrlSum', namespaces=namespaces), '30.00')
+            self.assertEqual(document.findtext('p:CstmrDrctDbtInitn/p:GrpHdr/p:InitgPty/p:Nm', namespaces=namespaces), 'Club & Co')
+            self.assertEqual(document.findtext('.//p:SeqTp', namespaces=namespaces), 'FRST')
+            self.assertEqual(document.findtext('.//p:ReqdColltnDt', namespaces=namespaces), '2019-02-01')
+            self.assertEqual(document.findtext('.//p:DrctDbtTxInf/p:PmtId/p:EndToEndId', namespaces=namespaces), '1900001')
+            self.assertEqual(document.findtext('.//p:DrctDbtTxInf//p:MndtId', namespaces=namespaces), 'MANDATE-1')
+            self.assertEqual(document.findtext('.//p:DrctDbtTxInf/p:DbtrAcct/p:Id/p:IBAN', namespaces=namespaces), 'DE89370400440532013000')
+
+            self.assertEqual(create_direct_debit(date(2019, 2, 1))[0], None)
+
+            # Next collection of the member is recurring
+            Transaction.objects.create(account=self.debitor, date=date(2019, 2, 1), text='Subscription', document_number='1900005', debit=Decimal('30.00'), member=self.member, accounting_year=2019)
+            direct_debit, invalid = create_direct_debit(date(2019, 3, 1))
+            document = ElementTree.parse(get_direct_debit_filepath(direct_debit))
+            self.assertEqual(document.findtext('.//p:SeqTp', namespaces=namespaces), 'RCUR')
+
+    def test_direct_debit_concurrent_clearing(self):
+        "Items cleared after they were read should not be collected and no file should be left"
+
+        get_items = sepa.get_items
+
+        def get_cleared_items():
+            items = get_items()
+            Transaction.objects.filter(pk=self.claim.pk).update(clearing_number=2)
+            return items
+
+        def write_failing_file(direct_debit, groups, creditor):
+            write_file(direct_debit, groups, creditor)
+            raise OSError('Disk full')
+
+        with self.settings(MEDIA_ROOT=self.temp_dir):
+            with mock.patch('finance.sepa.get_items', get_cleared_items):
+                with self.assertRaises(SEPAError):
+                    create_direct_debit(date(2019, 2, 1))
+            self.assertFalse(DirectDebit.objects.exists())
+
+            Transaction.objects.filter(pk=self.claim.pk).update(clearing_number=None)
+            with mock.patch('finance.sepa.write_file', write_failing_file):
+                with self.assertRaises(OSError):
+                    create_direct_debit(date(2019, 2, 1))
+            self.assertFalse(DirectDebit.objects.exists())
+            self.assertEqual(os.listdir(get_direct_debit_dir()), [])
+
+    def test_cancel_direct_debit(self):
+        "Canceled direct debits should release their items"
+
+        with self.settings(MEDIA_ROOT=self.temp_dir):
+            direct_debit, invalid = create_direct_debit(date(2019, 2, 1))
+            filepath = get_direct_debit_filepath(direct_debit)
+            cancel_direct_debit(direct_debit)
+
+            self.assertFalse(os.path.exists(filepath))
+            self.assertFalse(DirectDebit.objects.exists())
+            self.assertFalse(Transaction.objects.filter(direct_debit__isnull=False).exists())
+            self.assertEqual(create_direct_debit(date(2019, 2, 1))[0].count, 1)
+
+    def test_missing_creditor(self):
+        "Direct debits should not be created without creditor"
+
+        global_preferences_registry.manager()['Finance__sepa_creditor_iban'] = 'DE00'
+        with self.assertRaises(SEPAError):
+            create_direct_debit(date(2019, 2, 1))
+
+    def test_direct_debit_query_count(self):
+        "Collection should not query per item"
+
+        def create_items(count):
+            for i in range(count):
+                member = Member.objects.create(first_name='Temp', last_name=str(i), payment_method=Member.DEBIT, iban='DE89370400440532013000', debit_reference='MANDATE-{}'.format(i), debit_mandate_at=date(2018, 1, 1))
+                Transaction.objects.create(account=self.debitor, date=date(2019, 1, 1), text='Subscription', debit=Decimal(i + 1), member=member, accounting_year=2019)
+
+        with self.settings(MEDIA_ROOT=self.temp_dir):
+            create_items(2)
+            with CaptureQueriesContext(connection) as few:
+                create_direct_debit(date(2019, 2, 1))
+            create_items(30)
+            with CaptureQueriesContext(connection) as many:
+                self.assertEqual(create_direct_debit(date(2019, 3, 1))[0].count, 30)
+            self.assertEqual(len(many), len(few))
+
+    def test_direct_debit_views(self):
+        "Direct debit views should create, download and cancel direct debits"
+
+        with self.settings(MEDIA_ROOT=self.temp_dir, SENDFILE_ROOT=self.temp_dir):
+            response = self.client.post(reverse('finance:direct_debit_create'), {'collection_date': '2019-02-01'})
+            self.assertRedirects(response, reverse('finance:direct_debit_list'), fetch_redirect_response=False)
+            direct_debit = DirectDebit.objects.get()
+
+            response = self.client.get(reverse('finance:direct_debit_list'))
+            self.assertContains(response, direct_debit.message_id)
+
+            response = self.client.get(reverse('finance:direct_debit_download', kwargs={'pk': direct_debit.pk}))
+            self.assertEqual(response.status_code, 200)
+
+            response = self.client.post(reverse('finance:direct_debit_cancel', kwargs={'pk': direct_debit.pk}))
+            self.assertRedirects(response, reverse('finance:direct_debit_list'), fetch_redirect_response=False)
+            self.assertFalse(DirectDebit.objects.exists())
+
+class TrialBalanceTestMethods(TestCase):
+    def setUp(self):
+        # Create user
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        user.first_name = 'temp_first'
+        user.last_name = 'temp_last'
+        user.save()
+        user.user_permissions.add(Permission.objects.get(codename='view_transaction'))
+
+        # login with user
+        self.client.login(username='temp', password='temppass')
+
+        global_preferences_registry.manager()['Finance__accounting_year'] = '2019'
+
+        self.bank = Account.objects.create(number='18000', name='Bank', account_type=Account.ASSET)
+        self.income = Account.objects.create(number='40000', name='Income', account_type=Account.INCOME)
+        self.cost = Account.objects.create(number='60000', name='Cost', account_type=Account.COST)
+        cost_center = CostCenter.objects.create(number='100', name='Center')
+        cost_object = CostObject.objects.create(number='200', name='Object')
+        self.cost_center = cost_center
+        self.cost_object = cost_object
+        # Former year
+        self.post(date(2018, 6, 1), 2018, self.bank, self.income, Decimal('100.00'))
+        # Accounting year
+        self.post(date(2019, 1, 15), 2019, self.bank, self.income, Decimal('50.00'))
+        self.post(date(2019, 3, 1), 2019, self.cost, self.bank, Decimal('20.00'))
+        self.post(date(2019, 6, 1), 2019, self.bank, self.income, Decimal('5.00'))
+
+    def post(self, posting_date, accounting_year, debit_account, credit_account, amount):
+        Transaction.objects.create(account=debit_account, date=posting_date, text='Posting', debit=amount, cost_center=self.cost_center, cost_object=self.cost_object, accounting_year=accounting_year)
+        Transaction.objects.create(account=credit_account, date=posting_date, text='Posting', credit=amount, cost_center=self.cost_center, cost_object=self.cost_object, accounting_year=accounting_year)
+
+    def get_rows(self, *args):
+        return {row['account']: (row['opening'], row['debit'], row['credit'], row['closing']) for row in get_trial_balance(*args)}
+
+    def test_trial_balance(self):
+        "Balance sheet accounts should carry forward their balance, income and cost accounts not"
+
+        self.assertEqual(self.get_rows(2019), {
+            '18000': (Decimal('100.00'), Decimal('55.00'), Decimal('20.00'), Decimal('135.00')),
+            '40000': (Decimal(0), Decimal(0), Decimal('55.00'), Decimal('-55.00')),
+            '60000': (Decimal(0), Decimal('20.00'), Decimal(0), Decimal('20.00')),
+        })
+        totals = get_totals(get_trial_balance(2019))
+        self.assertEqual(totals['debit'], totals['credit'])
+
+    def test_trial_balance_date_range(self):
+        "Transactions before the range should be opening balance, transactions after the range ignored"
+
+        self.assertEqual(self.get_rows(2019, date(2019, 2, 1), date(2019, 3, 31)), {
+            '18000': (Decimal('150.00'), Decimal(0), Decimal('20.00'), Decimal('130.00')),
+            '40000': (Decimal('-50.00'), Decimal(0), Decimal(0), Decimal('-50.00')),
+            '60000': (Decimal(0), Decimal('20.00'), Decimal(0), Decimal('20.00')),
+        })
+
+    def test_trial_balance_cache(self):
+        "Trial balance should be cached until the next posting"
+
+        get_trial_balance(2019)
+        with self.assertNumQueries(1):
+            get_trial_balance(2019)
+
+        self.post(date(2019, 7, 1), 2019, self.bank, self.income, Decimal('1.00'))
+        self.assertEqual(self.get_rows(2019)['18000'][1], Decimal('56.00'))
+
+    def test_trial_balance_language(self):
+        "Account types should be translated after the cache, so the cached rows do not depend on the language"
+
+        self.assertEqual(get_trial_balance(2019)[0]['account_type'], Account.ASSET)
+        with mock.patch.object(Account, 'ACCOUNT_TYPES', ((Account.ASSET, 'Translated'),)):
+            self.assertEqual(get_trial_balance(2019)[0]['account_type_display'], 'Translated')
+
+    def test_trial_balance_query_count(self):
+        "Trial balance should be calculated in one query for all accounts"
+
+        for number in range(20):
+            account = Account.objects.create(number=str(41000 + number), name='Income', account_type=Account.INCOME)
+            self.post(date(2019, 1, 1), 2019, self.bank, account, Decimal(number + 1))
+
+        with self.assertNumQueries(2):
+            self.assertEqual(len(get_trial_balance(2019)), 23)
+
+    def test_trial_balance_views(self):
+        "Trial balance should be shown and exported"
+
+        response = self.client.get(reverse('finance:trial_balance'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['trial_balance']), 3)
+
+        response = self.client.get(reverse('finance:trial_balance_export'), {'year': 2019, 'date_from': '2019-02-01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(len(response.content.decode('utf8').splitlines()), 5)
+
+        response = self.client.get(reverse('finance:trial_balance'), {'date_from': 'x'})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,80 @@
+"""
+Trial balance with opening balance, period sums and closing balance of all accounts
+"""
+from decimal import Decimal
+from django.core.cache import cache
+from django.db.models import Q, F, Sum, Case, When, Value, DecimalField
+from utils.models import ModelVersion
+from .models import Account, Transaction
+
+# Accounts, whose balances are carried forward into the next accounting year
+BALANCE_SHEET_TYPES = (Account.ASSET, Account.DEBITOR, Account.CREDITOR)
+
+def calculate_trial_balance(accounting_year, date_from=None, date_to=None):
+    """
+    Returns the trial balance rows of all accounts with transactions, calculated in one grouped query.
+    The opening balance contains the former years of balance sheet accounts and the transactions before date_from.
+    """
+    value = DecimalField(max_digits=14, decimal_places=2)
+
+    def total(condition, field):
+        return Sum(Case(When(condition, then=F(field)), default=Value(0), output_field=value))
+
+    opening = Q(accounting_year__lt=accounting_year)
+    period = Q(accounting_year=accounting_year)
+    if date_from:
+        opening |= Q(accounting_year=accounting_year, date__lt=date_from)
+        period &= Q(date__gte=date_from)
+    if date_to:
+        period &= Q(date__lte=date_to)
+
+    transactions = Transaction.objects.filter(Q(accounting_year=accounting_year) | Q(accounting_year__lt=accounting_year, account__account_type__in=BALANCE_SHEET_TYPES))
+    if date_to:
+        transactions = transactions.exclude(accounting_year=accounting_year, date__gt=date_to)
+
+    rows = transactions.values('account', 'account__name', 'account__account_type').annotate(
+        opening_debit=total(opening, 'debit'),
+        opening_credit=total(opening, 'credit'),
+        debit_sum=total(period, 'debit'),
+        credit_sum=total(period, 'credit'),
+    ).order_by('account')
+
+    trial_balance = []
+    for row in rows:
+        opening_balance = (row['opening_debit'] or Decimal(0)) - (row['opening_credit'] or Decimal(0))
+        debit = row['debit_sum'] or Decimal(0)
+        credit = row['credit_sum'] or Decimal(0)
+        trial_balance.append({
+            'account': row['account'],
+            'name': row['account__name'],
+            'account_type': row['account__account_type'],
+            'opening': opening_balance,
+            'debit': debit,
+            'credit': credit,
+            'closing': opening_balance + debit - credit,
+        })
+    return trial_balance
+
+def get_trial_balance(accounting_year, date_from=None, date_to=None):
+    """
+    Returns the trial balance rows, cached until transactions or accounts change.
+    The account types are translated after the cache, so the cached rows do not depend on the language.
+    """
+    versions = ModelVersion.objects.get_versions([Transaction, Account])
+    key = 'trial_balance:{}:{}:{}:{}'.format(accounting_year, date_from or '', date_to or '', ':'.join(str(versions[label]) for label in sorted(versions)))
+    trial_balance = cache.get(key)
+    if trial_balance is None:
+        trial_balance = calculate_trial_balance(accounting_year, date_from, date_to)
+        cache.set(key, trial_balance, None)
+
+    account_types = dict(Account.ACCOUNT_TYPES)
+    return [dict(row, account_type_display=str(account_types.get(row['account_type'], ''))) for row in trial_balance]
+
+def get_totals(trial_balance):
+    """
+    Returns the column sums of the trial balance rows
+    """
+    return {
+        column: sum((row[column] for row in trial_balance), Decimal(0))
+        for column in ('opening', 'debit', 'credit', 'closing')
+    }
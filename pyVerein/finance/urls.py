@@ -35,6 +35,8 @@ urlpatterns = [
     path('costobject/<str:pk>/edit/', views.CostObjectEditView.as_view(), name='costobject_edit'),
 
     path('transaction/', views.TransactionIndexView.as_view(), name='transaction_list'),
+    path('transaction/data/', views.get_transactions, name='transaction_data'),
+    path('transaction/import/', views.StatementImportView.as_view(), name='transaction_import'),
     path('transaction/new/', views.TransactionCreateView.as_view(), name='transaction_create'),
     path('transaction/new/<str:session_id>/', views.TransactionCreateView.as_view(), name='transaction_create_session'),
     path('transaction/new/<str:session_id>/<int:step>/', views.TransactionCreateView.as_view(), name='transaction_create_step'),
@@ -51,6 +53,15 @@ urlpatterns = [
     path('api/account/<str:search>', views.get_account, name='account_search'),
     path('api/costcenter/<str:search>', views.get_cost_center, name='costcenter_search'),
     path('api/costobject/<str:search>', views.get_cost_object, name='costobject_search'),
+    path('clearing/proposals/', views.ClearingProposalIndexView.as_view(), name='clearing_proposals'),
+    path('clearing/proposals/match/', views.match_open_items, name='clearing_match'),
+    path('clearing/proposals/update/', views.update_clearing_proposals, name='clearing_proposals_update'),
+    path('trialbalance/', views.TrialBalanceView.as_view(), name='trial_balance'),
+    path('trialbalance/export/', views.export_trial_balance, name='trial_balance_export'),
+    path('directdebit/', views.DirectDebitIndexView.as_view(), name='direct_debit_list'),
+    path('directdebit/new/', views.create_direct_debit, name='direct_debit_create'),
+    path('directdebit/<int:pk>/download/', views.download_direct_debit, name='direct_debit_download'),
+    path('directdebit/<int:pk>/cancel/', views.cancel_direct_debit, name='direct_debit_cancel'),
     path('api/clearing/', views.clear_transaction, name='clear_transactions'),
     path('api/clearing/reset/', views.reset_cleared_transaction, name='reset_cleared_transactions'),
 ] 
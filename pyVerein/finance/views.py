@@ -2,24 +2,38 @@
 Viewmodule for finance app
 """
 import datetime
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponseRedirect, HttpResponseBadRequest, Http404
 # Import views
-from django.views.generic import TemplateView, UpdateView, CreateView
+from django.views.generic import TemplateView, UpdateView, CreateView, FormView
 # Import forms
-from .forms import PersonalAccountCreateForm, PersonalAccountEditForm, ImpersonalAccountCreateForm, ImpersonalAccountEditForm, CostCenterCreateForm, CostCenterEditForm, CostObjectCreateForm, CostObjectEditForm, TransactionCreateForm, TransactionEditForm, VirtualAccountCreateForm, VirtualAccountEditForm
+from .forms import PersonalAccountCreateForm, PersonalAccountEditForm, ImpersonalAccountCreateForm, ImpersonalAccountEditForm, CostCenterCreateForm, CostCenterEditForm, CostObjectCreateForm, CostObjectEditForm, TransactionCreateForm, TransactionEditForm, VirtualAccountCreateForm, VirtualAccountEditForm, StatementImportForm
 # Import reverse.
 from django.urls import reverse, reverse_lazy
 # Import Q for extended filtering.
-from django.db.models import Q, Max, Sum
+from django.db.models import Q, Sum
 # Import localization
 from django.utils.translation import ugettext_lazy as _
+from django.utils.formats import date_format, localize
 # Import MessageMixin
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib.messages import get_messages
 # Import Account model
-from .models import Account, CostCenter, CostObject, Transaction, VirtualAccount
+from .models import Account, CostCenter, CostObject, Transaction, VirtualAccount, AccountBalance, ClearingProposal, DirectDebit
 from utils.views import generate_document_number, generate_internal_number
+from django.db import transaction as db_transaction
+from .clearing import clear_transactions, reset_clearing, ClearingError
+from .matching import accept_proposals, reject_proposals
+from .statements import parse_statement, StatementImport
+from . import sepa
+from .trial_balance import get_trial_balance, get_totals
+from django.http import HttpResponse
+import csv
+from sendfile import sendfile
+from django.shortcuts import get_object_or_404
+import os
+from xml.etree.ElementTree import ParseError
+from tasks.models import Job
 
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.auth.decorators import login_required, permission_required
@@ -27,7 +41,7 @@ from decimal import Decimal
 import random
 import string
 from dynamic_preferences.registries import global_preferences_registry
-from utils.views import DetailView
+from utils.views import DetailView, HistoryMixin
 
 class CreditorIndexView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
     """
@@ -87,12 +101,10 @@ class CreditorDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView
 
         if self.request.GET.get('show-cleared', None) == 'True':
             context['transactions'] = Transaction.objects.filter(account=self.object.number)
-            debit_sum = Transaction.objects.filter(account=self.object.number).aggregate(Sum('debit'))['debit__sum']
-            credit_sum = Transaction.objects.filter(account=self.object.number).aggregate(Sum('credit'))['credit__sum']
+            debit_sum, credit_sum = AccountBalance.objects.totals(self.object)
         else:
             context['transactions'] = Transaction.objects.filter(Q(account=self.object.number) & Q(clearing_number=None))
-            debit_sum = Transaction.objects.filter(Q(account=self.object.number) & Q(clearing_number=None)).aggregate(Sum('debit'))['debit__sum']
-            credit_sum = Transaction.objects.filter(Q(account=self.object.number) & Q(clearing_number=None)).aggregate(Sum('credit'))['credit__sum']
+            debit_sum, credit_sum = AccountBalance.objects.totals(self.object, cleared=False)
        
         context['debit_sum'] = debit_sum if debit_sum else 0
         context['credit_sum'] = credit_sum if credit_sum else 0
@@ -191,12 +203,10 @@ class DebitorDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView)
 
         if self.request.GET.get('show-cleared', None) == 'True':
             context['transactions'] = Transaction.objects.filter(account=self.object.number)
-            debit_sum = Transaction.objects.filter(account=self.object.number).aggregate(Sum('debit'))['debit__sum']
-            credit_sum = Transaction.objects.filter(account=self.object.number).aggregate(Sum('credit'))['credit__sum']
+            debit_sum, credit_sum = AccountBalance.objects.totals(self.object)
         else:
             context['transactions'] = Transaction.objects.filter(Q(account=self.object.number) & Q(clearing_number=None))
-            debit_sum = Transaction.objects.filter(Q(account=self.object.number) & Q(clearing_number=None)).aggregate(Sum('debit'))['debit__sum']
-            credit_sum = Transaction.objects.filter(Q(account=self.object.number) & Q(clearing_number=None)).aggregate(Sum('credit'))['credit__sum']
+            debit_sum, credit_sum = AccountBalance.objects.totals(self.object, cleared=False)
 
         context['debit_sum'] = debit_sum if debit_sum else 0
         context['credit_sum'] = credit_sum if credit_sum else 0
@@ -285,12 +295,10 @@ class ImpersonalDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailVi
             year = global_preferences_registry.manager()['Finance__accounting_year']
         if year == '0':
             context['transactions'] = Transaction.objects.filter(account=self.object.number)
-            debit_sum = Transaction.objects.filter(account=self.object.number).aggregate(Sum('debit'))['debit__sum']
-            credit_sum = Transaction.objects.filter(account=self.object.number).aggregate(Sum('credit'))['credit__sum']
+            debit_sum, credit_sum = AccountBalance.objects.totals(self.object)
         else:
             context['transactions'] = Transaction.objects.filter(Q(account=self.object.number) & Q(accounting_year=year))
-            debit_sum = Transaction.objects.filter(Q(account=self.object.number) & Q(accounting_year=year)).aggregate(Sum('debit'))['debit__sum']
-            credit_sum = Transaction.objects.filter(Q(account=self.object.number) & Q(accounting_year=year)).aggregate(Sum('credit'))['credit__sum']
+            debit_sum, credit_sum = AccountBalance.objects.totals(self.object, accounting_year=year)
 
         context['debit_sum'] = debit_sum if debit_sum else 0
         context['credit_sum'] = credit_sum if credit_sum else 0
@@ -492,16 +500,88 @@ class TransactionIndexView(LoginRequiredMixin, PermissionRequiredMixin, Template
         year = str(self.request.GET.get('year'))
         if year == 'None':
             year = global_preferences_registry.manager()['Finance__accounting_year']
-        if year == '0':
-            context['transactions'] = Transaction.objects.all()
-        else:
-            context['transactions'] = Transaction.objects.filter(Q(accounting_year=year))
-    
+
         context['accounting_years'] = Transaction.objects.values('accounting_year').distinct().order_by('-accounting_year')
         context['accounting_year'] = int(year)
 
         return context
 
+# Maximum number of transactions per page of the transaction list
+TRANSACTION_PAGE_LENGTH = 100
+
+@login_required
+@permission_required('finance.view_transaction', raise_exception=True)
+def get_transactions(request):
+    """
+    Server-side processing endpoint for the transaction list.
+    Filters, sorts and pages the transactions in the database and returns only the requested page.
+    """
+    columns = ['date', 'document_number', 'account__number', 'text', 'debit', 'credit', 'cost_center__number', 'cost_object__number']
+
+    try:
+        draw = int(request.GET.get('draw', 0))
+        start = max(int(request.GET.get('start', 0)), 0)
+        length = int(request.GET.get('length', 10))
+        order_column = int(request.GET.get('order[0][column]', 0))
+        year = int(request.GET.get('year', None) or global_preferences_registry.manager()['Finance__accounting_year'] or 0)
+    except ValueError:
+        return HttpResponseBadRequest()
+    # Pages are limited, so all transactions are never loaded at once
+    if length < 0 or length > TRANSACTION_PAGE_LENGTH:
+        length = TRANSACTION_PAGE_LENGTH
+
+    transactions = Transaction.objects.all()
+    if year != 0:
+        transactions = transactions.filter(accounting_year=year)
+    records_total = transactions.count()
+
+    search = request.GET.get('search[value]', '').strip()
+    if search:
+        transactions = transactions.filter(
+            Q(document_number__icontains=search) | Q(text__icontains=search) |
+            Q(account__number__icontains=search) | Q(account__name__icontains=search) |
+            Q(cost_center__number__icontains=search) | Q(cost_object__number__icontains=search)
+        )
+        records_filtered = transactions.count()
+    else:
+        records_filtered = records_total
+
+    order_field = columns[order_column] if 0 <= order_column < len(columns) else columns[0]
+    if request.GET.get('order[0][dir]', 'asc') == 'desc':
+        order_field = '-' + order_field
+    transactions = transactions.select_related('account', 'cost_center', 'cost_object').order_by(order_field, 'pk')[start:start + length]
+
+    account_urls = {
+        Account.DEBITOR: 'finance:debitor_detail',
+        Account.CREDITOR: 'finance:creditor_detail',
+        Account.COST: 'finance:impersonal_detail',
+        Account.INCOME: 'finance:impersonal_detail',
+        Account.ASSET: 'finance:impersonal_detail',
+    }
+    data = []
+    for transaction in transactions:
+        data.append({
+            'date': date_format(transaction.date),
+            'document_number': transaction.document_number,
+            'document_url': reverse('finance:transaction_detail', kwargs={'internal_number': transaction.internal_number}),
+            'account': transaction.account.number,
+            'account_url': reverse(account_urls[transaction.account.account_type], kwargs={'pk': transaction.account.pk}),
+            'text': transaction.text,
+            'debit': localize(transaction.debit) if transaction.debit is not None else '',
+            'credit': localize(transaction.credit) if transaction.credit is not None else '',
+            'cost_center': transaction.cost_center.number if transaction.cost_center else None,
+            'cost_center_url': reverse('finance:costcenter_detail', kwargs={'pk': transaction.cost_center.pk}) if transaction.cost_center else None,
+            'cost_object': transaction.cost_object.number if transaction.cost_object else None,
+            'cost_object_url': reverse('finance:costobject_detail', kwargs={'pk': transaction.cost_object.pk}) if transaction.cost_object else None,
+        })
+
+    return JsonResponse({
+        'draw': draw,
+        'recordsTotal': records_total,
+        'recordsFiltered': records_filtered,
+        'data': data,
+    })
+
 class TransactionCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     """
     Create view for transaction
@@ -600,6 +680,7 @@ class TransactionCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateV
                 key = str(step)
             else:
                 key = str(int(max(transactions.keys())) + 1)
+            previous = transactions.get(key, {})
             transactions[key] = {
                 'account':  str(self.object.account.number) if self.object.account is not None else None,
                 'date':  self.object.date.strftime('%d.%m.%Y'),
@@ -611,6 +692,8 @@ class TransactionCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateV
                 'cost_object':  str(self.object.cost_object.number) if self.object.cost_object is not None else None,
                 'document_number_generated':  str(transactions['0']['document_number_generated'])
             }
+            # Keep the billed subscription period of a reset posting
+            transactions[key].update({field: previous[field] for field in ('member', 'subscription', 'billing_period') if field in previous})
 
             debit_sum = Decimal(0)
             credit_sum = Decimal(0)
@@ -626,30 +709,34 @@ class TransactionCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateV
             if debit_sum != credit_sum:
                 self.request.session[session_id + 'transactions'] = transactions
             else:
-                # Generate document_number
-                if transactions['0']['document_number'] is None:
-                    document_number = generate_document_number()
-                    document_number_generated = True
-                else:
-                    document_number = transactions['0']['document_number']
-                    document_number_generated = False
-
-                internal_number = generate_internal_number()
-                # Save transactions from session to db
-                for transaction in transactions.values():
-                    obj = Transaction()
-                    obj.account = Account.objects.get(number=transaction['account'])
-                    obj.date = datetime.datetime.strptime(transaction['date'], '%d.%m.%Y')
-                    obj.document_number = document_number if document_number else transaction['document_number']
-                    obj.text = transaction['text']
-                    obj.debit = Decimal(transaction['debit']) if transaction['debit'] is not None else None
-                    obj.credit = Decimal(transaction['credit']) if transaction['credit'] is not None else None
-                    obj.cost_center = CostCenter.objects.get(number=transaction['cost_center']) if transaction['cost_center'] is not None else None
-                    obj.cost_object = CostObject.objects.get(number=transaction['cost_object']) if transaction['cost_object'] is not None else None
-                    obj.document_number_generated = document_number_generated
-                    obj.internal_number = internal_number
-                    obj.accounting_year = global_preferences['Finance__accounting_year']
-                    obj.save()
+                with db_transaction.atomic():
+                    # Generate document_number
+                    if transactions['0']['document_number'] is None:
+                        document_number = generate_document_number()
+                        document_number_generated = True
+                    else:
+                        document_number = transactions['0']['document_number']
+                        document_number_generated = False
+
+                    internal_number = generate_internal_number()
+                    # Save transactions from session to db
+                    for transaction in transactions.values():
+                        obj = Transaction()
+                        obj.account = Account.objects.get(number=transaction['account'])
+                        obj.date = datetime.datetime.strptime(transaction['date'], '%d.%m.%Y')
+                        obj.document_number = document_number if document_number else transaction['document_number']
+                        obj.text = transaction['text']
+                        obj.debit = Decimal(transaction['debit']) if transaction['debit'] is not None else None
+                        obj.credit = Decimal(transaction['credit']) if transaction['credit'] is not None else None
+                        obj.cost_center = CostCenter.objects.get(number=transaction['cost_center']) if transaction['cost_center'] is not None else None
+                        obj.cost_object = CostObject.objects.get(number=transaction['cost_object']) if transaction['cost_object'] is not None else None
+                        obj.document_number_generated = document_number_generated
+                        obj.internal_number = internal_number
+                        obj.accounting_year = global_preferences['Finance__accounting_year']
+                        obj.member_id = transaction.get('member')
+                        obj.subscription_id = transaction.get('subscription')
+                        obj.billing_period = transaction.get('billing_period')
+                        obj.save()
                 messages.success(self.request, _('Transaction {0:s} saved successfully').format(document_number))
                 # Clear session
                 del self.request.session[session_id + 'transactions']
@@ -657,7 +744,31 @@ class TransactionCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateV
 
         return HttpResponseRedirect(reverse_lazy('finance:transaction_create_session', kwargs={'session_id':session_id}))
 
-class TransactionDetailView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
+class StatementImportView(LoginRequiredMixin, PermissionRequiredMixin, FormView):
+    """
+    Import view for bank statements
+    """
+    permission_required = ('finance.view_transaction', 'finance.add_transaction')
+    template_name = 'finance/transaction/import.html'
+    form_class = StatementImportForm
+
+    def form_valid(self, form):
+        """
+        Post the statement lines and show the lines without counterparty
+        """
+        statement = form.cleaned_data['statement']
+        statement.seek(0)
+        lines = parse_statement(statement.file, form.cleaned_data['file_format'], form.cleaned_data['encoding'])
+        try:
+            result = StatementImport(form.cleaned_data['bank_account'], form.cleaned_data['fallback_account'], user=self.request.user).run(lines)
+        except (ValueError, ParseError) as err:
+            messages.error(self.request, _('Statement could not be imported: {}').format(err))
+            return self.form_invalid(form)
+
+        messages.success(self.request, _('{imported} lines imported, {duplicates} lines already imported, {unmatched} lines without counterparty').format(**result))
+        return self.render_to_response(self.get_context_data(form=self.get_form_class()(), result=result))
+
+class TransactionDetailView(LoginRequiredMixin, PermissionRequiredMixin, HistoryMixin, TemplateView):
     """
     Detail view for transaction
     """
@@ -665,43 +776,27 @@ class TransactionDetailView(LoginRequiredMixin, PermissionRequiredMixin, Templat
     model = Transaction
     template_name = 'finance/transaction/detail.html'
 
+    def get_history_object(self):
+        transaction = Transaction.objects.filter(internal_number=self.kwargs['internal_number']).order_by('-clearing_number').first()
+        if not transaction:
+            raise Http404
+        return transaction
+
     def get_context_data(self, **kwargs):
         context = super(TransactionDetailView, self).get_context_data(**kwargs)
         
-        transactions = Transaction.objects.filter(internal_number=kwargs['internal_number']).order_by('-clearing_number')
+        transactions = Transaction.objects.filter(internal_number=kwargs['internal_number']).select_related('account', 'cost_center', 'cost_object').order_by('-clearing_number')
         context['transactions'] = transactions
         context['history_transaction'] = transactions[0]
         context['date'] = transactions[0].date
         context['document_number'] = transactions[0].document_number
         context['internal_number'] = transactions[0].internal_number
         if transactions[0].clearing_number:
-            context['cleared_transactions'] = Transaction.objects.filter(clearing_number=transactions[0].clearing_number)
+            context['cleared_transactions'] = Transaction.objects.filter(clearing_number=transactions[0].clearing_number).select_related('account')
             context['clearing_number'] = transactions[0].clearing_number
 
         context['instance'] = transactions[0]
 
-        history = []
-        for record in transactions[0].history.all():
-            entry = {
-                'type': record.history_type,
-                'date': record.history_date,
-                'user': record.history_user.get_full_name() if record.history_user else None,
-                'changes': []
-            }
-            
-            if record.prev_record:
-                delta = record.diff_against(record.prev_record)
-                for change in delta.changes:
-                    entry['changes'].append({
-                        'field': change.field,
-                        'old': change.old,
-                        'new': change.new
-                    })
-
-            history.append(entry)
-
-        context['history'] = history
-
         return context
 
 class TransactionEditView(LoginRequiredMixin, PermissionRequiredMixin, SuccessMessageMixin, UpdateView):
@@ -791,28 +886,32 @@ def reset_transaction(request, internal_number):
         messages.error(request, _('Receipt already reset'))
         return HttpResponseRedirect(reverse_lazy('finance:transaction_list'))
     else:
-        # Get last internal_number
-        internal_number = Transaction.objects.all().aggregate(Max('internal_number'))['internal_number__max'] + 1
         for transaction in transactions:
             if transaction.clearing_number != None:
                 messages.error(request, _('Receipt can not be reset because it was already cleared. Reset clearing before resetting this receipt.'))
                 return HttpResponseRedirect(reverse_lazy('finance:transaction_detail', kwargs={'internal_number':transaction.internal_number}))
 
-    for transaction in transactions:
-        transaction.reset = True
-        transaction.save()
+    with db_transaction.atomic():
+        # Get next internal_number
+        internal_number = generate_internal_number()
+        for transaction in transactions:
+            transaction.reset = True
+            # Free the billed subscription period so it can be billed again
+            transaction.subscription = None
+            transaction.billing_period = None
+            transaction.save()
 
-        reset_new_transaction = transaction
-        reset_new_transaction.pk = None
+            reset_new_transaction = transaction
+            reset_new_transaction.pk = None
 
-        global_preferences = global_preferences_registry.manager()
-        reset_new_transaction.document_number = global_preferences['Finance__reset_prefix'] + transaction.document_number
+            global_preferences = global_preferences_registry.manager()
+            reset_new_transaction.document_number = global_preferences['Finance__reset_prefix'] + transaction.document_number
 
-        reset_new_transaction.debit, reset_new_transaction.credit = transaction.credit, transaction.debit
-        reset_new_transaction.reset = True
-        reset_new_transaction.internal_number = internal_number
-        
-        reset_new_transaction.save()
+            reset_new_transaction.debit, reset_new_transaction.credit = transaction.credit, transaction.debit
+            reset_new_transaction.reset = True
+            reset_new_transaction.internal_number = internal_number
+            
+            reset_new_transaction.save()
     
     messages.success(request, _('Receipt reset successfully'))
     return HttpResponseRedirect(reverse_lazy('finance:transaction_list'))
@@ -834,39 +933,47 @@ def reset_new_transaction(request, internal_number):
         messages.error(request, _('Receipt already reset'))
         return HttpResponseRedirect(reverse_lazy('finance:transaction_list'))
     else:
-        # Get last internal_number
-        internal_number = Transaction.objects.all().aggregate(Max('internal_number'))['internal_number__max'] + 1
         for transaction in transactions:
             if transaction.clearing_number != None:
                 messages.error(request, _('Receipt can not be reset because it was already cleared. Reset clearing before resetting this receipt.'))
                 return HttpResponseRedirect(reverse_lazy('finance:transaction_detail', kwargs={'internal_number':transaction.internal_number}))
-    for key, transaction in enumerate(transactions):
-        # Add transaction to session data
-        session_transactions[key] = {
-            'account':  str(transaction.account.number) if transaction.account is not None else None,
-            'date':  transaction.date.strftime('%d.%m.%Y'),
-            'document_number': transaction.document_number,
-            'text':  transaction.text,
-            'debit':  str(transaction.debit) if transaction.debit is not None else None,
-            'credit':  str(transaction.credit) if transaction.credit is not None else None,
-            'cost_center':  str(transaction.cost_center.number) if transaction.cost_center is not None else None,
-            'cost_object':  str(transaction.cost_object.number) if transaction.cost_object is not None else None,
-            'document_number_generated':  str(transaction.document_number_generated)
-        }
-        transaction.reset = True
-        transaction.save()
-
-        reset_new_transaction = transaction
-        reset_new_transaction.pk = None
 
-        global_preferences = global_preferences_registry.manager()
-        reset_new_transaction.document_number = global_preferences['Finance__reset_prefix'] + transaction.document_number
+    with db_transaction.atomic():
+        # Get next internal_number
+        internal_number = generate_internal_number()
+        for key, transaction in enumerate(transactions):
+            # Add transaction to session data
+            session_transactions[key] = {
+                'account':  str(transaction.account.number) if transaction.account is not None else None,
+                'date':  transaction.date.strftime('%d.%m.%Y'),
+                'document_number': transaction.document_number,
+                'text':  transaction.text,
+                'debit':  str(transaction.debit) if transaction.debit is not None else None,
+                'credit':  str(transaction.credit) if transaction.credit is not None else None,
+                'cost_center':  str(transaction.cost_center.number) if transaction.cost_center is not None else None,
+                'cost_object':  str(transaction.cost_object.number) if transaction.cost_object is not None else None,
+                'document_number_generated':  str(transaction.document_number_generated),
+                # The billed subscription period is moved to the new posting
+                'member': transaction.member_id,
+                'subscription': transaction.subscription_id,
+                'billing_period': transaction.billing_period
+            }
+            transaction.reset = True
+            transaction.subscription = None
+            transaction.billing_period = None
+            transaction.save()
 
-        reset_new_transaction.debit, reset_new_transaction.credit = transaction.credit, transaction.debit
-        reset_new_transaction.reset = True
-        reset_new_transaction.internal_number = internal_number
-        
-        reset_new_transaction.save()
+            reset_new_transaction = transaction
+            reset_new_transaction.pk = None
+
+            global_preferences = global_preferences_registry.manager()
+            reset_new_transaction.document_number = global_preferences['Finance__reset_prefix'] + transaction.document_number
+
+            reset_new_transaction.debit, reset_new_transaction.credit = transaction.credit, transaction.debit
+            reset_new_transaction.reset = True
+            reset_new_transaction.internal_number = internal_number
+            
+            reset_new_transaction.save()
 
     # Save transactions to session
     request.session[session_id + 'transactions'] = session_transactions
@@ -883,12 +990,11 @@ def clear_transaction(request):
 
     transactions = request.POST.getlist("transactions[]", None)
     if transactions is not None:
-        max_clearing_number = Transaction.objects.all().aggregate(Max('clearing_number'))['clearing_number__max']
-        clearing_number =  1 if max_clearing_number is None else max_clearing_number + 1
-        for transaction in transactions:
-            tr = Transaction.objects.get(pk=transaction)
-            tr.clearing_number = clearing_number
-            tr.save()
+        try:
+            clear_transactions(transactions, user=request.user)
+        except ClearingError as err:
+            messages.error(request, err)
+            return JsonResponse({'success': False})
         messages.success(request, _('Receipt cleared successfully'))
     return JsonResponse({'success': True})
 
@@ -901,13 +1007,206 @@ def reset_cleared_transaction(request):
 
     clearing_number = request.POST.get("clearing_number", None)
     if clearing_number is not None:
-        transactions = Transaction.objects.filter(clearing_number=clearing_number)
-        for transaction in transactions:
-            transaction.clearing_number = None
-            transaction.save()
+        try:
+            reset_clearing(int(clearing_number), user=request.user)
+        except ValueError:
+            return HttpResponseBadRequest()
         messages.success(request, _('Receipt clearing reset successfully'))
     return JsonResponse({'success': True})
 
+class ClearingProposalIndexView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
+    """
+    Index view for open clearing proposals
+    """
+    permission_required = ('finance.view_transaction', 'finance.add_transaction', 'finance.change_transaction')
+    template_name = 'finance/clearing/proposals.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(ClearingProposalIndexView, self).get_context_data(**kwargs)
+
+        context['proposals'] = ClearingProposal.objects.filter(state=ClearingProposal.OPEN).select_related('account').prefetch_related('transactions').order_by('account', 'pk')
+        context['matching'] = Job.objects.filter(name='match_open_items', state__in=(Job.QUEUED, Job.RUNNING)).exists()
+
+        return context
+
+@login_required
+@permission_required(['finance.view_transaction', 'finance.add_transaction', 'finance.change_transaction'], raise_exception=True)
+def match_open_items(request):
+    """
+    Start matching of the open items in background
+    """
+    if request.method != 'POST':
+        return HttpResponseBadRequest()
+
+    if Job.objects.filter(name='match_open_items', state__in=(Job.QUEUED, Job.RUNNING)).exists():
+        messages.info(request, _('Open items are already matched in background'))
+        return HttpResponseRedirect(reverse_lazy('finance:clearing_proposals'))
+
+    Job.objects.enqueue('match_open_items', user=request.user)
+    messages.success(request, _('Open items are matched in background'))
+    return HttpResponseRedirect(reverse_lazy('finance:clearing_proposals'))
+
+@login_required
+@permission_required(['finance.view_transaction', 'finance.add_transaction', 'finance.change_transaction'], raise_exception=True)
+def update_clearing_proposals(request):
+    """
+    Accept or reject the selected clearing proposals
+    """
+    if request.method != 'POST':
+        return HttpResponseBadRequest()
+
+    try:
+        proposals = [int(pk) for pk in request.POST.getlist('proposals')]
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    action = request.POST.get('action', None)
+    if action == 'accept':
+        cleared, failed = accept_proposals(proposals, user=request.user)
+        messages.success(request, _('%(count)s proposals cleared successfully') % {'count': cleared})
+        if failed:
+            messages.error(request, _('%(count)s proposals could not be cleared anymore') % {'count': failed})
+    elif action == 'reject':
+        rejected = reject_proposals(proposals)
+        messages.success(request, _('%(count)s proposals rejected') % {'count': rejected})
+    else:
+        return HttpResponseBadRequest()
+
+    return HttpResponseRedirect(reverse_lazy('finance:clearing_proposals'))
+
+class DirectDebitIndexView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
+    """
+    Index view for SEPA direct debits
+    """
+    permission_required = 'finance.view_directdebit'
+    template_name = 'finance/direct_debit/list.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(DirectDebitIndexView, self).get_context_data(**kwargs)
+
+        context['direct_debits'] = DirectDebit.objects.order_by('-created_at')
+
+        return context
+
+@login_required
+@permission_required(['finance.view_directdebit', 'finance.add_directdebit'], raise_exception=True)
+def create_direct_debit(request):
+    """
+    Collect the open debit items of all members with direct debit mandate
+    """
+    if request.method != 'POST':
+        return HttpResponseBadRequest()
+
+    try:
+        collection_date = datetime.datetime.strptime(request.POST.get('collection_date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        messages.error(request, _('Invalid collection date'))
+        return HttpResponseRedirect(reverse_lazy('finance:direct_debit_list'))
+
+    try:
+        direct_debit, invalid = sepa.create_direct_debit(collection_date, user=request.user)
+    except sepa.SEPAError as err:
+        messages.error(request, err)
+        return HttpResponseRedirect(reverse_lazy('finance:direct_debit_list'))
+
+    if direct_debit:
+        messages.success(request, _('Direct debit of {count} transactions created successfully').format(count=direct_debit.count))
+    else:
+        messages.error(request, _('No transactions to collect'))
+    for item, error in invalid:
+        messages.error(request, '{} - {}: {}'.format(item.document_number, item.name, error))
+
+    return HttpResponseRedirect(reverse_lazy('finance:direct_debit_list'))
+
+@login_required
+@permission_required('finance.view_directdebit', raise_exception=True)
+def download_direct_debit(request, pk):
+    """
+    Download the pain.008 file of a direct debit with X-SENDFILE header
+    """
+    direct_debit = get_object_or_404(DirectDebit, pk=pk)
+    filepath = sepa.get_direct_debit_filepath(direct_debit)
+    if not os.path.isfile(filepath):
+        raise Http404
+
+    return sendfile(request, filepath, attachment=True, attachment_filename=os.path.basename(filepath))
+
+@login_required
+@permission_required(['finance.view_directdebit', 'finance.delete_directdebit'], raise_exception=True)
+def cancel_direct_debit(request, pk):
+    """
+    Cancel a direct debit, which was not submitted to the bank
+    """
+    if request.method != 'POST':
+        return HttpResponseBadRequest()
+
+    sepa.cancel_direct_debit(get_object_or_404(DirectDebit, pk=pk), user=request.user)
+    messages.success(request, _('Direct debit canceled successfully'))
+
+    return HttpResponseRedirect(reverse_lazy('finance:direct_debit_list'))
+
+def get_trial_balance_parameters(request):
+    """
+    Returns accounting year, start and end date of the trial balance request. Raises ValueError for invalid values.
+    """
+    year = request.GET.get('year', None) or global_preferences_registry.manager()['Finance__accounting_year'] or datetime.date.today().year
+    date_from = request.GET.get('date_from', None)
+    date_to = request.GET.get('date_to', None)
+    return (
+        int(year),
+        datetime.datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None,
+        datetime.datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None,
+    )
+
+class TrialBalanceView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
+    """
+    Trial balance of all accounts
+    """
+    permission_required = 'finance.view_transaction'
+    template_name = 'finance/trial_balance/list.html'
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.accounting_year, self.date_from, self.date_to = get_trial_balance_parameters(request)
+        except ValueError:
+            return HttpResponseBadRequest()
+        return super(TrialBalanceView, self).get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super(TrialBalanceView, self).get_context_data(**kwargs)
+
+        context['trial_balance'] = get_trial_balance(self.accounting_year, self.date_from, self.date_to)
+        context['totals'] = get_totals(context['trial_balance'])
+        context['accounting_years'] = Transaction.objects.values('accounting_year').distinct().order_by('-accounting_year')
+        context['accounting_year'] = self.accounting_year
+        context['date_from'] = self.date_from
+        context['date_to'] = self.date_to
+
+        return context
+
+@login_required
+@permission_required('finance.view_transaction', raise_exception=True)
+def export_trial_balance(request):
+    """
+    Export the trial balance as CSV file
+    """
+    try:
+        accounting_year, date_from, date_to = get_trial_balance_parameters(request)
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    trial_balance = get_trial_balance(accounting_year, date_from, date_to)
+    response = HttpResponse(content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="trial_balance_{}.csv"'.format(accounting_year)
+    writer = csv.writer(response, delimiter=';')
+    writer.writerow([_('Account'), _('Name'), _('Account type'), _('Opening balance'), _('Debit'), _('Credit'), _('Closing balance')])
+    for row in trial_balance:
+        writer.writerow([row['account'], row['name'], row['account_type_display'], localize(row['opening']), localize(row['debit']), localize(row['credit']), localize(row['closing'])])
+    totals = get_totals(trial_balance)
+    writer.writerow([_('Total'), '', '', localize(totals['opening']), localize(totals['debit']), localize(totals['credit']), localize(totals['closing'])])
+
+    return response
+
 class VirtualAccountIndexView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
     """
     Index view for virtual accounts
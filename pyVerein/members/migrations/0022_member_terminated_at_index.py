@@ -0,0 +1,23 @@
+# Generated by Django 2.1.15 on 2026-10-18 06:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0021_auto_20190417_1439'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historicalmember',
+            name='terminated_at',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='member',
+            name='terminated_at',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+    ]
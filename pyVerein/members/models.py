@@ -2,13 +2,46 @@ from django.db import models
 # Import localization
 from django.utils.translation import ugettext_lazy as _
 # Import datetime
-from datetime import datetime
+from datetime import datetime, timedelta
 from finance.models import Account, CostCenter, CostObject
 from dynamic_preferences.registries import global_preferences_registry
 from utils.models import AccessRestrictedModel, ModelBase
 import uuid
 from author.decorators import with_author
 
+class MemberQuerySet(models.QuerySet):
+    """
+    Queryset for filtering members by their termination date
+    """
+    def active(self, date=None):
+        """
+        Members which are not terminated at the given date, default today
+        """
+        date = date if date else datetime.now().date()
+        return self.filter(models.Q(terminated_at=None) | models.Q(terminated_at__gt=date))
+
+    def terminated(self, date=None):
+        """
+        Members which are terminated at the given date, default today
+        """
+        date = date if date else datetime.now().date()
+        return self.filter(terminated_at__lte=date)
+
+    def terminated_before(self, days, date=None):
+        """
+        Members which are terminated longer than the given number of days
+        """
+        date = date if date else datetime.now().date()
+        return self.filter(terminated_at__lt=date - timedelta(days=days))
+
+    def accessible_by(self, user):
+        """
+        Members without division or with at least one division the user is allowed to view
+        """
+        if user.is_superuser:
+            return self
+        return self.filter(models.Q(division=None) | models.Q(division__in=Division.get_accessible_ids(user))).distinct()
+
 # Member model.
 @with_author
 class Member(ModelBase):
@@ -81,7 +114,7 @@ class Member(ModelBase):
     # Joined at
     joined_at = models.DateField(blank=True, null=True)
     # Terminated at
-    terminated_at = models.DateField(blank=True, null=True)
+    terminated_at = models.DateField(blank=True, null=True, db_index=True)
     # Division
     division = models.ManyToManyField('Division', blank=True)
 
@@ -124,6 +157,8 @@ class Member(ModelBase):
     files = models.CharField(blank=True, null=True, max_length=255)
     divisions = models.CharField(blank=True, null=True, max_length=255)
 
+    objects = MemberQuerySet.as_manager()
+
     # Return full name
     def get_full_name(self):
         return '{0} {1}'.format(self.first_name, self.last_name)
@@ -135,6 +170,11 @@ class Member(ModelBase):
         else:
             return False
 
+    # Return true if member has no division or the user can access one of its divisions
+    def is_access_granted(self, user):
+        division_ids = set(self.division.values_list('pk', flat=True))
+        return not division_ids or not division_ids.isdisjoint(Division.get_accessible_ids(user))
+
     # Return full name as string representation
     def __str__(self):
         return self.get_full_name()
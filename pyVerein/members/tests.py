@@ -10,6 +10,9 @@ from shutil import rmtree
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from tempfile import mkdtemp
+from utils.testing import QueryBudgetTestMixin
+from finance.models import Account, CostCenter, CostObject
+from .serializer import MemberJSONSerializer, SubscriptionJSONSerializer
 
 class MemberTestMethods(TestCase):
     @classmethod
@@ -83,6 +86,24 @@ class MemberTestMethods(TestCase):
         # Member with terminated_at date in the past should be terminated
         self.assertTrue(member.is_terminated())
 
+    # Test for active, terminated and terminated_before queryset methods.
+    def test_termination_queryset(self):
+        today = datetime.now().date()
+        active = Member.objects.create(first_name="active", last_name="termination")
+        future = Member.objects.create(first_name="future", last_name="termination", terminated_at=today + timedelta(days=1))
+        now = Member.objects.create(first_name="now", last_name="termination", terminated_at=today)
+        past = Member.objects.create(first_name="past", last_name="termination", terminated_at=today - timedelta(days=10))
+
+        # Querysets should match is_terminated
+        self.assertEqual(set(Member.objects.filter(last_name="termination").active()), {active, future})
+        self.assertEqual(set(Member.objects.filter(last_name="termination").terminated()), {now, past})
+        for member in Member.objects.filter(last_name="termination"):
+            self.assertEqual(member in Member.objects.terminated(), member.is_terminated())
+
+        # Members terminated longer than the given days
+        self.assertEqual(set(Member.objects.filter(last_name="termination").terminated_before(5)), {past})
+        self.assertEqual(set(Member.objects.filter(last_name="termination").terminated_before(10)), set())
+
     # Test for __str__ method.
     def test__str__(self):
         # Create Member.
@@ -718,6 +739,46 @@ class DivisionTestMethods(TestCase):
         # Assert if __str__ ist full name.
         self.assertEqual(str(division), "Temp")
 
+    def test_division_access_cache(self):
+        "Accessible divisions should be resolved once per request"
+
+        user = User.objects.get(username='temp')
+        user2 = User.objects.get(username='temp2')
+        group = Group.objects.get(name='group')
+        division = Division.objects.get(name='Temp')
+        restricted = Division.objects.create(name='Restricted')
+        restricted.user.add(user2)
+
+        self.assertEqual(Division.get_accessible_ids(user), {division.pk})
+        with self.assertNumQueries(0):
+            self.assertTrue(division.is_access_granted(user))
+            self.assertFalse(restricted.is_access_granted(user))
+
+        restricted.groups.add(group)
+        self.assertFalse(restricted.is_access_granted(User.objects.get(pk=user.pk)))
+        group.user_set.add(user)
+        self.assertTrue(restricted.is_access_granted(User.objects.get(pk=user.pk)))
+
+        # Members are filtered by their divisions in SQL
+        member = Member.objects.create(first_name='first', last_name='restricted')
+        member.division.add(restricted)
+        Member.objects.create(first_name='first', last_name='free')
+        self.assertEqual(set(Member.objects.accessible_by(User.objects.get(pk=user2.pk)).values_list('last_name', flat=True)), {'restricted', 'free'})
+        restricted.user.remove(user2)
+        self.assertEqual(set(Member.objects.accessible_by(User.objects.get(pk=user2.pk)).values_list('last_name', flat=True)), {'free'})
+
+    def test_division_access_revoked(self):
+        "Revoked access should take effect with the next request, even if it was revoked by another process"
+
+        user = User.objects.get(username='temp')
+        restricted = Division.objects.create(name='Restricted')
+        restricted.user.add(user, User.objects.get(username='temp2'))
+        self.assertIn(restricted.pk, Division.get_accessible_ids(User.objects.get(pk=user.pk)))
+
+        # Revoke access without sending signals
+        Division.user.through.objects.filter(division=restricted, user=user).delete()
+        self.assertNotIn(restricted.pk, Division.get_accessible_ids(User.objects.get(pk=user.pk)))
+
     def test_division_list_permission(self):
         "User should only access division list if view permission is set"
 
@@ -982,4 +1043,88 @@ class SubscriptionTestMethods(TestCase):
 
         user.user_permissions.add(Permission.objects.get(codename='view_subscription'))
         response = self.client.get(reverse('members:subscription_create'))
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        self.assertEqual(response.status_code, 200)
+
+class QueryBudgetTestMethods(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        # Create user
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        user.first_name = 'temp_first'
+        user.last_name = 'temp_last'
+        user.save()
+        for codename in ['view_member', 'view_division', 'view_subscription', 'view_field_last_name', 'view_field_first_name', 'view_field_division', 'view_field_subscription']:
+            user.user_permissions.add(Permission.objects.get(codename=codename))
+        group = Group.objects.create(name='group')
+        group.user_set.add(user)
+
+        # login with user
+        self.client.login(username='temp', password='temppass')
+
+        global_preferences_registry.manager()['Finance__accounting_year'] = '2019'
+
+        self.division = Division.objects.create(name='Division')
+        self.division.groups.add(group)
+        self.restricted = Division.objects.create(name='Restricted')
+        self.restricted.user.add(User.objects.create_user('temp2', 'temp2@temp.tld', 'temp2pass'))
+        self.subscription = Subscription.objects.create(name='Subscription', amount=10)
+        for i in range(20):
+            member = Member.objects.create(first_name='first', last_name='last{}'.format(i))
+            member.division.add(self.division if i % 2 else self.restricted)
+            member.subscription.add(self.subscription)
+        self.member = member
+
+    def test_member_query_budgets(self):
+        "Member views should stay within their query budget"
+
+        self.assertQueryBudget('app:index')
+        response = self.assertQueryBudget('members:member_list')
+        self.assertContains(response, 'last19')
+        self.assertNotContains(response, 'last18')
+        self.assertQueryBudget('members:member_detail', kwargs={'pk': self.member.pk})
+
+    def test_division_query_budgets(self):
+        "Division and subscription views should stay within their query budget"
+
+        self.assertQueryBudget('members:division_list')
+        self.assertQueryBudget('members:division_detail', kwargs={'pk': self.division.pk})
+        self.assertQueryBudget('members:subscription_list')
+        self.assertQueryBudget('members:subscription_detail', kwargs={'pk': self.subscription.pk})
+
+class SerializerTestMethods(TestCase):
+    def setUp(self):
+        income = Account.objects.create(number='40000', name='Income', account_type=Account.INCOME)
+        debitor = Account.objects.create(number='10000', name='Debitor', account_type=Account.DEBITOR)
+        cost_center = CostCenter.objects.create(number='100', name='Center')
+        cost_object = CostObject.objects.create(number='200', name='Object')
+        divisions = [Division.objects.create(name='Division {}'.format(i)) for i in range(3)]
+        subscriptions = [
+            Subscription.objects.create(name='Subscription {}'.format(i), amount=10 + i, income_account=income, debitor_account=debitor, cost_center=cost_center, cost_object=cost_object)
+            for i in range(3)
+        ]
+        for i in range(30):
+            member = Member.objects.create(first_name='first', last_name='last{}'.format(i))
+            member.division.add(divisions[i % 3])
+            member.subscription.add(subscriptions[i % 3], subscriptions[(i + 1) % 3])
+
+    def test_member_serializer_queries(self):
+        "Serializing members should take a constant number of queries"
+
+        # Members, divisions and subscriptions with their accounts
+        with self.assertNumQueries(3):
+            data = MemberJSONSerializer().serialize(Member.objects.all())
+        self.assertEqual(len(data['members']), 30)
+        self.assertEqual(data['members'][0]['division'], [{'name': 'Division 0'}])
+        self.assertEqual(len(data['members'][0]['subscription']), 2)
+        self.assertEqual(data['members'][0]['subscription'][0]['income_account'], {'number': '40000', 'name': 'Income'})
+
+        with self.assertNumQueries(3):
+            data = MemberJSONSerializer().serialize(Member.objects.all()[:5])
+        self.assertEqual(len(data['members']), 5)
+
+    def test_subscription_serializer_queries(self):
+        "Serializing subscriptions should take one query"
+
+        with self.assertNumQueries(1):
+            data = SubscriptionJSONSerializer().serialize(Subscription.objects.all())
+        self.assertEqual(len(data['subscriptions']), 3)
+        self.assertEqual(data['subscriptions'][0]['cost_object'], {'number': '200', 'name': 'Object'})
@@ -14,6 +14,7 @@ from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib.auth.decorators import login_required, permission_required
 from django.http import HttpResponseForbidden, JsonResponse, HttpResponseBadRequest, HttpResponseRedirect
 from django.db import Error, connection
+from django.db.models import Count
 import os
 from django.conf import settings
 from sendfile import sendfile
@@ -27,17 +28,7 @@ class MemberIndexView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView)
     def get_context_data(self, **kwargs):
         context = super(MemberIndexView, self).get_context_data(**kwargs)
 
-        members = []
-        for member in Member.objects.all():
-            if member.division.all():
-               for division in member.division.all():
-                    if division.is_access_granted(self.request.user):
-                        members.append(member)
-                        break
-            else:
-                members.append(member)
-
-        context['members'] = members
+        context['members'] = Member.objects.accessible_by(self.request.user)
 
         return context
 
@@ -59,12 +50,7 @@ class MemberDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
         super_perm = super(MemberDetailView, self).has_permission()
 
         member = Member.objects.get(pk=self.kwargs['pk'])
-        if member.division.all():
-            for division in member.division.all():
-                if division.is_access_granted(self.request.user):
-                    return super_perm
-            return False
-        return super_perm
+        return super_perm and member.is_access_granted(self.request.user)
 
 # Edit-View.
 class MemberEditView(LoginRequiredMixin, PermissionRequiredMixin, SuccessMessageMixin, UpdateView):
@@ -82,12 +68,7 @@ class MemberEditView(LoginRequiredMixin, PermissionRequiredMixin, SuccessMessage
         super_perm = super(MemberEditView, self).has_permission()
 
         member = Member.objects.get(pk=self.kwargs['pk'])
-        if member.division.all():
-            for division in member.division.all():
-                if division.is_access_granted(self.request.user):
-                    return super_perm 
-            return False
-        return super_perm
+        return super_perm and member.is_access_granted(self.request.user)
 
     def form_valid(self, form):
         # Save validated data
@@ -123,14 +104,8 @@ def upload_file(request, pk):
         member = Member.objects.get(pk=pk)
 
         # Check if user can access member
-        if member.division.all():
-            access = False
-            for division in member.division.all():
-                if division.is_access_granted(request.user):
-                    access = True
-                    break
-            if not access:        
-                return HttpResponseForbidden()
+        if not member.is_access_granted(request.user):
+            return HttpResponseForbidden()
 
         try:
             file = File(member=member, file=request.FILES['file'])
@@ -157,14 +132,8 @@ def delete_file(request, pk):
         member = file.member
 
         # Check if user can access member
-        if member.division.all():
-            access = False
-            for division in member.division.all():
-                if division.is_access_granted(request.user):
-                    access = True
-                    break
-            if not access:        
-                return HttpResponseForbidden()
+        if not member.is_access_granted(request.user):
+            return HttpResponseForbidden()
 
         file.delete()
         if os.path.isfile(os.path.join(settings.MEDIA_ROOT, file.file.path)):
@@ -185,14 +154,8 @@ def download_file(request, pk):
     """
     file = File.objects.get(pk=pk)
     # Check if user can access member
-    if file.member.division.all():
-        access = False
-        for division in file.member.division.all():
-            if division.is_access_granted(request.user):
-                access = True
-                break
-        if not access:        
-            return HttpResponseForbidden()
+    if not file.member.is_access_granted(request.user):
+        return HttpResponseForbidden()
 
 
     file = file.file
@@ -209,12 +172,12 @@ class DivisionIndexView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
         context = super(DivisionIndexView, self).get_context_data(**kwargs)
 
         context['divisions'] = []
-        divisions = [division for division in Division.objects.all() if division.is_access_granted(self.request.user)]
+        divisions = Division.objects.filter(pk__in=Division.get_accessible_ids(self.request.user)).annotate(members=Count('member'))
         for division in divisions:
             context['divisions'].append({
                 'pk': division.pk,
                 'name': division.name,
-                'members': Member.objects.filter(division=division.pk).count()
+                'members': division.members
             })
 
         return context
@@ -275,11 +238,11 @@ class SubscriptionIndexView(LoginRequiredMixin, PermissionRequiredMixin, ListVie
         context = super(SubscriptionIndexView, self).get_context_data(**kwargs)
 
         context['subscriptions'] = []
-        for subscription in Subscription.objects.all():
+        for subscription in Subscription.objects.annotate(members=Count('member')):
             context['subscriptions'].append({
                 'pk': subscription.pk,
                 'name': subscription.name,
-                'members': Member.objects.filter(subscription=subscription.pk).count()
+                'members': subscription.members
             })
 
         return context
@@ -294,17 +257,7 @@ class SubscriptionDetailView(LoginRequiredMixin, PermissionRequiredMixin, Detail
     def get_context_data(self, **kwargs):
         context = super(SubscriptionDetailView, self).get_context_data(**kwargs)
 
-        members = []
-        for member in Member.objects.filter(subscription=self.object.pk):
-            if member.division.all():
-               for division in member.division.all():
-                    if division.is_access_granted(self.request.user):
-                        members.append(member)
-                        break
-            else:
-                members.append(member)
-                
-        context['members'] = members
+        context['members'] = Member.objects.filter(subscription=self.object.pk).accessible_by(self.request.user)
         return context
 
 # Edit-View.
@@ -62,6 +62,7 @@ MIDDLEWARE = [
     'author.middlewares.AuthorDefaultBackendMiddleware',
     'django_otp.middleware.OTPMiddleware',
     'simple_history.middleware.HistoryRequestMiddleware',
+    'utils.middleware.QueryCountMiddleware',
 ]
 
 ROOT_URLCONF = 'pyVerein.urls'
@@ -136,4 +137,48 @@ AUTHOR_UPDATED_BY_FIELD_NAME = 'last_modified_by'
 
 MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
 
-AUTH_USER_MODEL = 'account.User'
\ No newline at end of file
+AUTH_USER_MODEL = 'account.User'
+
+# Maximum size in bytes of the cached report data snapshots
+REPORT_SNAPSHOT_CACHE_SIZE = 100 * 1024 * 1024
+# Maximum size in bytes and age in seconds of the cached rendered reports
+REPORT_OUTPUT_CACHE_SIZE = 500 * 1024 * 1024
+REPORT_OUTPUT_MAX_AGE = 7 * 24 * 60 * 60
+# Number of background report runs shown per user
+REPORT_RUNS_SHOWN = 50
+
+# Local address of the report render service, e.g. ('localhost', 6543), rendered in the web process if not set or not running
+REPORT_RENDER_ADDRESS = None
+# Maximum number of reports the render service renders at once
+REPORT_RENDER_WORKERS = 2
+# Seconds to wait for the render service
+REPORT_RENDER_TIMEOUT = 300
+
+# Seconds between the heartbeats of a running background job
+JOB_HEARTBEAT_INTERVAL = 30
+# Running background jobs without heartbeat for this number of seconds are failed, e.g. if the worker was killed
+JOB_TIMEOUT = 300
+
+# Requests slower than this number of milliseconds are logged
+SLOW_REQUEST_THRESHOLD = 1000
+# Number of requests per view kept for the request statistics
+REQUEST_STATS_WINDOW = 100
+# Maximum number of SQL queries per view, independent of the amount of data
+QUERY_BUDGETS = {
+    'app:index': 12,
+    'members:member_list': 8,
+    'members:member_detail': 16,
+    'members:division_list': 8,
+    'members:division_detail': 12,
+    'members:subscription_list': 6,
+    'members:subscription_detail': 10,
+    'finance:creditor_list': 6,
+    'finance:creditor_detail': 12,
+    'finance:debitor_list': 6,
+    'finance:debitor_detail': 12,
+    'finance:impersonal_list': 6,
+    'finance:impersonal_detail': 12,
+    'finance:transaction_list': 6,
+    'finance:transaction_data': 6,
+    'finance:transaction_detail': 16,
+}
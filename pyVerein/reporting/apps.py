@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class ReportingConfig(AppConfig):
     name = 'reporting'
+
+    def ready(self):
+        # Track changes of all models report data depends on
+        from utils.signals import connect_version_signals
+        from .snapshots import get_dependencies
+        connect_version_signals(get_dependencies())
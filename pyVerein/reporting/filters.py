@@ -0,0 +1,78 @@
+"""
+Row filters of reports, which are applied to the report data in the database
+"""
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.utils.translation import ugettext_lazy as _
+from .snapshots import MODELS
+import re
+
+# One filter per line, e.g. TRA.accounting_year = $P{year}
+FILTER_PATTERN = re.compile(r'^(?P<model>[A-Z]{3})\.(?P<lookup>\w+)\s*=\s*(?P<value>.*)$')
+# Parameter binding, e.g. $P{year}
+PARAMETER_PATTERN = re.compile(r'\$P\{(\w+)\}')
+# Lookups, which may follow the field of a filter
+LOOKUPS = ('exact', 'iexact', 'in', 'gt', 'gte', 'lt', 'lte', 'startswith', 'istartswith', 'contains', 'icontains', 'isnull')
+
+def is_valid_lookup(model, lookup):
+    """
+    Returns whether lookup is a field of model, optionally followed by one of LOOKUPS.
+    Relations may only be followed to models, whose data is available to reports.
+    """
+    models = {options['model'] for options in MODELS.values()}
+    parts = lookup.split('__')
+    for index, part in enumerate(parts):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            # Only the last part may be a lookup
+            return index > 0 and index == len(parts) - 1 and part in LOOKUPS
+        if field.is_relation:
+            if field.related_model not in models:
+                return False
+            model = field.related_model
+        elif index < len(parts) - 1:
+            return index == len(parts) - 2 and parts[-1] in LOOKUPS
+    return True
+
+def parse_filters(text):
+    """
+    Returns the filters of text as list of (model, lookup, value).
+    Raises ValidationError if a line is no valid filter.
+    """
+    filters = []
+    for number, line in enumerate((text or '').splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        match = FILTER_PATTERN.match(line)
+        if not match or match.group('model') not in MODELS:
+            raise ValidationError(_('Invalid filter in line %(line)s'), params={'line': number})
+        model, lookup, value = match.group('model', 'lookup', 'value')
+        if not is_valid_lookup(MODELS[model]['model'], lookup):
+            raise ValidationError(_('Invalid field in line %(line)s'), params={'line': number})
+        if any(model == other_model and lookup == other_lookup for other_model, other_lookup, other_value in filters):
+            raise ValidationError(_('Duplicate filter in line %(line)s'), params={'line': number})
+        filters.append((model, lookup, value))
+    return filters
+
+def get_filter_parameters(filters):
+    """
+    Returns the names of the parameters bound by filters
+    """
+    return {name for model, lookup, value in filters for name in PARAMETER_PATTERN.findall(value)}
+
+def bind_filters(filters, parameters):
+    """
+    Returns the filter arguments per model with the parameter bindings replaced by the parameter values.
+    Values of __in lookups are comma separated, values of __isnull lookups true or false.
+    """
+    bound = {}
+    for model, lookup, value in filters:
+        value = PARAMETER_PATTERN.sub(lambda match: parameters.get(match.group(1), ''), value)
+        if lookup.endswith('__in'):
+            value = [item.strip() for item in value.split(',')]
+        elif lookup.endswith('__isnull'):
+            value = value.lower() in ('true', '1')
+        bound.setdefault(model, {})[lookup] = value
+    return bound
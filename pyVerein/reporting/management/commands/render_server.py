@@ -0,0 +1,20 @@
+"""
+Management command to run the report render service
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from reporting.render import RenderService
+
+class Command(BaseCommand):
+    help = 'Runs the local service rendering the reports of the reporting app'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.REPORT_RENDER_WORKERS, dest='workers', help='Maximum number of reports rendered at once')
+
+    def handle(self, *args, **options):
+        if not settings.REPORT_RENDER_ADDRESS:
+            raise CommandError('REPORT_RENDER_ADDRESS is not set.')
+
+        service = RenderService(settings.REPORT_RENDER_ADDRESS, options['workers'])
+        self.stdout.write('Render service listening on {} with {} workers.'.format(service.listener.address, options['workers']))
+        service.serve_forever()
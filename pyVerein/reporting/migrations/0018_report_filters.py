@@ -0,0 +1,23 @@
+# Generated by Django 2.1.15 on 2026-10-18 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0017_report_definition_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalreport',
+            name='filters',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='filters',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -4,8 +4,24 @@ from utils.models import ModelBase, AccessRestrictedModel
 from django.utils.translation import ugettext_lazy as _
 from django.forms import ValidationError
 import uuid
+import hashlib
+import os
+import json
 from separatedvaluesfield.models import SeparatedValuesField
 from author.decorators import with_author
+from pyreportjasper.jasperpy import JasperPy
+from tasks.models import Job
+from .filters import parse_filters, get_filter_parameters
+
+def get_file_hash(path, sha=None):
+    """
+    Returns the sha256 hash object updated with the content of the file at path
+    """
+    sha = sha if sha else hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha.update(chunk)
+    return sha
 
 def get_report_path(instance, filename):
     """
@@ -69,11 +85,84 @@ class Report(ModelBase, AccessRestrictedModel):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False)
 
     resources = models.CharField(blank=True, null=True, max_length=255)
+
+    # Row filters, one per line, e.g. TRA.accounting_year = $P{year}
+    filters = models.TextField(null=True, blank=True)
+
+    # Content hash of the report definition
+    definition_hash = models.CharField(blank=True, null=True, max_length=64, editable=False)
+    # Content hash of the resources
+    resources_hash = models.CharField(blank=True, null=True, max_length=64, editable=False)
+    # Parameters of the report definition as JSON list of [name, class, description]
+    parameters = models.TextField(blank=True, null=True, editable=False)
         
     def clean(self, *args, **kwargs):
         super(Report, self).clean(*args, **kwargs)
         if not self.report:
             raise ValidationError(_('Report must not be empty'))
+        try:
+            parse_filters(self.filters)
+        except ValidationError as err:
+            raise ValidationError({'filters': err.messages})
+
+    def save(self, *args, **kwargs):
+        super(Report, self).save(*args, **kwargs)
+        self.update_definition()
+
+    def get_resources_hash(self):
+        sha = hashlib.sha256()
+        for resource in Resource.objects.filter(report=self).order_by('pk'):
+            sha.update(resource.resource.name.encode('utf8'))
+            if os.path.isfile(resource.resource.path):
+                get_file_hash(resource.resource.path, sha)
+        return sha.hexdigest()
+
+    def read_parameters(self):
+        """
+        Returns the parameters of the report definition
+        """
+        return [[name] + values for name, values in JasperPy.list_parameters(self.report.path).items()]
+
+    def update_definition(self):
+        """
+        Update hashes and parameters if definition or resources changed and queue compiling the changed definition
+        """
+        changes = {}
+        definition_hash = get_file_hash(self.report.path).hexdigest() if self.report and os.path.isfile(self.report.path) else None
+        if definition_hash != self.definition_hash:
+            changes['definition_hash'] = definition_hash
+            changes['parameters'] = None
+        resources_hash = self.get_resources_hash()
+        if resources_hash != self.resources_hash:
+            changes['resources_hash'] = resources_hash
+        if not changes:
+            return
+
+        # Derived fields are updated without a new history record
+        Report.objects.filter(pk=self.pk).update(**changes)
+        for field, value in changes.items():
+            setattr(self, field, value)
+        if changes.get('definition_hash'):
+            Job.objects.enqueue('compile_report', report=self.pk)
+
+    def get_definition_parameters(self):
+        """
+        Returns the parameter names of the report definition, which are read once per definition
+        """
+        if self.parameters is None:
+            self.parameters = json.dumps(self.read_parameters())
+            Report.objects.filter(pk=self.pk, definition_hash=self.definition_hash).update(parameters=self.parameters)
+        return [parameter[0] for parameter in json.loads(self.parameters)]
+
+    def get_filters(self):
+        return parse_filters(self.filters)
+
+    def get_parameters(self):
+        """
+        Returns the parameter names of the report definition and of the filters
+        """
+        parameters = self.get_definition_parameters()
+        return parameters + sorted(get_filter_parameters(self.get_filters()) - set(parameters))
 
 def get_resource_path(instance, filename):
     """
@@ -0,0 +1,73 @@
+"""
+Cache for rendered report outputs
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils.translation import ugettext as _
+from .filters import bind_filters
+from .render import render_report
+from .snapshots import get_snapshot, evict_files
+import hashlib
+import json
+import os
+import uuid
+
+def get_output_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'protected', 'outputs')
+
+def get_output_key(report, parameters, file_format, data_filepath):
+    """
+    Returns the key of the output of report with the given parameters, format and data snapshot
+    """
+    key = json.dumps([str(report.uuid), report.definition_hash, report.resources_hash, report.jsonql_query, sorted(parameters.items()), file_format, os.path.basename(data_filepath)])
+    return hashlib.sha256(key.encode('utf8')).hexdigest()
+
+def get_output(report, parameters, file_format):
+    """
+    Returns the path of the rendered report. Reports are rendered again only if the definition,
+    the resources, the query, the parameters, the format or the data changed.
+    Raises NameError if the report could not be rendered.
+    """
+    try:
+        data_filepath = get_snapshot(report.model, filters=bind_filters(report.get_filters(), parameters))
+    except (ValueError, ValidationError) as err:
+        raise NameError(_('Invalid filter value: {}').format(err))
+    # Parameters which are only used by filters are not passed to the report
+    definition_parameters = report.get_definition_parameters()
+    parameters = {name: value for name, value in parameters.items() if name in definition_parameters}
+    output_filepath = os.path.join(get_output_dir(), '{}.{}'.format(get_output_key(report, parameters, file_format, data_filepath), file_format))
+    if report.definition_hash and os.path.isfile(output_filepath):
+        # Mark output as recently used
+        os.utime(output_filepath)
+        return output_filepath
+
+    # Render to temporary file first, so concurrent runs never send a partial output
+    os.makedirs(get_output_dir(), exist_ok=True)
+    temp_filepath = '{}.{}.tmp'.format(os.path.splitext(output_filepath)[0], uuid.uuid4())
+    try:
+        render_report(
+            input_file=report.report.path,
+            output_file=temp_filepath,
+            format_list=[file_format],
+            db_connection={
+                'driver': 'jsonql',
+                'data_file': data_filepath,
+                'jsonql_query': report.jsonql_query
+            },
+            resource=os.path.join(settings.MEDIA_ROOT, 'protected/reports/{}/resource/'.format(report.uuid)),
+            parameters=parameters
+        )
+        os.replace('{}.{}'.format(temp_filepath, file_format), output_filepath)
+    finally:
+        if os.path.exists('{}.{}'.format(temp_filepath, file_format)):
+            os.remove('{}.{}'.format(temp_filepath, file_format))
+
+    evict_outputs(keep=output_filepath)
+
+    return output_filepath
+
+def evict_outputs(keep=None, max_age=None):
+    """
+    Delete expired and least recently used outputs until their total size is below the limit
+    """
+    evict_files(get_output_dir(), settings.REPORT_OUTPUT_CACHE_SIZE, max_age if max_age is not None else settings.REPORT_OUTPUT_MAX_AGE, keep)
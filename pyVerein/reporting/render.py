@@ -0,0 +1,122 @@
+"""
+Rendering of jasper reports, locally or by the render service
+"""
+from django.conf import settings
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from concurrent.futures import ThreadPoolExecutor
+from pyreportjasper.jasperpy import JasperPy
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+class Renderer:
+    """
+    Renders reports with jasperstarter, compiling every report definition only once
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.compiled = {}
+
+    def compile(self, input_file):
+        """
+        Returns the compiled report of input_file. The compiled report is stored next to the definition
+        and compiled again if the definition changed.
+        """
+        if not input_file.endswith('.jrxml'):
+            return input_file
+
+        compiled_file = os.path.splitext(input_file)[0] + '.jasper'
+        key = (input_file, os.path.getmtime(input_file))
+        with self.lock:
+            if self.compiled.get(input_file) == key and os.path.isfile(compiled_file):
+                return compiled_file
+
+            if not os.path.isfile(compiled_file) or os.path.getmtime(compiled_file) < key[1]:
+                JasperPy().compile(input_file)
+            if not os.path.isfile(compiled_file):
+                # Process uncompiled definition, if jasperstarter wrote the compiled report elsewhere
+                return input_file
+
+            self.compiled[input_file] = key
+        return compiled_file
+
+    def render(self, input_file, output_file, format_list, parameters, db_connection, resource):
+        JasperPy().process(
+            input_file=self.compile(input_file),
+            output_file=output_file,
+            format_list=format_list,
+            db_connection=db_connection,
+            resource=resource,
+            parameters=parameters
+        )
+
+# Renderer used if no render service is running
+local_renderer = Renderer()
+
+def get_authkey():
+    return settings.SECRET_KEY.encode('utf8')
+
+def render_report(**job):
+    """
+    Render report by the render service, if it is configured and running, otherwise in this process.
+    Raises NameError if the report could not be rendered, like JasperPy.
+    """
+    address = settings.REPORT_RENDER_ADDRESS
+    if address:
+        try:
+            connection = Client(address, authkey=get_authkey())
+        except OSError:
+            logger.warning('Render service at %s is not running, rendering report locally', address)
+        else:
+            with connection:
+                connection.send(job)
+                if not connection.poll(settings.REPORT_RENDER_TIMEOUT):
+                    raise NameError('Report rendering timed out!')
+                result = connection.recv()
+            if result['state'] != 'Success':
+                raise NameError(result['error'])
+            return
+
+    local_renderer.render(**job)
+
+class RenderService:
+    """
+    Long-lived render service, which accepts render jobs on a local address and
+    renders at most workers reports at once
+    """
+    def __init__(self, address, workers):
+        self.listener = Listener(address, authkey=get_authkey())
+        self.renderer = Renderer()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def handle(self, connection):
+        with connection:
+            try:
+                job = connection.recv()
+                self.renderer.render(**job)
+                result = {'state': 'Success'}
+            except EOFError:
+                return
+            except Exception as err:
+                logger.exception('Rendering report failed')
+                result = {'state': 'Error', 'error': str(err)}
+            try:
+                connection.send(result)
+            except OSError:
+                # Client gave up waiting
+                pass
+
+    def serve_forever(self):
+        with self.listener:
+            while True:
+                try:
+                    connection = self.listener.accept()
+                except (OSError, AuthenticationError):
+                    # Failed authentication or broken connection
+                    logger.warning('Rejected connection to render service')
+                    continue
+                # Jobs wait in the executor queue until a worker is free
+                self.executor.submit(self.handle, connection)
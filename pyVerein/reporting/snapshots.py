@@ -0,0 +1,169 @@
+"""
+Snapshot cache for report data
+"""
+from django.conf import settings
+from django.utils import translation
+from dynamic_preferences.models import GlobalPreferenceModel
+from members.models import Member, Division, Subscription
+from members.serializer import MemberJSONSerializer, DivisionJSONSerializer, SubscriptionJSONSerializer
+from finance.models import Transaction, Account, CostCenter, CostObject, ClosureBalance, ClosureTransaction
+from finance.serializer import TransactionJSONSerializer, AccountJSONSerializer, CostCenterJSONSerializer, CostObjectJSONSerializer, ClosureBalanceJSONSerializer, ClosureTransactionJSONSerializer
+from utils.models import ModelVersion
+from utils.serializer import iterate_json
+import hashlib
+import io
+import json
+import os
+import time
+import uuid
+
+# Serializable models with the models their data depends on
+MODELS = {
+    'MEM': {
+        'model': Member,
+        'serializer': MemberJSONSerializer,
+        'permission': 'reporting.download_member_data',
+        'dependencies': [Member, Member.division.through, Division, Member.subscription.through, Subscription, Account, CostCenter, CostObject, GlobalPreferenceModel],
+    },
+    'DIV': {
+        'model': Division,
+        'serializer': DivisionJSONSerializer,
+        'permission': 'reporting.download_division_data',
+        'dependencies': [Division],
+    },
+    'SUB': {
+        'model': Subscription,
+        'serializer': SubscriptionJSONSerializer,
+        'permission': 'reporting.download_subscription_data',
+        'dependencies': [Subscription, Account, CostCenter, CostObject, GlobalPreferenceModel],
+    },
+    'ACC': {
+        'model': Account,
+        'serializer': AccountJSONSerializer,
+        'permission': 'reporting.download_account_data',
+        'dependencies': [Account],
+    },
+    'COC': {
+        'model': CostCenter,
+        'serializer': CostCenterJSONSerializer,
+        'permission': 'reporting.download_costcenter_data',
+        'dependencies': [CostCenter],
+    },
+    'COO': {
+        'model': CostObject,
+        'serializer': CostObjectJSONSerializer,
+        'permission': 'reporting.download_costobject_data',
+        'dependencies': [CostObject],
+    },
+    'TRA': {
+        'model': Transaction,
+        'serializer': TransactionJSONSerializer,
+        'permission': 'reporting.download_transaction_data',
+        'dependencies': [Transaction, Account, CostCenter, CostObject],
+    },
+    'CTR': {
+        'model': ClosureTransaction,
+        'serializer': ClosureTransactionJSONSerializer,
+        'permission': 'reporting.download_closuretransaction_data',
+        'dependencies': [ClosureTransaction],
+    },
+    'CBA': {
+        'model': ClosureBalance,
+        'serializer': ClosureBalanceJSONSerializer,
+        'permission': 'reporting.download_closurebalance_data',
+        'dependencies': [ClosureBalance],
+    }
+}
+
+def get_dependencies(models=None):
+    """
+    Returns all models the data of the given model keys depends on
+    """
+    dependencies = []
+    for model in sorted(set(models if models is not None else MODELS)):
+        for dependency in MODELS[model]['dependencies']:
+            if dependency not in dependencies:
+                dependencies.append(dependency)
+    return dependencies
+
+def get_snapshot_dir():
+    return os.path.join(settings.MEDIA_ROOT, 'protected', 'snapshots')
+
+def get_snapshot_key(models, limit=None, filters=None):
+    """
+    Returns the key of the snapshot of the given models in their current version
+    """
+    versions = ModelVersion.objects.get_versions(get_dependencies(models))
+    filters = sorted((model, sorted(lookups.items())) for model, lookups in (filters or {}).items() if model in models)
+    key = json.dumps([sorted(set(models)), limit, filters, translation.get_language(), sorted(versions.items())])
+    return hashlib.sha1(key.encode('utf8')).hexdigest()
+
+def get_snapshot(models, limit=None, filters=None):
+    """
+    Returns the path of a JSON file with the data of the given models, optionally filtered by
+    the lookups in filters per model. The file is reused until one of the models the data depends on changes.
+    """
+    # The versions are read before the data, so later changes always lead to a new key
+    filepath = os.path.join(get_snapshot_dir(), get_snapshot_key(models, limit, filters) + '.json')
+    if os.path.isfile(filepath):
+        # Mark snapshot as recently used
+        os.utime(filepath)
+        return filepath
+
+    sections = []
+    for model in sorted(set(models)):
+        queryset = MODELS[model]['model'].objects.all()
+        if (filters or {}).get(model):
+            # Lookups across many-to-many and reverse relations would duplicate rows
+            queryset = queryset.filter(**filters[model]).distinct()
+        sections.append((MODELS[model]['serializer'](), queryset[:limit] if limit else queryset))
+
+    # Stream to temporary file first, so concurrent runs never read a partial snapshot
+    os.makedirs(get_snapshot_dir(), exist_ok=True)
+    temp_filepath = '{}.{}.tmp'.format(filepath, uuid.uuid4())
+    try:
+        with io.open(temp_filepath, 'w', encoding='utf8') as f:
+            for chunk in iterate_json(sections):
+                f.write(chunk)
+        os.replace(temp_filepath, filepath)
+    finally:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+
+    evict_snapshots(keep=filepath)
+
+    return filepath
+
+def evict_files(directory, max_size, max_age=None, keep=None):
+    """
+    Delete files older than max_age seconds and least recently used files until their total size is below max_size.
+    Temporary files are only deleted if they are expired.
+    """
+    if not os.path.isdir(directory):
+        return
+
+    files = []
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for mtime, size, path in files)
+    expired_before = time.time() - max_age if max_age is not None else None
+    for mtime, size, path in sorted(files):
+        expired = expired_before is not None and mtime < expired_before
+        if not expired and total_size <= max_size:
+            break
+        if path == keep or (not expired and '.tmp' in os.path.basename(path)):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+def evict_snapshots(keep=None, max_size=None, max_age=None):
+    """
+    Delete least recently used snapshots until their total size is below max_size
+    """
+    evict_files(get_snapshot_dir(), max_size if max_size is not None else settings.REPORT_SNAPSHOT_CACHE_SIZE, max_age, keep)
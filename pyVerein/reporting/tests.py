@@ -9,6 +9,20 @@ from django.conf import settings
 from shutil import rmtree
 from django.contrib.auth.models import Group
 import itertools
+import json
+import os
+from members.models import Member, Division
+from finance.models import ClosureBalance
+from .snapshots import get_snapshot, evict_snapshots
+from .render import RenderService, render_report, local_renderer
+from .outputs import get_output, get_output_dir, evict_outputs
+from .filters import parse_filters
+from django.core.exceptions import ValidationError
+from multiprocessing.connection import Listener
+from unittest import mock
+import threading
+from tasks.models import Job
+from tasks.jobs import run_next_job
 
 class ReportTestMethods(TestCase):
     @classmethod
@@ -290,17 +304,18 @@ class ReportTestMethods(TestCase):
         }
 
 
-        for model in permissionmap:
-            response = self.client.post(reverse('reporting:download_data'), {'models': model, 'records': 'all'})
-            self.assertEqual(response.status_code, 403)
-
-            for permission in permissions:
-                p = Permission.objects.get(codename=permission)
-                user.user_permissions.add(p)
+        with self.settings(MEDIA_ROOT=self.temp_dir):
+            for model in permissionmap:
                 response = self.client.post(reverse('reporting:download_data'), {'models': model, 'records': 'all'})
-                self.assertEqual(response.status_code, 200 if permission == permissionmap[model] else 403)
+                self.assertEqual(response.status_code, 403)
 
-                user.user_permissions.remove(p)
+                for permission in permissions:
+                    p = Permission.objects.get(codename=permission)
+                    user.user_permissions.add(p)
+                    response = self.client.post(reverse('reporting:download_data'), {'models': model, 'records': 'all'})
+                    self.assertEqual(response.status_code, 200 if permission == permissionmap[model] else 403)
+
+                    user.user_permissions.remove(p)
     
     def test_report_resource_upload_permission(self):
         "User should only be able to upload resources if permission is set"
@@ -476,3 +491,316 @@ class ReportTestMethods(TestCase):
             report.groups.add(group)
             response = self.client.post(reverse('reporting:delete_resource', args={Resource.objects.filter(report=Report.objects.get(name='testreport')).first().pk}))
             self.assertEqual(response.status_code, 302)
+
+class SnapshotTestMethods(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.temp_dir)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        rmtree(self.temp_dir)
+
+    def test_snapshot_reuse(self):
+        "Snapshots should be reused until a model the data depends on changes"
+
+        division = Division.objects.create(name='Division')
+        snapshot = get_snapshot(['DIV'])
+        with open(snapshot) as f:
+            self.assertEqual(json.load(f), {'divisions': [{'name': 'Division'}]})
+        self.assertEqual(get_snapshot(['DIV']), snapshot)
+
+        Division.objects.create(name='Division 2')
+        new_snapshot = get_snapshot(['DIV'])
+        self.assertNotEqual(new_snapshot, snapshot)
+        with open(new_snapshot) as f:
+            self.assertEqual(len(json.load(f)['divisions']), 2)
+
+        member = Member.objects.create(first_name='first', last_name='last')
+        member_snapshot = get_snapshot(['MEM'])
+        member.division.add(division)
+        self.assertNotEqual(get_snapshot(['MEM']), member_snapshot)
+        self.assertEqual(get_snapshot(['DIV']), new_snapshot)
+
+    def test_snapshot_closure_balances(self):
+        "Closure balances should be serialized into snapshots"
+
+        ClosureBalance.objects.create(year=2018, claims=10, liabilities=5)
+        with open(get_snapshot(['CBA'])) as f:
+            self.assertEqual(json.load(f), {'closure_balances': [{'year': 2018, 'claims': '10.00', 'liabilities': '5.00'}]})
+
+    def test_snapshot_filter_distinct(self):
+        "Filtered snapshots should contain objects matching several related objects once"
+
+        member = Member.objects.create(first_name='first', last_name='last')
+        member.division.add(Division.objects.create(name='A'), Division.objects.create(name='B'))
+        with open(get_snapshot(['MEM'], filters={'MEM': {'division__name__in': ['A', 'B']}})) as f:
+            self.assertEqual(len(json.load(f)['members']), 1)
+
+    def test_snapshot_eviction(self):
+        "Least recently used snapshots should be deleted if the cache is too large"
+
+        snapshot = get_snapshot(['DIV'])
+        os.utime(snapshot, (0, 0))
+        other_snapshot = get_snapshot(['ACC'])
+
+        evict_snapshots(max_size=os.path.getsize(other_snapshot))
+        self.assertFalse(os.path.exists(snapshot))
+        self.assertTrue(os.path.exists(other_snapshot))
+
+        evict_snapshots(max_size=0, keep=other_snapshot)
+        self.assertTrue(os.path.exists(other_snapshot))
+
+class RenderServiceTestMethods(TestCase):
+    def setUp(self):
+        self.jobs = []
+        self.service = RenderService(('localhost', 0), 1)
+        self.service.renderer.render = self.render
+        threading.Thread(target=self.service.serve_forever, daemon=True).start()
+
+    def render(self, **job):
+        if job['input_file'] == 'broken.jrxml':
+            raise NameError('Broken report')
+        self.jobs.append(job)
+
+    def get_job(self, input_file):
+        return {
+            'input_file': input_file,
+            'output_file': 'output',
+            'format_list': ['pdf'],
+            'parameters': {},
+            'db_connection': {},
+            'resource': ''
+        }
+
+    def test_render_service(self):
+        "Reports should be rendered by the render service and errors be raised"
+
+        with self.settings(REPORT_RENDER_ADDRESS=self.service.listener.address):
+            render_report(**self.get_job('report.jrxml'))
+            self.assertEqual(self.jobs, [self.get_job('report.jrxml')])
+
+            with self.assertRaisesMessage(NameError, 'Broken report'):
+                render_report(**self.get_job('broken.jrxml'))
+
+    def test_render_fallback(self):
+        "Reports should be rendered locally if the render service is not running"
+
+        listener = Listener(('localhost', 0))
+        address = listener.address
+        listener.close()
+        with self.settings(REPORT_RENDER_ADDRESS=address), mock.patch.object(local_renderer, 'render', self.render):
+            render_report(**self.get_job('report.jrxml'))
+        self.assertEqual(self.jobs, [self.get_job('report.jrxml')])
+
+class ReportDefinitionTestMethods(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.temp_dir)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        rmtree(self.temp_dir)
+
+    def get_definition(self, *parameters):
+        return SimpleUploadedFile('report.jrxml', bytes(
+            '<jasperReport xmlns="http://jasperreports.sourceforge.net/jasperreports">{}</jasperReport>'.format(
+                ''.join('<parameter name="{}" class="java.lang.String"/>'.format(parameter) for parameter in parameters)
+            ), 'utf-8'))
+
+    def test_report_parameters(self):
+        "Parameters should be read once per definition and compiling be queued on change"
+
+        report = Report.objects.create(name='report', model='MEM', jsonql_query='members', report=self.get_definition('year', 'month'))
+        self.assertEqual(Job.objects.filter(name='compile_report').count(), 1)
+        self.assertEqual(report.get_parameters(), ['year', 'month'])
+
+        report = Report.objects.get(pk=report.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(report.get_parameters(), ['year', 'month'])
+
+        report.name = 'renamed'
+        report.save()
+        self.assertEqual(Job.objects.filter(name='compile_report').count(), 1)
+
+        report.report = self.get_definition('year')
+        report.save()
+        self.assertEqual(Job.objects.filter(name='compile_report').count(), 2)
+        self.assertEqual(Report.objects.get(pk=report.pk).get_parameters(), ['year'])
+
+    def test_report_resources_hash(self):
+        "Resources hash should change with the resources"
+
+        report = Report.objects.create(name='report', model='MEM', jsonql_query='members', report=self.get_definition())
+        resources_hash = report.resources_hash
+        Resource.objects.create(report=report, resource=SimpleUploadedFile('logo.png', b'logo'))
+        report.save()
+        self.assertNotEqual(report.resources_hash, resources_hash)
+        self.assertEqual(Report.objects.get(pk=report.pk).resources_hash, report.resources_hash)
+
+class OutputCacheTestMethods(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.temp_dir)
+        self.settings_override.enable()
+        self.report = Report.objects.create(name='report', model='DIV', jsonql_query='divisions', report=SimpleUploadedFile('report.jrxml', bytes(
+            '<jasperReport xmlns="http://jasperreports.sourceforge.net/jasperreports"><parameter name="year" class="java.lang.String"/></jasperReport>', 'utf-8')))
+        self.renders = []
+
+    def tearDown(self):
+        self.settings_override.disable()
+        rmtree(self.temp_dir)
+
+    def render(self, output_file, format_list, **kwargs):
+        self.renders.append(output_file)
+        with open('{}.{}'.format(output_file, format_list[0]), 'w') as f:
+            f.write('output')
+
+    def test_output_cache(self):
+        "Outputs should be rendered again only if parameters, format or data changed"
+
+        with mock.patch('reporting.outputs.render_report', self.render):
+            output = get_output(self.report, {'year': '2019'}, 'pdf')
+            self.assertEqual(get_output(self.report, {'year': '2019'}, 'pdf'), output)
+            self.assertEqual(len(self.renders), 1)
+
+            self.assertNotEqual(get_output(self.report, {'year': '2018'}, 'pdf'), output)
+            self.assertNotEqual(get_output(self.report, {'year': '2019'}, 'csv'), output)
+            self.assertEqual(len(self.renders), 3)
+
+            Division.objects.create(name='Division')
+            self.assertNotEqual(get_output(self.report, {'year': '2019'}, 'pdf'), output)
+            self.assertEqual(len(self.renders), 4)
+        self.assertEqual(len(os.listdir(get_output_dir())), 4)
+
+    def test_output_cache_query(self):
+        "Outputs should be rendered again if the query changed"
+
+        with mock.patch('reporting.outputs.render_report', self.render):
+            output = get_output(self.report, {'year': '2019'}, 'pdf')
+            self.report.jsonql_query = 'divisions[*]'
+            self.report.save()
+            self.assertNotEqual(get_output(Report.objects.get(pk=self.report.pk), {'year': '2019'}, 'pdf'), output)
+            self.assertEqual(len(self.renders), 2)
+
+    def test_output_eviction(self):
+        "Expired outputs should be deleted"
+
+        with mock.patch('reporting.outputs.render_report', self.render):
+            output = get_output(self.report, {'year': '2019'}, 'pdf')
+            other_output = get_output(self.report, {'year': '2018'}, 'pdf')
+        os.utime(output, (0, 0))
+
+        evict_outputs(max_age=60)
+        self.assertFalse(os.path.exists(output))
+        self.assertTrue(os.path.exists(other_output))
+
+class ReportRunTestMethods(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.temp_dir)
+        self.settings_override.enable()
+
+        # Create user
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        user.first_name = 'temp_first'
+        user.last_name = 'temp_last'
+        user.save()
+        user.user_permissions.add(Permission.objects.get(codename='view_report'))
+        user.user_permissions.add(Permission.objects.get(codename='run_report'))
+        self.user = user
+
+        # login with user
+        self.client.login(username='temp', password='temppass')
+
+        self.report = Report.objects.create(name='report', model='DIV', jsonql_query='divisions', report=SimpleUploadedFile('report.jrxml', bytes(
+            '<jasperReport xmlns="http://jasperreports.sourceforge.net/jasperreports"><parameter name="year" class="java.lang.String"/></jasperReport>', 'utf-8')))
+        # Compiling needs jasperstarter
+        Job.objects.filter(name='compile_report').delete()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        rmtree(self.temp_dir)
+
+    def render(self, output_file, format_list, **kwargs):
+        with open('{}.{}'.format(output_file, format_list[0]), 'w') as f:
+            f.write('output')
+
+    def test_background_run(self):
+        "Reports should be rendered in background and be downloadable by the user who started the run"
+
+        response = self.client.post(reverse('reporting:run', kwargs={'pk': self.report.pk}), {'year': '2019', 'format': 'pdf', 'background': '1'})
+        self.assertRedirects(response, reverse('reporting:runs'))
+        job = Job.objects.get(name='render_report')
+        self.assertEqual(job.get_parameters(), {'report': self.report.pk, 'parameters': {'year': '2019'}, 'file_format': 'pdf'})
+
+        response = self.client.get(reverse('reporting:runs'))
+        self.assertContains(response, 'report')
+        self.assertTrue(response.context['running'])
+        self.assertEqual(self.client.get(reverse('reporting:run_download', kwargs={'pk': job.pk})).status_code, 404)
+
+        with mock.patch('reporting.outputs.render_report', self.render):
+            job = run_next_job()
+        self.assertEqual(job.state, Job.SUCCESS)
+
+        response = self.client.get(reverse('reporting:runs'))
+        self.assertFalse(response.context['running'])
+        self.assertContains(response, reverse('reporting:run_download', kwargs={'pk': job.pk}))
+        response = self.client.get(reverse('reporting:run_download', kwargs={'pk': job.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'output')
+
+        User.objects.create_user('temp2', 'temp2@temp.tld', 'temp2pass').user_permissions.add(*self.user.user_permissions.all())
+        self.client.login(username='temp2', password='temp2pass')
+        self.assertEqual(self.client.get(reverse('reporting:run_download', kwargs={'pk': job.pk})).status_code, 403)
+        self.assertNotContains(self.client.get(reverse('reporting:runs')), reverse('reporting:run_download', kwargs={'pk': job.pk}))
+
+class ReportFilterTestMethods(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.temp_dir)
+        self.settings_override.enable()
+        for name in ('Football', 'Handball', 'Tennis'):
+            Division.objects.create(name=name)
+        self.report = Report.objects.create(name='report', model='DIV', jsonql_query='divisions', filters='DIV.name__startswith = $P{prefix}\n# comment\nDIV.name__in = Football, Handball', report=SimpleUploadedFile('report.jrxml', bytes(
+            '<jasperReport xmlns="http://jasperreports.sourceforge.net/jasperreports"><parameter name="year" class="java.lang.String"/></jasperReport>', 'utf-8')))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        rmtree(self.temp_dir)
+
+    def render(self, output_file, format_list, parameters, db_connection, **kwargs):
+        self.parameters = parameters
+        with open(db_connection['data_file']) as f:
+            self.data = json.load(f)
+        with open('{}.{}'.format(output_file, format_list[0]), 'w') as f:
+            f.write('output')
+
+    def test_parse_filters(self):
+        "Filters should be parsed and invalid filters be rejected"
+
+        self.assertEqual(parse_filters('TRA.accounting_year = $P{year}\n\nTRA.cost_center__number=100'), [('TRA', 'accounting_year', '$P{year}'), ('TRA', 'cost_center__number', '100')])
+        self.assertEqual(parse_filters('MEM.division__name__in = A, B\nTRA.cost_center__isnull = true'), [('MEM', 'division__name__in', 'A, B'), ('TRA', 'cost_center__isnull', 'true')])
+        for filters in ('TRA.accounting_year', 'XXX.name = 1', 'TRA.unknown = 1', 'TRA.account__unknown = 1', 'TRA.text__regex = 1', 'TRA.text__exact__exact = 1', 'TRA.date__year = 2019',
+                        'MEM.created_by__password__startswith = $P{x}', 'DIV.user__username = admin', 'MEM.file__file__startswith = x',
+                        'DIV.name = A\nDIV.name = B'):
+            with self.assertRaises(ValidationError):
+                parse_filters(filters)
+
+        self.report.filters = 'TRA.unknown = 1'
+        with self.assertRaises(ValidationError):
+            self.report.full_clean()
+
+    def test_filtered_output(self):
+        "Filters should be applied to the report data and filter parameters not be passed to the report"
+
+        self.assertEqual(self.report.get_parameters(), ['year', 'prefix'])
+        with mock.patch('reporting.outputs.render_report', self.render):
+            get_output(self.report, {'year': '2019', 'prefix': 'F'}, 'pdf')
+            self.assertEqual(self.data, {'divisions': [{'name': 'Football'}]})
+            self.assertEqual(self.parameters, {'year': '2019'})
+
+            get_output(self.report, {'year': '2019', 'prefix': 'T'}, 'pdf')
+            self.assertEqual(self.data, {'divisions': []})
@@ -12,6 +12,8 @@ urlpatterns = [
     path('<int:pk>/', views.ReportDetailView.as_view(), name='detail'),
     path('edit/<int:pk>/', views.ReportEditView.as_view(), name='edit'),
     path('run/<int:pk>/', views.run_report, name='run'),
+    path('runs/', views.ReportRunIndexView.as_view(), name='runs'),
+    path('runs/<int:pk>/download/', views.download_run, name='run_download'),
     path('download_report/<int:pk>/', views.download_report, name='download_report'),
     path('upload_resource/<int:pk>/', views.upload_resource, name='upload_resource'),
     path('delete_resource/<int:pk>/', views.delete_resource, name='delete_resource'),
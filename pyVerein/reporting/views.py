@@ -7,10 +7,9 @@ from django.db import Error
 # Import Report.
 from .forms import ReportForm, ResourceForm
 from .models import Report, Resource
-from members.models import Member, Division, Subscription
-from members.serializer import MemberJSONSerializer, DivisionJSONSerializer, SubscriptionJSONSerializer
-from finance.models import Transaction, Account, CostCenter, CostObject, ClosureBalance, ClosureTransaction
-from finance.serializer import TransactionJSONSerializer, AccountJSONSerializer, CostCenterJSONSerializer, CostObjectJSONSerializer, ClosureBalanceJSONSerializer, ClosureTransactionJSONSerializer
+from .snapshots import MODELS, get_snapshot
+from .outputs import get_output
+from tasks.models import Job
 import os
 from django.conf import settings
 
@@ -19,12 +18,12 @@ from django.utils.translation import ugettext_lazy as _
 
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
 from sendfile import sendfile
 import io
 import uuid
 import json
-from pyreportjasper.jasperpy import JasperPy, FORMATS as JASPER_FORMATS
+from pyreportjasper.jasperpy import FORMATS as JASPER_FORMATS
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib import messages
 import os
@@ -182,10 +181,7 @@ def run_report(request, pk):
     if not report.is_access_granted(request.user):
         return HttpResponseForbidden()
     
-    # Get report definition
-    report_definition = report.report.path
-    jasperpy = JasperPy()
-    parameters = jasperpy.list_parameters(report_definition).keys()
+    parameters = report.get_parameters()
     if request.method == 'GET':
         context = {
             'report': report,
@@ -208,78 +204,61 @@ def run_report(request, pk):
         file_format = request.POST.get('format', None)
         if not file_format:
             return HttpResponseBadRequest()
-        # Create data-JSON file
-        modelmap = {
-            'MEM': {
-                'model': Member,
-                'serializer': MemberJSONSerializer,
-            },
-            'DIV': {
-                'model': Division,
-                'serializer': DivisionJSONSerializer,
-            },
-            'SUB': {
-                'model': Subscription,
-                'serializer': SubscriptionJSONSerializer,
-            },
-            'ACC': {
-                'model': Account,
-                'serializer': AccountJSONSerializer,
-            },
-            'COC': {
-                'model': CostCenter,
-                'serializer': CostCenterJSONSerializer,
-            },
-            'COO': {
-                'model': CostObject,
-                'serializer': CostObjectJSONSerializer,
-            },
-            'TRA': {
-                'model': Transaction,
-                'serializer': TransactionJSONSerializer,
-            },
-            'CTR': {
-                'model': ClosureTransaction,
-                'serializer': ClosureTransactionJSONSerializer,
-            },
-            'CBA': {
-                'model': ClosureBalance,
-                'serializer': ClosureBalanceJSONSerializer,
-            }
-        }
-        json_data = {}
-        for model in set(report.model):
-            json_data.update(modelmap[model]['serializer']().serialize(modelmap[model]['model'].objects.all()))
-        # Write JSON-data
-        data_filepath = os.path.join(settings.MEDIA_ROOT, "protected/reports/{}/data/{}".format(report.uuid, str(uuid.uuid4()) + '.json'))
-        os.makedirs(os.path.dirname(data_filepath), exist_ok=True)
-        with io.open(data_filepath, 'w', encoding='utf8') as f:
-            f.write(json.dumps(json_data))
-        
-        # Output file
-        output_filepath = os.path.join(settings.MEDIA_ROOT, "protected/reports/{}/output/{}-{}".format(report.uuid, report.name, str(uuid.uuid4())))
-        os.makedirs(os.path.dirname(output_filepath), exist_ok=True)
+        if request.POST.get('background', None):
+            Job.objects.enqueue('render_report', user=request.user, report=report.pk, parameters=parameter_map, file_format=file_format)
+            messages.success(request, _('Report is rendered in background'))
+            return HttpResponseRedirect(reverse_lazy('reporting:runs'))
+
         try:
-            jasperpy.process(
-                input_file=report_definition,
-                output_file=output_filepath,
-                format_list=[file_format],
-                db_connection={
-                    'driver': 'jsonql',
-                    'data_file': data_filepath,
-                    'jsonql_query': report.jsonql_query
-                },
-                resource=os.path.join(settings.MEDIA_ROOT, 'protected/reports/{}/resource/'.format(report.uuid)),
-                parameters=parameter_map
-            )
+            output_filepath = get_output(report, parameter_map, file_format)
         except NameError as err:
             messages.error(request, err)
             return HttpResponseRedirect(reverse_lazy('reporting:run', kwargs={'pk': pk}))
 
-        return sendfile(request, output_filepath + '.' + file_format)
+        return sendfile(request, output_filepath)
     else:
         return HttpResponseBadRequest()
 
+class ReportRunIndexView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
+    """
+    List of the reports rendered in background by the user
+    """
+    permission_required = ('reporting.view_report', 'reporting.run_report')
+    template_name = 'reporting/runs.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(ReportRunIndexView, self).get_context_data(**kwargs)
+
+        jobs = list(Job.objects.filter(name='render_report', user=self.request.user).order_by('-created_at')[:settings.REPORT_RUNS_SHOWN])
+        reports = Report.objects.in_bulk([job.get_parameters()['report'] for job in jobs])
+        context['runs'] = [{
+            'job': job,
+            'report': reports.get(job.get_parameters()['report']),
+            'format': job.get_parameters()['file_format'],
+        } for job in jobs]
+        context['running'] = any(not job.is_finished() for job in jobs)
+
+        return context
+
+@login_required
+@permission_required(['reporting.view_report', 'reporting.run_report'], raise_exception=True)
+def download_run(request, pk):
+    """
+    Download the output of a report rendered in background with X-SENDFILE header
+    """
+    job = get_object_or_404(Job, pk=pk, name='render_report', state=Job.SUCCESS)
+    report = get_object_or_404(Report, pk=job.get_parameters()['report'])
+    # Check if user started the run and can access report
+    if job.user != request.user or not report.is_access_granted(request.user):
+        return HttpResponseForbidden()
+
+    output_filepath = job.get_result()['output']
+    if not os.path.isfile(output_filepath):
+        messages.error(request, _('Output was deleted, please run the report again'))
+        return HttpResponseRedirect(reverse_lazy('reporting:runs'))
+
+    return sendfile(request, output_filepath, attachment=True, attachment_filename='{}.{}'.format(report.name, job.get_parameters()['file_format']))
+
 @login_required
 @permission_required(['reporting.view_report', 'reporting.download_data'], raise_exception=True)
 def download_data(request):
@@ -301,74 +280,18 @@ def download_data(request):
         if not records:
             return HttpResponseBadRequest()
 
-        # Create data-JSON file
-        modelmap = {
-            'MEM': {
-                'model': Member,
-                'serializer': MemberJSONSerializer,
-                'permission': 'reporting.download_member_data'
-            },
-            'DIV': {
-                'model': Division,
-                'serializer': DivisionJSONSerializer,
-                'permission': 'reporting.download_division_data'
-            },
-            'SUB': {
-                'model': Subscription,
-                'serializer': SubscriptionJSONSerializer,
-                'permission': 'reporting.download_subscription_data'
-            },
-            'ACC': {
-                'model': Account,
-                'serializer': AccountJSONSerializer,
-                'permission': 'reporting.download_account_data'
-            },
-            'COC': {
-                'model': CostCenter,
-                'serializer': CostCenterJSONSerializer,
-                'permission': 'reporting.download_costcenter_data'
-            },
-            'COO': {
-                'model': CostObject,
-                'serializer': CostObjectJSONSerializer,
-                'permission': 'reporting.download_costobject_data'
-            },
-            'TRA': {
-                'model': Transaction,
-                'serializer': TransactionJSONSerializer,
-                'permission': 'reporting.download_transaction_data'
-            },
-            'CTR': {
-                'model': ClosureTransaction,
-                'serializer': ClosureTransactionJSONSerializer,
-                'permission': 'reporting.download_closuretransaction_data'
-            },
-            'CBA': {
-                'model': ClosureBalance,
-                'serializer': ClosureBalanceJSONSerializer,
-                'permission': 'reporting.download_closurebalance_data'
-            }
-        }
-        json_data = {}
         if records == 'all':
-            for model in models:
-                # Check if user is allowed to download data
-                if not request.user.has_perm(modelmap[model]['permission']):
-                    return HttpResponseForbidden()
-
-                json_data.update(modelmap[model]['serializer']().serialize(modelmap[model]['model'].objects.all()))
+            limit = None
         elif records == '50':
-            for model in models:
-                # Check if user is allowed to download data
-                if not request.user.has_perm(modelmap[model]['permission']):
-                    return HttpResponseForbidden()
-
-                json_data.update(modelmap[model]['serializer']().serialize(modelmap[model]['model'].objects.all()[:50]))
+            limit = 50
         else:
             return HttpResponseBadRequest()
 
-        response = JsonResponse(json_data)
-        response['Content-Disposition'] = 'attachment; filename=models.json'
-        return response
+        for model in models:
+            # Check if user is allowed to download data
+            if model not in MODELS or not request.user.has_perm(MODELS[model]['permission']):
+                return HttpResponseForbidden()
+
+        return sendfile(request, get_snapshot(models, limit), attachment=True, attachment_filename='models.json', mimetype='application/json')
     else:
         return HttpResponseBadRequest()
\ No newline at end of file
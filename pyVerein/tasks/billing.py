@@ -0,0 +1,177 @@
+"""
+Billing module for tasks app
+"""
+import datetime
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.translation import ugettext_lazy as _
+from dynamic_preferences.registries import global_preferences_registry
+
+from members.models import Member, Subscription
+from finance.models import Transaction, AccountBalance
+from utils.models import bulk_create_with_history, ModelVersion
+from utils.views import generate_document_numbers, generate_internal_numbers
+
+class SubscriptionBilling:
+    """
+    Batch engine for generating the subscription transactions of all active members
+    """
+
+    # Number of billing periods per accounting year
+    PERIODS = {
+        Subscription.YEARLY: 1,
+        Subscription.HALFYEARLY: 2,
+        Subscription.QUARTERLY: 4,
+        Subscription.MONTHLY: 12,
+    }
+    # Billing period of subscriptions paid once. It is not NULL, so the unique key also prevents billing them twice.
+    ONCE_PERIOD = 0
+
+    def __init__(self, accounting_year, user=None, today=None, chunk_size=500):
+        self.accounting_year = str(accounting_year)
+        self.user = user
+        self.today = today if today else datetime.date.today()
+        self.chunk_size = chunk_size
+        self.skip_first_subscription = global_preferences_registry.manager()['Members__skip_first_subscription']
+        self.accounts = {}
+
+    def get_members(self):
+        """
+        Returns all active members with their subscriptions
+        """
+        subscriptions = Subscription.objects.select_related('income_account', 'debitor_account', 'cost_center', 'cost_object')
+        return Member.objects.active(self.today).prefetch_related(Prefetch('subscription', queryset=subscriptions)).order_by('pk')
+
+    def get_accounts(self, subscription):
+        """
+        Returns income account, debitor account, cost center and cost object of a subscription, resolved once per subscription
+        """
+        if subscription.pk not in self.accounts:
+            self.accounts[subscription.pk] = (
+                subscription.get_income_account(),
+                subscription.get_debitor_account(),
+                subscription.get_cost_center(),
+                subscription.get_cost_object(),
+            )
+        return self.accounts[subscription.pk]
+
+    def get_billed_periods(self):
+        """
+        Returns the already billed (member, subscription, period) keys of the accounting year
+        """
+        billed = Transaction.objects.filter(
+            accounting_year=self.accounting_year, subscription__isnull=False, billing_period__isnull=False
+        ).values_list('member', 'subscription', 'billing_period')
+
+        return set(billed)
+
+    def get_subscription_text(self, member, subscription):
+        return _("Subscription - {subscription_name} - {membership_number} - {last_name}, {first_name}").format(subscription_name=subscription.name, membership_number=member.membership_number, last_name=member.last_name, first_name=member.first_name)
+
+    def get_open_periods(self, member, subscription, billed_periods):
+        """
+        Returns the periods of the subscription which have to be billed
+        """
+        if subscription.payment_frequency == Subscription.ONCE:
+            return [self.ONCE_PERIOD] if (member.pk, subscription.pk, self.ONCE_PERIOD) not in billed_periods else []
+
+        periods = self.PERIODS[subscription.payment_frequency]
+        current_period = (self.today.month - 1) // (12 // periods) + 1
+        open_periods = range(current_period, periods + 1)
+        # The current period is not billed for members who joined in the accounting year
+        if self.skip_first_subscription and member.joined_at and str(member.joined_at.year) == self.accounting_year:
+            open_periods = open_periods[1:]
+        return [period for period in open_periods if (member.pk, subscription.pk, period) not in billed_periods]
+
+    def run(self, progress=None):
+        """
+        Generate the transactions and return the members which could not be billed.
+        progress is called with the number of inserted and total receipts after each chunk.
+        """
+        missed_members = []
+        billable = []
+        members = list(self.get_members())
+        for member in members:
+            subscriptions = list(member.subscription.all())
+            if subscriptions and member.membership_number:
+                for subscription in subscriptions:
+                    self.get_accounts(subscription)
+                billable.append((member, subscriptions))
+            else:
+                missed_members.append("%s - %s, %s" % (member.membership_number, member.last_name, member.first_name))
+
+        billed_periods = self.get_billed_periods()
+
+        # Collect postings per member
+        receipts = []
+        once_subscriptions = []
+        for member, subscriptions in billable:
+            income_postings = []
+            for subscription in subscriptions:
+                if subscription.payment_frequency == Subscription.ONCE:
+                    once_subscriptions.append((member.pk, subscription.pk))
+                income_postings += [(subscription, period) for period in self.get_open_periods(member, subscription, billed_periods)]
+            if income_postings:
+                receipts.append((member, income_postings))
+
+        with transaction.atomic():
+            document_numbers = generate_document_numbers(len(receipts)) if receipts else []
+            internal_numbers = generate_internal_numbers(len(receipts)) if receipts else []
+            now = datetime.datetime.now()
+
+            receipt_transactions = []
+            for (member, income_postings), document_number, internal_number in zip(receipts, document_numbers, internal_numbers):
+                transactions = []
+                subscription_amount = Decimal(0)
+                for subscription, period in income_postings:
+                    income_account, debitor_account, cost_center, cost_object = self.get_accounts(subscription)
+                    transactions.append(self.create_transaction(
+                        income_account, now, self.get_subscription_text(member, subscription),
+                        document_number, internal_number, credit=subscription.amount, cost_center=cost_center, cost_object=cost_object,
+                        member=member, subscription=subscription, billing_period=period))
+                    subscription_amount += Decimal(subscription.amount)
+
+                debitor_account = self.get_accounts(income_postings[-1][0])[1]
+                transactions.append(self.create_transaction(
+                    debitor_account, now, _("Subscription - {membership_number} - {last_name}, {first_name}").format(membership_number=member.membership_number, last_name=member.last_name, first_name=member.first_name),
+                    document_number, internal_number, debit=subscription_amount, member=member))
+                receipt_transactions.append(transactions)
+
+            # Insert whole receipts per chunk
+            for start in range(0, len(receipt_transactions), self.chunk_size):
+                chunk = [t for transactions in receipt_transactions[start:start + self.chunk_size] for t in transactions]
+                chunk_internal_numbers = internal_numbers[start:start + self.chunk_size]
+                created = bulk_create_with_history(Transaction, chunk, user=self.user, batch_size=self.chunk_size, refetch=Transaction.objects.filter(internal_number__in=chunk_internal_numbers))
+                AccountBalance.objects.add_transactions(created)
+                if progress:
+                    progress(min(start + self.chunk_size, len(receipt_transactions)), len(receipt_transactions))
+
+            # Subscriptions which are paid once are removed after billing
+            members_by_subscription = {}
+            for member_id, subscription_id in once_subscriptions:
+                members_by_subscription.setdefault(subscription_id, []).append(member_id)
+            for subscription_id, member_ids in members_by_subscription.items():
+                Member.subscription.through.objects.filter(subscription_id=subscription_id, member_id__in=member_ids).delete()
+            if members_by_subscription:
+                ModelVersion.objects.bump(Member.subscription.through)
+
+        return missed_members
+
+    def create_transaction(self, account, date, text, document_number, internal_number, debit=None, credit=None, cost_center=None, cost_object=None, member=None, subscription=None, billing_period=None):
+        return Transaction(
+            account=account,
+            date=date,
+            text=text,
+            debit=debit,
+            credit=credit,
+            cost_center=cost_center,
+            cost_object=cost_object,
+            document_number=document_number,
+            document_number_generated=True,
+            internal_number=internal_number,
+            accounting_year=self.accounting_year,
+            member=member,
+            subscription=subscription,
+            billing_period=billing_period,
+        )
@@ -0,0 +1,89 @@
+"""
+Annual closure module for tasks app
+"""
+from decimal import Decimal
+from django.db import transaction, IntegrityError
+from django.db.models import Sum, Case, When, F, DecimalField
+
+from finance.models import Transaction, Account, AccountBalance, ClosureTransaction, ClosureBalance
+from utils.models import bulk_create_with_history
+
+class AnnualClosure:
+    """
+    Set based engine for closing an accounting year
+    """
+
+    # Transaction values copied into the closure transactions
+    FIELDS = {
+        'account_number': 'account__number',
+        'account_name': 'account__name',
+        'date': 'date',
+        'document_number': 'document_number',
+        'text': 'text',
+        'debit': 'debit',
+        'credit': 'credit',
+        'cost_center_number': 'cost_center__number',
+        'cost_center_name': 'cost_center__name',
+        'cost_center_description': 'cost_center__description',
+        'cost_object_number': 'cost_object__number',
+        'cost_object_name': 'cost_object__name',
+        'cost_object_description': 'cost_object__description',
+        'document_number_generated': 'document_number_generated',
+        'internal_number': 'internal_number',
+        'reset': 'reset',
+        'clearing_number': 'clearing_number',
+        'accounting_year': 'accounting_year',
+    }
+
+    def __init__(self, year, user=None, chunk_size=2000):
+        self.year = year
+        self.user = user
+        self.chunk_size = chunk_size
+
+    def is_closed(self):
+        return ClosureBalance.objects.filter(year=self.year).exists() or ClosureTransaction.objects.filter(accounting_year=self.year).exists()
+
+    def get_closure_transactions(self):
+        """
+        Returns unsaved closure transactions for all transactions of the year, loaded with joined accounts, cost centers and cost objects
+        """
+        rows = Transaction.objects.filter(accounting_year=self.year).order_by('pk').values_list(*self.FIELDS.values())
+        return [ClosureTransaction(**dict(zip(self.FIELDS.keys(), row))) for row in rows.iterator(chunk_size=self.chunk_size)]
+
+    def get_open_items(self):
+        """
+        Returns claims and liabilities of all uncleared debitor and creditor transactions, summed from the balance ledger
+        """
+        value = DecimalField(max_digits=14, decimal_places=2)
+        totals = AccountBalance.objects.filter(cleared=False).aggregate(
+            claims=Sum(Case(When(account__account_type=Account.DEBITOR, then=F('debit') - F('credit')), default=0, output_field=value)),
+            liabilities=Sum(Case(When(account__account_type=Account.CREDITOR, then=F('credit') - F('debit')), default=0, output_field=value)),
+        )
+        return totals['claims'] or Decimal(0), totals['liabilities'] or Decimal(0)
+
+    def run(self, progress=None):
+        """
+        Copy the transactions of the year and store the closure balance. Returns False if the year is already closed.
+        """
+        with transaction.atomic():
+            if self.is_closed():
+                return False
+
+            # The closure balance is unique per year and inserted first, so concurrent closures of the year wait for each other
+            try:
+                with transaction.atomic():
+                    cb = ClosureBalance.objects.create(year=self.year)
+            except IntegrityError:
+                return False
+
+            closure_transactions = self.get_closure_transactions()
+            if progress:
+                progress(0, len(closure_transactions))
+            bulk_create_with_history(ClosureTransaction, closure_transactions, user=self.user, batch_size=self.chunk_size, refetch=ClosureTransaction.objects.filter(accounting_year=self.year))
+            if progress:
+                progress(len(closure_transactions), len(closure_transactions))
+
+            cb.claims, cb.liabilities = self.get_open_items()
+            cb.save()
+
+        return True
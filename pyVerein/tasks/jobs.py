@@ -0,0 +1,190 @@
+"""
+Background jobs of the tasks app
+"""
+import os
+import socket
+import traceback
+import json
+import threading
+from shutil import rmtree
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection
+from django.utils import timezone
+# Import localization
+from django.utils.translation import ugettext_lazy as _
+from dynamic_preferences.registries import global_preferences_registry
+
+from members.models import Member
+from finance.matching import update_proposals
+from reporting.models import Report
+from reporting.render import local_renderer
+from reporting.snapshots import evict_snapshots
+from reporting.outputs import evict_outputs, get_output
+from .billing import SubscriptionBilling
+from .closure import AnnualClosure
+from .models import Job
+
+# Registered job functions by name
+JOBS = {}
+# Names of the jobs, which never run at the same time as another job of the same name
+EXCLUSIVE_JOBS = set()
+
+def register(name, exclusive=False):
+    """
+    Register a function as job. The function is called with the job and its parameters as keyword arguments
+    and returns a JSON serializable result. Exclusive jobs are run one after the other by all workers.
+    """
+    def decorator(function):
+        JOBS[name] = function
+        if exclusive:
+            EXCLUSIVE_JOBS.add(name)
+        return function
+    return decorator
+
+def get_worker_name():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+def keep_alive(job, stop):
+    """
+    Store the heartbeat of the running job until stop is set
+    """
+    try:
+        while not stop.wait(settings.JOB_HEARTBEAT_INTERVAL):
+            job.beat()
+    finally:
+        # The thread has its own database connection
+        connection.close()
+
+def run_job(job):
+    """
+    Run a claimed job and store its result
+    """
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=keep_alive, args=(job, stop), daemon=True)
+    heartbeat.start()
+    try:
+        result = JOBS[job.name](job, **job.get_parameters())
+        job.state = Job.SUCCESS
+        job.result = json.dumps(result, cls=DjangoJSONEncoder)
+    except Exception:
+        job.state = Job.FAILED
+        job.error = traceback.format_exc()
+    finally:
+        stop.set()
+        heartbeat.join()
+    job.finished_at = timezone.now()
+    job.save(update_fields=['state', 'result', 'error', 'finished_at'])
+    return job
+
+def run_next_job(worker=None):
+    """
+    Claim and run the oldest queued job. Returns the job or None if the queue is empty.
+    """
+    close_old_connections()
+    job = Job.objects.claim(worker if worker else get_worker_name(), EXCLUSIVE_JOBS)
+    if job is None:
+        return None
+    return run_job(job)
+
+@register('apply_subscriptions', exclusive=True)
+def apply_subscriptions(job, accounting_year):
+    """
+    Generate transaction for membersubscriptions
+    """
+    missed_members = SubscriptionBilling(accounting_year, user=job.user).run(progress=job.set_progress)
+    if missed_members:
+        return {
+            'state': 'Missed',
+            'missed': missed_members
+        }
+    else:
+        return {
+            'state': 'Success'
+        }
+
+@register('apply_annualclosure', exclusive=True)
+def apply_annualclosure(job, year):
+    """
+    Create Closuretransaction for annual closure
+    """
+    if not AnnualClosure(year, user=job.user).run(progress=job.set_progress):
+        return {
+            'state': 'Failed',
+            'message': str(_('No year selected or year already closed.'))
+        }
+
+    return {
+        'state': 'Success'
+    }
+
+@register('delete_terminated_members', exclusive=True)
+def delete_terminated_members(job):
+    """
+    Deletes terminated members
+    """
+    global_preferences = global_preferences_registry.manager()
+    # Get all terminated members which are longer than "Keep terminated members" days terminated
+    members = list(Member.objects.terminated_before(global_preferences['Members__keep_terminated_members']))
+    # Delete these members
+    for count, member in enumerate(members, 1):
+        member.delete()
+        job.set_progress(count, len(members))
+
+    return {
+        'state': 'Success'
+    }
+
+@register('delete_report_data')
+def delete_report_data(job):
+    """
+    Deletes expired and least recently used report data and outputs
+    """
+    evict_snapshots(max_age=settings.REPORT_OUTPUT_MAX_AGE)
+    evict_outputs()
+
+    # Data and outputs of former versions were stored per report
+    reports_dir = os.path.join(settings.MEDIA_ROOT, 'protected', 'reports')
+    subdirs = os.listdir(reports_dir) if os.path.isdir(reports_dir) else []
+    for count, subdir in enumerate(subdirs, 1):
+        for name in ('data', 'output'):
+            if os.path.exists(os.path.join(reports_dir, subdir, name)):
+                rmtree(os.path.join(reports_dir, subdir, name))
+        job.set_progress(count, len(subdirs))
+
+    return {
+        'state': 'Success'
+    }
+
+@register('compile_report')
+def compile_report(job, report):
+    """
+    Compiles the report definition
+    """
+    local_renderer.compile(Report.objects.get(pk=report).report.path)
+
+    return {
+        'state': 'Success'
+    }
+
+@register('render_report')
+def render_report(job, report, parameters, file_format):
+    """
+    Renders a report in background
+    """
+    output = get_output(Report.objects.get(pk=report), parameters, file_format)
+
+    return {
+        'state': 'Success',
+        'output': output
+    }
+
+@register('match_open_items', exclusive=True)
+def match_open_items(job):
+    """
+    Proposes groups of open items of all debitor and creditor accounts for clearing
+    """
+    return {
+        'state': 'Success',
+        'proposals': update_proposals()
+    }
@@ -0,0 +1,54 @@
+"""
+Management command to run the queued background jobs
+"""
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from tasks.jobs import run_next_job, get_worker_name
+from tasks.models import Job
+
+class Command(BaseCommand):
+    help = 'Runs the queued background jobs of the tasks app'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', dest='once', help='Exit as soon as the queue is empty')
+        parser.add_argument('--sleep', type=float, default=2, dest='sleep', help='Seconds to wait before polling an empty queue again')
+        parser.add_argument('--workers', type=int, default=1, dest='workers', help='Number of jobs run at once, e.g. to render several reports in parallel')
+
+    def handle(self, *args, **options):
+        if options['workers'] <= 1:
+            self.work(get_worker_name(), options['once'], options['sleep'])
+            return
+
+        threads = [
+            threading.Thread(target=self.work_in_thread, args=('{}:{}'.format(get_worker_name(), number), options['once'], options['sleep']))
+            for number in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def work(self, worker, once, sleep):
+        self.stdout.write('Worker {} started.'.format(worker))
+
+        while True:
+            job = run_next_job(worker)
+            if job is None:
+                if once:
+                    break
+                time.sleep(sleep)
+                continue
+
+            if job.state == Job.FAILED:
+                self.stderr.write('Job {} ({}) failed:\n{}'.format(job.pk, job.name, job.error))
+            else:
+                self.stdout.write('Job {} ({}) finished in {}.'.format(job.pk, job.name, job.get_run_duration()))
+
+    def work_in_thread(self, worker, once, sleep):
+        try:
+            self.work(worker, once, sleep)
+        finally:
+            # Every thread has its own database connection
+            connection.close()
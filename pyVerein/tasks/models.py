@@ -1,4 +1,11 @@
 from django.db import models
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from datetime import timedelta
+# Import localization
+from django.utils.translation import ugettext_lazy as _
+import json
 
 class TasksPermissionModel(models.Model):
 
@@ -13,4 +20,137 @@ class TasksPermissionModel(models.Model):
             ('run_closure_task', 'Can run closure task'),
             ('run_delete_terminated_members_task', 'Can run delete terminated members task'),
             ('run_delete_report_data_task', 'Can run delete report data task'),
-        )
\ No newline at end of file
+        )
+
+class JobManager(models.Manager):
+    """
+    Manager for the database backed job queue
+    """
+    def enqueue(self, name, user=None, **parameters):
+        """
+        Queue a job for the worker process
+        """
+        return self.create(name=name, user=user, parameters=json.dumps(parameters, cls=DjangoJSONEncoder))
+
+    def claim(self, worker, exclusive=()):
+        """
+        Claim the oldest queued job for the given worker. Returns None if no job is queued.
+        The state is switched with a conditional update, so a job is claimed by one worker only.
+        Jobs with a name in exclusive are not claimed while another job of the same name is running.
+        """
+        self.fail_stale()
+        while True:
+            running = set(self.filter(state=Job.RUNNING, name__in=exclusive).values_list('name', flat=True)) if exclusive else set()
+            job = self.filter(state=Job.QUEUED).exclude(name__in=running).order_by('created_at', 'pk').values_list('pk', 'name').first()
+            if job is None:
+                return None
+            pk, name = job
+            if not self.filter(pk=pk, state=Job.QUEUED).update(state=Job.RUNNING, worker=worker, started_at=timezone.now(), heartbeat_at=timezone.now()):
+                continue
+            if name in exclusive and self.filter(name=name, state=Job.RUNNING, pk__lt=pk).exists():
+                # An older job of the same name was claimed concurrently, it runs first
+                self.filter(pk=pk).update(state=Job.QUEUED, worker=None, started_at=None, heartbeat_at=None)
+                continue
+            return self.get(pk=pk)
+
+    def fail_stale(self):
+        """
+        Fail running jobs without heartbeat for JOB_TIMEOUT seconds, whose worker stopped.
+        Returns the number of failed jobs.
+        """
+        threshold = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT)
+        return self.filter(state=Job.RUNNING).filter(models.Q(heartbeat_at__lt=threshold) | models.Q(heartbeat_at=None, started_at__lt=threshold)).update(
+            state=Job.FAILED, error=str(_('Worker stopped while running the job')), finished_at=timezone.now())
+
+
+class Job(models.Model):
+    """
+    Background job model
+    """
+    QUEUED = 'QUE'
+    RUNNING = 'RUN'
+    SUCCESS = 'SUC'
+    FAILED = 'FAI'
+    STATES = (
+        (QUEUED, _('Queued')),
+        (RUNNING, _('Running')),
+        (SUCCESS, _('Success')),
+        (FAILED, _('Failed')),
+    )
+
+    # Name of the registered job function
+    name = models.CharField(max_length=100)
+    # JSON encoded keyword arguments of the job function
+    parameters = models.TextField(default='{}')
+    # State
+    state = models.CharField(max_length=3, choices=STATES, default=QUEUED, db_index=True)
+    # User who queued the job
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    # Worker which runs the job
+    worker = models.CharField(max_length=255, blank=True, null=True)
+
+    # Processed items
+    progress_current = models.PositiveIntegerField(default=0)
+    # Total items
+    progress_total = models.PositiveIntegerField(default=0)
+
+    # JSON encoded result of the job function
+    result = models.TextField(blank=True, null=True)
+    # Error message if the job failed
+    error = models.TextField(blank=True, null=True)
+
+    # Queued at
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Started at
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Finished at
+    finished_at = models.DateTimeField(blank=True, null=True)
+    # Last sign of life of the worker running the job
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+
+    objects = JobManager()
+
+    def get_parameters(self):
+        return json.loads(self.parameters)
+
+    def get_result(self):
+        return json.loads(self.result) if self.result else None
+
+    def set_progress(self, current, total=None):
+        """
+        Store the progress of the running job
+        """
+        self.progress_current = current
+        if total is not None:
+            self.progress_total = total
+        Job.objects.filter(pk=self.pk).update(progress_current=self.progress_current, progress_total=self.progress_total, heartbeat_at=timezone.now())
+
+    def beat(self):
+        """
+        Store that the worker running the job is still alive
+        """
+        Job.objects.filter(pk=self.pk).update(heartbeat_at=timezone.now())
+
+    def get_wait_duration(self):
+        """
+        Returns the time the job waited in the queue
+        """
+        if self.started_at:
+            return self.started_at - self.created_at
+        return timezone.now() - self.created_at
+
+    def get_run_duration(self):
+        """
+        Returns the runtime of the job
+        """
+        if not self.started_at:
+            return None
+        if self.finished_at:
+            return self.finished_at - self.started_at
+        return timezone.now() - self.started_at
+
+    def is_finished(self):
+        return self.state in (Job.SUCCESS, Job.FAILED)
+
+    def __str__(self):
+        return '{} ({})'.format(self.name, self.get_state_display())
@@ -1,7 +1,19 @@
 from django.test import TestCase
+from unittest import mock
 from account.models import User
 from django.urls import reverse
 from django.contrib.auth.models import Permission
+from django.conf import settings
+from django.utils import timezone
+from datetime import date, timedelta
+from decimal import Decimal
+from dynamic_preferences.registries import global_preferences_registry
+from members.models import Member, Subscription
+from finance.models import Account, CostCenter, CostObject, Transaction, AccountBalance, ClosureTransaction, ClosureBalance
+from .billing import SubscriptionBilling
+from .closure import AnnualClosure
+from .jobs import run_next_job
+from .models import Job
 
 class TasksTestMethods(TestCase):
     def setUp(self):
@@ -224,4 +236,244 @@ class TasksTestMethods(TestCase):
         user.user_permissions.add(Permission.objects.get(codename='run_tasks'))
         user.user_permissions.add(Permission.objects.get(codename='run_delete_report_data_task'))
         response = self.client.get(reverse('tasks:delete_report_data'))
-        self.assertEqual(response.status_code, 400)
\ No newline at end of file
+        self.assertEqual(response.status_code, 400)
+
+class SubscriptionBillingTestMethods(TestCase):
+    def setUp(self):
+        global_preferences_registry.manager()['Finance__accounting_year'] = '2019'
+
+        income = Account.objects.create(number='40000', name='Income', account_type=Account.INCOME)
+        debitor = Account.objects.create(number='10000', name='Debitor', account_type=Account.DEBITOR)
+        cost_center = CostCenter.objects.create(number='100', name='Center')
+        cost_object = CostObject.objects.create(number='200', name='Object')
+
+        yearly = Subscription.objects.create(name='Yearly', amount=Decimal('120.00'), payment_frequency=Subscription.YEARLY, income_account=income, debitor_account=debitor, cost_center=cost_center, cost_object=cost_object)
+        quarterly = Subscription.objects.create(name='Quarterly', amount=Decimal('10.00'), payment_frequency=Subscription.QUARTERLY, income_account=income, debitor_account=debitor, cost_center=cost_center, cost_object=cost_object)
+        once = Subscription.objects.create(name='Once', amount=Decimal('5.00'), payment_frequency=Subscription.ONCE, income_account=income, debitor_account=debitor, cost_center=cost_center, cost_object=cost_object)
+
+        member = Member.objects.create(first_name='First', last_name='Member', membership_number='1')
+        member.subscription.add(yearly, quarterly, once)
+        member = Member.objects.create(first_name='Second', last_name='Member', membership_number='2')
+        member.subscription.add(yearly)
+        member = Member.objects.create(first_name='Terminated', last_name='Member', membership_number='3', terminated_at=date(2019, 1, 1))
+        member.subscription.add(yearly)
+        Member.objects.create(first_name='Missing', last_name='Member')
+
+    def test_billing(self):
+        "Billing should post all open periods of active members in bulk"
+
+        missed = SubscriptionBilling('2019', today=date(2019, 5, 1)).run()
+
+        self.assertEqual(missed, ['None - Member, Missing'])
+        # First member: yearly, three open quarters, once and the debitor line. Second member: yearly and the debitor line
+        self.assertEqual(Transaction.objects.count(), 8)
+        self.assertEqual(Transaction.history.count(), 8)
+        self.assertEqual(Transaction.objects.values('internal_number').distinct().count(), 2)
+        self.assertEqual(Transaction.objects.get(account='10000', text__contains='- 1 -').debit, Decimal('155.00'))
+        self.assertEqual(AccountBalance.objects.totals('40000'), (Decimal(0), Decimal('275.00')))
+        self.assertEqual(AccountBalance.objects.verify(), [])
+        self.assertFalse(Member.objects.get(membership_number='1').subscription.filter(name='Once').exists())
+
+    def test_billing_is_idempotent(self):
+        "Billing again should only post periods which are not billed yet"
+
+        SubscriptionBilling('2019', today=date(2019, 5, 1)).run()
+        SubscriptionBilling('2019', today=date(2019, 5, 1)).run()
+        self.assertEqual(Transaction.objects.count(), 8)
+
+        SubscriptionBilling('2019', today=date(2019, 11, 1)).run()
+        self.assertEqual(Transaction.objects.count(), 8)
+
+        # Subscriptions paid once are billed once per year, even if they are assigned again
+        Member.objects.get(membership_number='1').subscription.add(Subscription.objects.get(name='Once'))
+        SubscriptionBilling('2019', today=date(2019, 11, 1)).run()
+        self.assertEqual(Transaction.objects.count(), 8)
+        self.assertEqual(Transaction.objects.get(subscription__name='Once').billing_period, SubscriptionBilling.ONCE_PERIOD)
+
+    def test_billing_period_keys(self):
+        "Billed periods should be tracked by member, subscription and period instead of the text"
+
+        SubscriptionBilling('2019', today=date(2019, 5, 1)).run()
+        quarterly = Subscription.objects.get(name='Quarterly')
+        self.assertEqual(sorted(Transaction.objects.filter(subscription=quarterly).values_list('billing_period', flat=True)), [2, 3, 4])
+
+        Member.objects.filter(membership_number='1').update(last_name='Renamed')
+        SubscriptionBilling('2019', today=date(2019, 5, 1)).run()
+        self.assertEqual(Transaction.objects.count(), 8)
+
+        # A reset period is billed again
+        Transaction.objects.filter(subscription=quarterly, billing_period=4).update(reset=True, subscription=None, billing_period=None)
+        SubscriptionBilling('2019', today=date(2019, 11, 1)).run()
+        self.assertTrue(Transaction.objects.filter(subscription=quarterly, billing_period=4).exists())
+
+    def test_reset_and_new_posting_keeps_billed_period(self):
+        "A billed posting, which is reset and posted again, should not be billed again"
+
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        for codename in ('view_transaction', 'add_transaction', 'change_transaction'):
+            user.user_permissions.add(Permission.objects.get(codename=codename))
+        self.client.login(username='temp', password='temppass')
+
+        SubscriptionBilling('2019', today=date(2019, 11, 1)).run()
+        internal_number = Transaction.objects.get(account='10000', text__contains='- 2 -').internal_number
+        response = self.client.get(reverse('finance:transaction_reset_new', args=[internal_number]))
+        session_id = response.url.rstrip('/').split('/')[-2]
+        posting = self.client.session[session_id + 'transactions']['0']
+        data = {key: posting[key] or '' for key in ('account', 'date', 'document_number', 'text', 'debit', 'credit', 'cost_center', 'cost_object')}
+        for key in ('debit', 'credit'):
+            data[key] = data[key].replace('.', ',')
+        self.client.post(reverse('finance:transaction_create_step', kwargs={'session_id': session_id, 'step': 0}), data)
+        self.assertEqual(Transaction.objects.filter(member__membership_number='2', reset=False, subscription__name='Yearly', billing_period=1).count(), 1)
+
+        count = Transaction.objects.count()
+        SubscriptionBilling('2019', today=date(2019, 11, 1)).run()
+        self.assertEqual(Transaction.objects.count(), count)
+
+class JobTestMethods(TestCase):
+    def setUp(self):
+        # Create user
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        user.first_name = 'temp_first'
+        user.last_name = 'temp_last'
+        user.save()
+        user.user_permissions.add(Permission.objects.get(codename='view_tasks'))
+        user.user_permissions.add(Permission.objects.get(codename='run_tasks'))
+        user.user_permissions.add(Permission.objects.get(codename='run_delete_terminated_members_task'))
+
+        # login with user
+        self.client.login(username='temp', password='temppass')
+
+    def test_task_is_queued(self):
+        "Running a task should queue a job which is executed by the worker"
+
+        Member.objects.create(first_name='First', last_name='Member', terminated_at=date(2000, 1, 1))
+
+        response = self.client.post(reverse('tasks:delete_terminated_members'))
+        self.assertEqual(response.json()['state'], 'Queued')
+        self.assertEqual(Member.objects.count(), 1)
+
+        job = Job.objects.get(pk=response.json()['job'])
+        self.assertEqual(job.state, Job.QUEUED)
+        self.assertEqual(job.user.username, 'temp')
+
+        self.assertEqual(run_next_job('test').pk, job.pk)
+        self.assertIsNone(run_next_job('test'))
+        self.assertEqual(Member.objects.count(), 0)
+
+        response = self.client.get(response.json()['url'])
+        self.assertTrue(response.json()['finished'])
+        self.assertFalse(response.json()['failed'])
+        self.assertEqual(response.json()['result'], {'state': 'Success'})
+        self.assertEqual(response.json()['progress'], {'current': 1, 'total': 1})
+
+    def test_job_is_claimed_once(self):
+        "A queued job should only be claimed by one worker"
+
+        job = Job.objects.enqueue('delete_terminated_members')
+        self.assertEqual(Job.objects.claim('first').pk, job.pk)
+        self.assertIsNone(Job.objects.claim('second'))
+        self.assertEqual(Job.objects.get(pk=job.pk).worker, 'first')
+
+    def test_stale_job_is_failed(self):
+        "A running job without heartbeat should be failed, so it does not block new jobs"
+
+        job = Job.objects.enqueue('delete_terminated_members')
+        Job.objects.claim('first')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT + 1))
+        alive_job = Job.objects.enqueue('delete_terminated_members')
+        Job.objects.claim('second')
+        new_job = Job.objects.enqueue('delete_terminated_members')
+
+        self.assertEqual(Job.objects.claim('third').pk, new_job.pk)
+        self.assertEqual(Job.objects.get(pk=job.pk).state, Job.FAILED)
+        self.assertIsNotNone(Job.objects.get(pk=job.pk).finished_at)
+        self.assertEqual(Job.objects.get(pk=alive_job.pk).state, Job.RUNNING)
+
+    def test_task_is_queued_once(self):
+        "A task should not be queued again while its job is queued or running"
+
+        response = self.client.post(reverse('tasks:delete_terminated_members'))
+        self.assertEqual(response.json()['state'], 'Queued')
+        response = self.client.post(reverse('tasks:delete_terminated_members'))
+        self.assertEqual(response.json()['state'], 'Failed')
+        self.assertEqual(Job.objects.count(), 1)
+
+        run_next_job('test')
+        response = self.client.post(reverse('tasks:delete_terminated_members'))
+        self.assertEqual(response.json()['state'], 'Queued')
+
+    def test_exclusive_jobs_are_serialized(self):
+        "Exclusive jobs of the same name should not be run by several workers at once"
+
+        first = Job.objects.enqueue('apply_subscriptions', accounting_year=2019)
+        second = Job.objects.enqueue('apply_subscriptions', accounting_year=2019)
+        other = Job.objects.enqueue('delete_report_data')
+
+        self.assertEqual(Job.objects.claim('first', {'apply_subscriptions'}).pk, first.pk)
+        self.assertEqual(Job.objects.claim('second', {'apply_subscriptions'}).pk, other.pk)
+        self.assertIsNone(Job.objects.claim('third', {'apply_subscriptions'}))
+
+        Job.objects.filter(pk=first.pk).update(state=Job.SUCCESS)
+        self.assertEqual(Job.objects.claim('third', {'apply_subscriptions'}).pk, second.pk)
+
+    def test_job_status_of_other_user(self):
+        "Job states should only be served to the user who queued the job"
+
+        job = Job.objects.enqueue('delete_report_data', user=User.objects.create_user('other', 'other@temp.tld', 'otherpass'))
+        response = self.client.get(reverse('tasks:job_status', kwargs={'pk': job.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_failed_job(self):
+        "Errors of a job should be stored on the job"
+
+        Job.objects.enqueue('apply_annualclosure')
+        job = run_next_job('test')
+        self.assertEqual(job.state, Job.FAILED)
+        self.assertIn('TypeError', job.error)
+
+class AnnualClosureTestMethods(TestCase):
+    def setUp(self):
+        debitor = Account.objects.create(number='10000', name='Debitor', account_type=Account.DEBITOR)
+        creditor = Account.objects.create(number='70000', name='Creditor', account_type=Account.CREDITOR)
+        income = Account.objects.create(number='40000', name='Income', account_type=Account.INCOME)
+        cost_center = CostCenter.objects.create(number='100', name='Center', description='Center description')
+
+        Transaction.objects.create(account=debitor, date=date(2019, 1, 1), text='Claim', debit=Decimal('100.00'), internal_number=1, accounting_year=2019)
+        Transaction.objects.create(account=income, date=date(2019, 1, 1), text='Claim', credit=Decimal('100.00'), cost_center=cost_center, internal_number=1, accounting_year=2019)
+        Transaction.objects.create(account=debitor, date=date(2019, 2, 1), text='Payment', credit=Decimal('30.00'), internal_number=2, accounting_year=2019)
+        Transaction.objects.create(account=debitor, date=date(2019, 3, 1), text='Cleared', debit=Decimal('50.00'), internal_number=3, clearing_number=1, accounting_year=2019)
+        Transaction.objects.create(account=creditor, date=date(2019, 3, 1), text='Liability', credit=Decimal('20.00'), internal_number=4, accounting_year=2019)
+        Transaction.objects.create(account=income, date=date(2020, 1, 1), text='Next year', credit=Decimal('10.00'), internal_number=5, accounting_year=2020)
+
+    def test_closure(self):
+        "Closure should copy the transactions of the year and sum the open items"
+
+        self.assertTrue(AnnualClosure(2019).run())
+
+        self.assertEqual(ClosureTransaction.objects.count(), 5)
+        self.assertEqual(ClosureTransaction.history.count(), 5)
+        ct = ClosureTransaction.objects.get(account_number='40000')
+        self.assertEqual(ct.account_name, 'Income')
+        self.assertEqual(ct.cost_center_number, '100')
+        self.assertEqual(ct.cost_center_description, 'Center description')
+        self.assertIsNone(ct.cost_object_number)
+
+        cb = ClosureBalance.objects.get(year=2019)
+        self.assertEqual(cb.claims, Decimal('70.00'))
+        self.assertEqual(cb.liabilities, Decimal('20.00'))
+
+    def test_closure_only_once(self):
+        "A closed year should not be closed again"
+
+        self.assertTrue(AnnualClosure(2019).run())
+        self.assertFalse(AnnualClosure(2019).run())
+        self.assertEqual(ClosureTransaction.objects.count(), 5)
+
+    def test_concurrent_closure(self):
+        "A closure, which passed the check while another closure of the year was running, should not copy the year again"
+
+        self.assertTrue(AnnualClosure(2019).run())
+        with mock.patch.object(AnnualClosure, 'is_closed', return_value=False):
+            self.assertFalse(AnnualClosure(2019).run())
+        self.assertEqual(ClosureTransaction.objects.count(), 5)
+        self.assertEqual(ClosureBalance.objects.count(), 1)
@@ -12,4 +12,5 @@ urlpatterns = [
     path('apply_annualclosure/', views.apply_annualclosure, name='apply_annualclosure'),
     path('delete_terminated_members/', views.delete_terminated_members, name='delete_terminated_members'),
     path('delete_report_data/', views.delete_report_data, name='delete_report_data'),
+    path('job/<int:pk>/', views.job_status, name='job_status'),
 ] 
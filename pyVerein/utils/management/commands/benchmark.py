@@ -0,0 +1,144 @@
+"""
+Management command to benchmark the main views and tasks
+"""
+import datetime
+import json
+import statistics
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from dynamic_preferences.registries import global_preferences_registry
+
+from account.models import User
+from members.models import Member
+from finance.models import Account, Transaction, ClosureTransaction
+from reporting.models import Report
+from tasks.billing import SubscriptionBilling
+from tasks.closure import AnnualClosure
+
+class Command(BaseCommand):
+    help = 'Times the main views and tasks and compares wall time and query counts against a baseline. All changes are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='benchmark.json', help='JSON file for the results')
+        parser.add_argument('--baseline', default=None, help='JSON file of an earlier run to compare against')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs per benchmark')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown compared to the baseline')
+        parser.add_argument('--report', type=int, default=None, help='Primary key of the report to benchmark run_report with')
+        parser.add_argument('--report-format', default='pdf', dest='report_format', help='Output format of the benchmarked report')
+        parser.add_argument('--report-parameter', action='append', default=[], dest='report_parameters', help='Report parameter as name=value')
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        results = {}
+
+        # The test client uses the host name testserver
+        with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']), transaction.atomic():
+            self.client = self.get_client()
+            for name, benchmark in self.get_benchmarks(options):
+                results[name] = self.measure(benchmark)
+                self.stdout.write('{:<25} {:>10.1f} ms {:>6} queries'.format(name, results[name]['wall_time_median'], results[name]['queries']))
+                if results[name]['status'] not in (None, 200):
+                    self.stderr.write('{} returned status {}'.format(name, results[name]['status']))
+            # Discard the benchmark user and all data changed by the tasks
+            transaction.set_rollback(True)
+
+        output = {
+            'created_at': datetime.datetime.now().isoformat(),
+            'database': connection.vendor,
+            'members': Member.objects.count(),
+            'transactions': Transaction.objects.count(),
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(output, f, indent=2)
+        self.stdout.write('Results written to {}.'.format(options['output']))
+
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def get_client(self):
+        user = User.objects.create_superuser('benchmark-{}'.format(int(time.time())), 'benchmark@example.org', None)
+        client = Client()
+        client.force_login(user)
+        self.user = user
+        return client
+
+    def get_benchmarks(self, options):
+        """
+        Returns (name, callable) for each benchmark. Callables return the status code or None for tasks.
+        """
+        accounting_year = global_preferences_registry.manager()['Finance__accounting_year']
+
+        yield 'dashboard', lambda: self.client.get(reverse('app:index')).status_code
+        yield 'member_list', lambda: self.client.get(reverse('members:member_list')).status_code
+        yield 'transaction_list', lambda: self.client.get(reverse('finance:transaction_list')).status_code
+        yield 'transaction_data', lambda: self.client.get(reverse('finance:transaction_data'), {'draw': 1, 'start': 0, 'length': 25, 'year': accounting_year}).status_code
+
+        account = Account.objects.filter(account_type=Account.DEBITOR).order_by('pk').first()
+        if account is not None:
+            yield 'account_detail', lambda: self.client.get(reverse('finance:debitor_detail', kwargs={'pk': account.pk})).status_code
+
+        yield 'apply_subscriptions', self.rollback(lambda: SubscriptionBilling(accounting_year, user=self.user).run())
+
+        closure_year = Transaction.objects.exclude(accounting_year__in=ClosureTransaction.objects.values('accounting_year')).exclude(accounting_year=None).order_by('accounting_year').values_list('accounting_year', flat=True).first()
+        if closure_year is not None:
+            yield 'apply_annualclosure', self.rollback(lambda: AnnualClosure(closure_year, user=self.user).run())
+
+        if options['report'] is not None:
+            report = Report.objects.get(pk=options['report'])
+            data = dict(parameter.split('=', 1) for parameter in options['report_parameters'])
+            data['format'] = options['report_format']
+            yield 'run_report', lambda: self.client.post(reverse('reporting:run', kwargs={'pk': report.pk}), data).status_code
+
+    def rollback(self, task):
+        """
+        Wrap a task, so every run starts with the same data
+        """
+        def run():
+            with transaction.atomic():
+                task()
+                transaction.set_rollback(True)
+        return run
+
+    def measure(self, benchmark):
+        times = []
+        queries = 0
+        status = None
+        for i in range(self.repeat):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                status = benchmark()
+                times.append((time.perf_counter() - start) * 1000)
+            queries = len(captured)
+        return {
+            'wall_time_min': round(min(times), 1),
+            'wall_time_median': round(statistics.median(times), 1),
+            'queries': queries,
+            'status': status,
+        }
+
+    def compare(self, results, baseline_path, tolerance):
+        """
+        Print the changes against the baseline and fail on regressions
+        """
+        with open(baseline_path) as f:
+            baseline = json.load(f)['results']
+
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            base = baseline[name]
+            ratio = result['wall_time_median'] / base['wall_time_median'] if base['wall_time_median'] else 1
+            self.stdout.write('{:<25} {:>+7.1%} time {:>+6} queries'.format(name, ratio - 1, result['queries'] - base['queries']))
+            if ratio > 1 + tolerance or result['queries'] > base['queries']:
+                regressions.append(name)
+
+        if regressions:
+            raise CommandError('Regressions compared to {}: {}'.format(baseline_path, ', '.join(regressions)))
+        self.stdout.write(self.style.SUCCESS('No regressions compared to {}.'.format(baseline_path)))
@@ -0,0 +1,170 @@
+"""
+Management command to generate a reproducible synthetic dataset for benchmarks
+"""
+import datetime
+import random
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import now
+from dynamic_preferences.registries import global_preferences_registry
+
+from members.models import Member, Division, Subscription
+from finance.models import Account, CostCenter, CostObject, Transaction, AccountBalance, NumberSequence
+from utils.models import bulk_create_with_history, ModelVersion
+
+FIRST_NAMES = ['Anna', 'Ben', 'Clara', 'David', 'Emma', 'Felix', 'Greta', 'Hannes', 'Ida', 'Jonas', 'Lena', 'Max', 'Nora', 'Paul', 'Sophie', 'Tom']
+LAST_NAMES = ['Müller', 'Schmidt', 'Schneider', 'Fischer', 'Weber', 'Meyer', 'Wagner', 'Becker', 'Schulz', 'Hoffmann', 'Koch', 'Richter']
+CITIES = [('20095', 'Hamburg'), ('10115', 'Berlin'), ('80331', 'München'), ('50667', 'Köln'), ('28195', 'Bremen')]
+
+class Command(BaseCommand):
+    help = 'Generates members, divisions, subscriptions and transactions for benchmarks. The same seed generates the same data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=1000, help='Number of members')
+        parser.add_argument('--transactions', type=int, default=10000, help='Number of transactions, two per receipt')
+        parser.add_argument('--years', type=int, default=3, help='Number of accounting years')
+        parser.add_argument('--first-year', type=int, default=datetime.date.today().year - 2, dest='first_year', help='First accounting year')
+        parser.add_argument('--history-changes', type=int, default=1, dest='history_changes', help='Additional change history records per member')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.seed = options['seed']
+
+        with transaction.atomic():
+            accounts, cost_centers, cost_objects = self.create_finance_data()
+            divisions, subscriptions = self.create_member_data(accounts, cost_centers, cost_objects)
+            members = self.create_members(options['members'], datetime.date(options['first_year'] + options['years'] - 1, 12, 31), divisions, subscriptions, options['history_changes'])
+            count = self.create_transactions(options['transactions'], options['first_year'], options['years'], accounts, cost_centers, cost_objects)
+
+        # The views need an accounting year
+        global_preferences = global_preferences_registry.manager()
+        if not global_preferences['Finance__accounting_year']:
+            global_preferences['Finance__accounting_year'] = str(options['first_year'] + options['years'] - 1)
+
+        self.stdout.write(self.style.SUCCESS('Generated {} members and {} transactions.'.format(len(members), count)))
+
+    def create_finance_data(self):
+        """
+        Returns debitor, creditor, income, cost and asset accounts as well as cost centers and cost objects
+        """
+        accounts = {}
+        for account_type, first_number, name in [(Account.DEBITOR, 10000, 'Debitor'), (Account.CREDITOR, 70000, 'Creditor'), (Account.INCOME, 40000, 'Income'), (Account.COST, 60000, 'Cost'), (Account.ASSET, 1000, 'Bank')]:
+            accounts[account_type] = [
+                Account.objects.get_or_create(number=str(first_number + i), defaults={'name': '{} {}'.format(name, i + 1), 'account_type': account_type})[0]
+                for i in range(5)
+            ]
+        cost_centers = [CostCenter.objects.get_or_create(number=str(100 + i), defaults={'name': 'Cost center {}'.format(i + 1)})[0] for i in range(5)]
+        cost_objects = [CostObject.objects.get_or_create(number=str(200 + i), defaults={'name': 'Cost object {}'.format(i + 1)})[0] for i in range(5)]
+        return accounts, cost_centers, cost_objects
+
+    def create_member_data(self, accounts, cost_centers, cost_objects):
+        divisions = [Division.objects.get_or_create(name='Division {}'.format(i + 1))[0] for i in range(5)]
+        subscriptions = []
+        for i, (frequency, amount) in enumerate([(Subscription.YEARLY, '120.00'), (Subscription.HALFYEARLY, '60.00'), (Subscription.QUARTERLY, '30.00'), (Subscription.MONTHLY, '10.00')]):
+            subscriptions.append(Subscription.objects.get_or_create(name='Subscription {}'.format(i + 1), defaults={
+                'amount': Decimal(amount),
+                'payment_frequency': frequency,
+                'income_account': accounts[Account.INCOME][i],
+                'debitor_account': accounts[Account.DEBITOR][i],
+                'cost_center': cost_centers[i],
+                'cost_object': cost_objects[i],
+            })[0])
+        return divisions, subscriptions
+
+    def create_members(self, count, today, divisions, subscriptions, history_changes):
+        members = []
+        for i in range(count):
+            zipcode, city = self.random.choice(CITIES)
+            joined_at = today - datetime.timedelta(days=self.random.randint(0, 20 * 365))
+            terminated = self.random.random() < 0.1
+            members.append(Member(
+                first_name=self.random.choice(FIRST_NAMES),
+                last_name=self.random.choice(LAST_NAMES),
+                street='Street {}'.format(self.random.randint(1, 200)),
+                zipcode=zipcode,
+                city=city,
+                birthday=datetime.date(self.random.randint(1940, 2015), self.random.randint(1, 12), self.random.randint(1, 28)),
+                email='member{}@example.org'.format(i),
+                membership_number='{}-{}'.format(self.seed, i + 1),
+                joined_at=joined_at,
+                terminated_at=joined_at + datetime.timedelta(days=self.random.randint(1, 3 * 365)) if terminated else None,
+                payment_method=self.random.choice([Member.CASH, Member.REMITTANCE, Member.DEBIT]),
+            ))
+        created = []
+        for start in range(0, len(members), 500):
+            chunk = members[start:start + 500]
+            numbers = [member.membership_number for member in chunk]
+            created += bulk_create_with_history(Member, chunk, refetch=Member.objects.filter(membership_number__in=numbers))
+        members = created
+
+        # Divisions and subscriptions
+        member_divisions = []
+        member_subscriptions = []
+        for member in members:
+            for division in self.random.sample(divisions, self.random.randint(1, 2)):
+                member_divisions.append(Member.division.through(member_id=member.pk, division_id=division.pk))
+            member_subscriptions.append(Member.subscription.through(member_id=member.pk, subscription_id=self.random.choice(subscriptions).pk))
+        Member.division.through.objects.bulk_create(member_divisions, batch_size=500)
+        Member.subscription.through.objects.bulk_create(member_subscriptions, batch_size=500)
+        ModelVersion.objects.bump(Member.division.through, Member.subscription.through)
+
+        # Change history
+        history = Member.history.model
+        records = []
+        for member in members:
+            for i in range(history_changes):
+                zipcode, city = self.random.choice(CITIES)
+                values = {field.attname: getattr(member, field.attname) for field in member._meta.fields if field.name not in history._history_excluded_fields}
+                values.update(zipcode=zipcode, city=city)
+                records.append(history(history_date=now(), history_type='~', **values))
+        history.objects.bulk_create(records, batch_size=500)
+
+        return members
+
+    def create_transactions(self, count, first_year, years, accounts, cost_centers, cost_objects):
+        """
+        Creates balanced receipts of two transactions spread over the accounting years
+        """
+        receipts = count // 2
+        internal_number = NumberSequence.objects.reserve(NumberSequence.INTERNAL, count=receipts) if receipts else 0
+        transactions = []
+        created = 0
+        for year_index in range(years):
+            year = first_year + year_index
+            year_receipts = receipts // years + (1 if year_index < receipts % years else 0)
+            if not year_receipts:
+                continue
+            document_number = NumberSequence.objects.reserve(NumberSequence.DOCUMENT, year, year_receipts)
+            for i in range(year_receipts):
+                date = datetime.date(year, 1, 1) + datetime.timedelta(days=self.random.randint(0, 364))
+                amount = Decimal(self.random.randint(100, 50000)) / 100
+                debit_type, credit_type = self.random.choice([(Account.DEBITOR, Account.INCOME), (Account.ASSET, Account.DEBITOR), (Account.COST, Account.CREDITOR), (Account.CREDITOR, Account.ASSET)])
+                values = {
+                    'date': date,
+                    'document_number': str(year)[2:] + str(document_number + i).zfill(5),
+                    'document_number_generated': True,
+                    'internal_number': internal_number,
+                    'accounting_year': year,
+                }
+                transactions.append(Transaction(account=self.random.choice(accounts[debit_type]), text='Receipt {}'.format(internal_number), debit=amount,
+                                                cost_center=self.random.choice(cost_centers) if debit_type == Account.COST else None,
+                                                cost_object=self.random.choice(cost_objects) if debit_type == Account.COST else None, **values))
+                transactions.append(Transaction(account=self.random.choice(accounts[credit_type]), text='Receipt {}'.format(internal_number), credit=amount,
+                                                cost_center=self.random.choice(cost_centers) if credit_type == Account.INCOME else None, **values))
+                internal_number += 1
+
+                if len(transactions) >= 2000:
+                    created += self.insert_transactions(transactions)
+                    transactions = []
+        created += self.insert_transactions(transactions)
+        return created
+
+    def insert_transactions(self, transactions):
+        if not transactions:
+            return 0
+        internal_numbers = [t.internal_number for t in transactions]
+        created = bulk_create_with_history(Transaction, transactions, refetch=Transaction.objects.filter(internal_number__gte=min(internal_numbers), internal_number__lte=max(internal_numbers)))
+        AccountBalance.objects.add_transactions(created)
+        return len(created)
@@ -0,0 +1,124 @@
+"""
+Middleware for utils app
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+class RequestStats:
+    """
+    Rolling per view statistics of the last requests
+    """
+    def __init__(self, window=100):
+        self.window = window
+        self.lock = threading.Lock()
+        self.requests = {}
+
+    def add(self, view_name, queries, sql_time, total_time):
+        with self.lock:
+            if view_name not in self.requests:
+                self.requests[view_name] = deque(maxlen=self.window)
+            self.requests[view_name].append((queries, sql_time, total_time))
+
+    def clear(self):
+        with self.lock:
+            self.requests = {}
+
+    def summary(self):
+        """
+        Returns count, average and maximum of query count, SQL time and total time (in ms) for each view
+        """
+        with self.lock:
+            requests = {view_name: list(values) for view_name, values in self.requests.items()}
+
+        summary = {}
+        for view_name, values in requests.items():
+            queries, sql_times, total_times = zip(*values)
+            summary[view_name] = {
+                'requests': len(values),
+                'queries_avg': round(sum(queries) / len(values), 1),
+                'queries_max': max(queries),
+                'sql_time_avg': round(sum(sql_times) / len(values) * 1000, 1),
+                'total_time_avg': round(sum(total_times) / len(values) * 1000, 1),
+                'total_time_max': round(max(total_times) * 1000, 1),
+            }
+        return summary
+
+request_stats = RequestStats(getattr(settings, 'REQUEST_STATS_WINDOW', 100))
+
+def get_view_name(request):
+    """
+    Returns the namespaced url name of the resolved view
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name
+
+def get_query_budget(view_name):
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+
+class QueryCountMiddleware:
+    """
+    Records SQL query count, SQL time and total time of each request by url name, for streamed responses
+    including the queries run while the content is consumed.
+    Slow requests and requests exceeding the query budget of their view are logged.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = {'queries': 0, 'sql_time': 0.0}
+
+        def record(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                state['queries'] += 1
+                state['sql_time'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        with self.count_queries(record):
+            response = self.get_response(request)
+
+        def finish():
+            total_time = time.perf_counter() - start
+            view_name = get_view_name(request)
+            request_stats.add(view_name, state['queries'], state['sql_time'], total_time)
+
+            if total_time * 1000 > getattr(settings, 'SLOW_REQUEST_THRESHOLD', 1000):
+                logger.warning('Slow request %s (%s): %.0f ms total, %.0f ms SQL, %d queries', request.path, view_name, total_time * 1000, state['sql_time'] * 1000, state['queries'])
+            budget = get_query_budget(view_name)
+            if budget is not None and state['queries'] > budget:
+                logger.warning('Request %s (%s) exceeded its query budget: %d of %d queries', request.path, view_name, state['queries'], budget)
+
+        if response.streaming:
+            # Streamed content runs its queries after the view returned, so the request is recorded when it is consumed
+            response.streaming_content = self.iterate_content(response.streaming_content, record, finish)
+        else:
+            finish()
+
+        return response
+
+    def count_queries(self, record):
+        """
+        Returns a context, in which all queries of all connections are recorded
+        """
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(record))
+        return stack
+
+    def iterate_content(self, content, record, finish):
+        try:
+            with self.count_queries(record):
+                yield from content
+        finally:
+            finish()
@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import models, connections, router
+from django.db.models import Q, F
+from django.conf import settings
+from django.utils.timezone import now
 from django.contrib.auth.models import Group
 from account.models import User
 from simple_history.models import HistoricalRecords
@@ -21,6 +24,89 @@ class ModelBase(models.Model):
         else:
             return self.last_modified_by
 
+def bulk_create_with_history(model, objs, user=None, batch_size=500, refetch=None):
+    """
+    Insert objs with bulk_create in chunks and record their creation in the history.
+    On databases which do not return primary keys from bulk inserts the created rows
+    are loaded again with the refetch queryset.
+    """
+    if not objs:
+        return []
+
+    for obj in objs:
+        setattr(obj, settings.AUTHOR_CREATED_BY_FIELD_NAME, user)
+        setattr(obj, settings.AUTHOR_UPDATED_BY_FIELD_NAME, user)
+
+    created = model.objects.bulk_create(objs, batch_size=get_batch_size(model, objs, batch_size))
+    if created[0].pk is None and refetch is not None:
+        created = list(refetch)
+
+    bulk_create_history(model, created, '+', user=user, batch_size=batch_size)
+
+    # bulk_create does not send signals
+    ModelVersion.objects.bump(model)
+
+    return created
+
+def bulk_create_history(model, objs, history_type, user=None, batch_size=500):
+    """
+    Record the current state of objs in the history, e.g. after bulk inserts or updates
+    """
+    # ModelBase._history_user queries the history for every row, so the historical records are built here directly
+    history = model.history.model
+    records = [
+        history(
+            history_date=now(),
+            history_user=user,
+            history_type=history_type,
+            **{
+                field.attname: getattr(obj, field.attname)
+                for field in obj._meta.fields
+                if field.name not in history._history_excluded_fields
+            }
+        )
+        for obj in objs
+    ]
+    history.objects.bulk_create(records, batch_size=get_batch_size(history, records, batch_size))
+
+def get_batch_size(model, objs, batch_size):
+    """
+    Limit batch_size to the number of rows the database accepts in one insert
+    """
+    connection = connections[router.db_for_write(model)]
+    return max(min(batch_size, connection.ops.bulk_batch_size(model._meta.concrete_fields, objs)), 1)
+
+class ModelVersionManager(models.Manager):
+    def bump(self, *models):
+        """
+        Increase the change version of the given models
+        """
+        for model in models:
+            label = model._meta.label_lower
+            if not self.filter(model=label).update(version=F('version') + 1):
+                version, created = self.get_or_create(model=label, defaults={'version': 1})
+                if not created:
+                    self.filter(model=label).update(version=F('version') + 1)
+
+    def get_versions(self, models):
+        """
+        Returns the change versions of the given models, 0 if never changed
+        """
+        labels = [model._meta.label_lower for model in models]
+        versions = dict(self.filter(model__in=labels).values_list('model', 'version'))
+        return {label: versions.get(label, 0) for label in labels}
+
+class ModelVersion(models.Model):
+    """
+    Change counter of a model, increased on every save and delete
+    """
+    # Model label
+    model = models.CharField(unique=True, max_length=255)
+    # Version
+    version = models.PositiveIntegerField(default=0)
+
+    objects = ModelVersionManager()
+
 class AccessRestrictedModel(models.Model):
     class Meta:
         abstract = True
@@ -28,32 +114,37 @@ class AccessRestrictedModel(models.Model):
     user = models.ManyToManyField(User, blank=True)
     groups = models.ManyToManyField(Group, blank=True)
 
+    @classmethod
+    def get_accessible_ids(cls, user):
+        """
+        Returns the ids of all objects the user is allowed to view: objects without access restriction,
+        objects granted to the user directly and objects granted to one of his groups.
+        The ids are resolved with one query and kept on the user object for the current request only,
+        so revoked access takes effect with the next request in every process.
+        """
+        if user.is_superuser:
+            return frozenset(cls.objects.values_list('pk', flat=True))
+
+        memo = getattr(user, '_accessible_ids', None)
+        if memo is not None and cls._meta.label_lower in memo:
+            return memo[cls._meta.label_lower]
+
+        access = Q(user=None, groups=None)
+        if user.pk:
+            access |= Q(user=user) | Q(groups__in=user.groups.all())
+        ids = frozenset(cls.objects.filter(access).values_list('pk', flat=True).distinct())
+
+        if memo is None:
+            memo = user._accessible_ids = {}
+        memo[cls._meta.label_lower] = ids
+        return ids
+
     def is_access_granted(self, user):
         """
         Checks if object has no access restriction or if user is allowed to view the object. 
         Either direct or by one of his groups.
         """
-
-        # No access restriction
-        if not self.user.all().exists() and not self.groups.all().exists():
-            return True
-        
-        # User is admin
-        if user.is_superuser:
-            return True
-
-        # Direct access granted for user
-        if user in self.user.all():
-            return True
-        
-        # Check if user is in one of the granted groups
-        user_groups = user.groups.all()
-        for group in self.groups.all():
-            if group in user_groups:
-                return True
-        
-        # No access granted for user
-        return False
+        return self.pk in type(self).get_accessible_ids(user)
 
 class HistoryPermissionModel(models.Model):
 
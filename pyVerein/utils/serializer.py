@@ -0,0 +1,71 @@
+"""
+Serializer base module
+"""
+import json
+
+def iterate_chunks(queryset, chunk_size=2000):
+    """
+    Iterate over queryset loading chunk_size rows at once, ordered by primary key.
+    Unlike QuerySet.iterator every chunk is a regular query, so prefetch_related is applied.
+    """
+    if not queryset.query.can_filter():
+        # Sliced querysets can not be filtered, they are small anyway
+        yield from queryset
+        return
+
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+class JSONSerializer:
+    """
+    Base class for JSON serializers, which yield one record per object
+    """
+    # Key of the record list in the serialized data
+    key = None
+
+    def get_queryset(self, queryset):
+        """
+        Prepare queryset, e.g. by select_related or prefetch_related
+        """
+        return queryset
+
+    def get_record(self, obj):
+        """
+        Returns the serialized data of obj
+        """
+        raise NotImplementedError
+
+    def iterate(self, queryset, chunk_size=2000):
+        """
+        Yield serialized records of queryset, loading chunk_size objects at once
+        """
+        for obj in iterate_chunks(self.get_queryset(queryset), chunk_size):
+            yield self.get_record(obj)
+
+    def serialize(self, queryset):
+        """
+        Serialize data
+        """
+        return {
+            self.key: list(self.iterate(queryset))
+        }
+
+def iterate_json(sections):
+    """
+    Yield the JSON document of sections, a list of (serializer, queryset) tuples, piece by piece.
+    The result is the same as json.dumps of the merged serialize results.
+    """
+    yield '{'
+    for index, (serializer, queryset) in enumerate(sections):
+        yield '{}{}: ['.format(', ' if index else '', json.dumps(serializer.key))
+        for record_index, record in enumerate(serializer.iterate(queryset)):
+            yield '{}{}'.format(', ' if record_index else '', json.dumps(record))
+        yield ']'
+    yield '}'
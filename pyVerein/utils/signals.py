@@ -0,0 +1,25 @@
+"""
+Signal handlers for utils app
+"""
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from .models import ModelVersion
+
+def bump_model_version(sender, **kwargs):
+    """
+    Increase the change version of the saved or deleted model
+    """
+    action = kwargs.get('action')
+    if action is None or action.startswith('post_'):
+        ModelVersion.objects.bump(sender)
+
+def connect_version_signals(models):
+    """
+    Track changes of the given models in their change version.
+    Many-to-many changes are tracked on the through model.
+    """
+    for model in models:
+        if model._meta.auto_created:
+            m2m_changed.connect(bump_model_version, sender=model, dispatch_uid='version_m2m_{}'.format(model._meta.label_lower))
+        else:
+            post_save.connect(bump_model_version, sender=model, dispatch_uid='version_save_{}'.format(model._meta.label_lower))
+            post_delete.connect(bump_model_version, sender=model, dispatch_uid='version_delete_{}'.format(model._meta.label_lower))
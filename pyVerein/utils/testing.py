@@ -0,0 +1,28 @@
+"""
+Test helpers for utils app
+"""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .middleware import get_query_budget
+
+class QueryBudgetTestMixin:
+    """
+    TestCase mixin for checking the query budgets configured in settings.QUERY_BUDGETS
+    """
+    def assertQueryBudget(self, view_name, args=None, kwargs=None, method='get', data=None):
+        """
+        Request the view with the test client and assert it stays within its query budget. Returns the response.
+        The view is requested once before counting, so filled caches like the preferences are not counted.
+        """
+        budget = get_query_budget(view_name)
+        self.assertIsNotNone(budget, 'No query budget configured for {}'.format(view_name))
+
+        url = reverse(view_name, args=args, kwargs=kwargs)
+        getattr(self.client, method)(url, data)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data)
+
+        self.assertLessEqual(len(queries), budget, '{} executed {} queries, budget is {}:\n{}'.format(
+            view_name, len(queries), budget, '\n'.join(query['sql'] for query in queries.captured_queries)))
+        return response
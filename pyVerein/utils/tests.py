@@ -1,3 +1,152 @@
 from django.test import TestCase
+import io
+import json
+import os
+from tempfile import mkdtemp
+from shutil import rmtree
+from django.core.management import call_command
+from account.models import User
+from django.contrib.auth.models import Permission
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from members.models import Member, Division
+from members.serializer import DivisionJSONSerializer
+from finance.models import Transaction, AccountBalance, Account
+from finance.serializer import AccountJSONSerializer
+from .serializer import iterate_chunks, iterate_json
+from .views import get_history
+from datetime import date
 
-# Create your tests here.
+class BenchmarkTestMethods(TestCase):
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def test_generate_data(self):
+        "Generated data should be reproducible and consistent"
+
+        call_command('generate_data', members=20, transactions=40, years=2, first_year=2018, seed=3, stdout=io.StringIO())
+        self.assertEqual(Member.objects.count(), 20)
+        self.assertEqual(Member.history.count(), 40)
+        self.assertEqual(Transaction.objects.count(), 40)
+        self.assertEqual(set(Transaction.objects.values_list('accounting_year', flat=True)), {2018, 2019})
+        self.assertEqual(AccountBalance.objects.verify(), [])
+        names = list(Member.objects.order_by('membership_number').values_list('last_name', 'city'))
+
+        Member.objects.all().delete()
+        call_command('generate_data', members=20, transactions=0, years=2, first_year=2018, seed=3, stdout=io.StringIO())
+        self.assertEqual(list(Member.objects.order_by('membership_number').values_list('last_name', 'city')), names)
+
+    def test_benchmark(self):
+        "Benchmark should write the results, compare them to a baseline and roll back all changes"
+
+        call_command('generate_data', members=10, transactions=20, years=2, first_year=2018, stdout=io.StringIO())
+        output = os.path.join(self.temp_dir, 'benchmark.json')
+
+        call_command('benchmark', output=output, repeat=1, stdout=io.StringIO(), stderr=io.StringIO())
+        with open(output) as f:
+            results = json.load(f)['results']
+        for name in ['dashboard', 'member_list', 'transaction_list', 'account_detail', 'apply_subscriptions', 'apply_annualclosure']:
+            self.assertIn(name, results)
+        self.assertEqual(results['member_list']['status'], 200)
+        self.assertEqual(Transaction.objects.count(), 20)
+
+        out = io.StringIO()
+        call_command('benchmark', output=os.path.join(self.temp_dir, 'second.json'), baseline=output, tolerance=100, repeat=1, stdout=out, stderr=io.StringIO())
+        self.assertIn('No regressions', out.getvalue())
+
+class HistoryTestMethods(TestCase):
+    def setUp(self):
+        # Create user
+        user = User.objects.create_user('temp', 'temp@temp.tld', 'temppass')
+        user.first_name = 'temp_first'
+        user.last_name = 'temp_last'
+        user.save()
+        user.user_permissions.add(Permission.objects.get(codename='view_member'))
+        self.user = user
+
+        # login with user
+        self.client.login(username='temp', password='temppass')
+
+        self.member = Member.objects.create(first_name='first', last_name='last0')
+        for i in range(1, 30):
+            self.member.last_name = 'last{}'.format(i)
+            self.member.save()
+        self.url = reverse('members:member_detail', kwargs={'pk': self.member.pk})
+
+    def test_history_permission(self):
+        "History should only be served with permission view_history"
+
+        response = self.client.get(self.url, {'history': 1})
+        self.assertEqual(response.status_code, 403)
+
+    def test_history_pagination(self):
+        "History should be served page by page with a constant number of queries"
+
+        self.user.user_permissions.add(Permission.objects.get(codename='view_history'))
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'last28 to last29')
+
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get(self.url, {'history': 1})
+        self.assertContains(response, 'last28 to last29')
+        self.assertNotContains(response, 'last8 to last9')
+        self.assertContains(response, 'data-page="2"')
+
+        with CaptureQueriesContext(connection) as second_page:
+            response = self.client.get(self.url, {'history': 2})
+        self.assertContains(response, 'last8 to last9')
+        self.assertContains(response, 'Record created')
+        self.assertNotContains(response, 'data-page="3"')
+        self.assertEqual(len(first_page), len(second_page))
+
+        response = self.client.get(self.url, {'history': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_history_related_objects(self):
+        "Changed relations should be shown by their related objects instead of their ids"
+
+        account = Account.objects.create(number='10000', name='Debitor', account_type=Account.DEBITOR)
+        transaction = Transaction.objects.create(account=account, date=date(2019, 1, 1), text='text', debit=1, accounting_year=2019)
+        other_member = Member.objects.create(first_name='other', last_name='member')
+        transaction.member = self.member
+        transaction.save()
+        transaction.member = other_member
+        transaction.save()
+        transaction.member = None
+        transaction.save()
+        other_member_pk = other_member.pk
+        other_member.delete()
+
+        with self.assertNumQueries(2):
+            history, has_more = get_history(transaction)
+        changes = [entry['changes'] for entry in history[:3]]
+        self.assertEqual(changes[2], [{'field': 'member', 'old': None, 'new': str(self.member)}])
+        self.assertEqual(changes[1], [{'field': 'member', 'old': str(self.member), 'new': other_member_pk}])
+        self.assertEqual(changes[0], [{'field': 'member', 'old': other_member_pk, 'new': None}])
+
+class SerializerTestMethods(TestCase):
+    def setUp(self):
+        for i in range(5):
+            Division.objects.create(name='Division {}'.format(i))
+
+    def test_iterate_chunks(self):
+        "All objects should be iterated once in chunks"
+
+        names = [division.name for division in iterate_chunks(Division.objects.all(), chunk_size=2)]
+        self.assertEqual(names, ['Division {}'.format(i) for i in range(5)])
+        self.assertEqual(len(list(iterate_chunks(Division.objects.all()[:3], chunk_size=2))), 3)
+
+    def test_iterate_json(self):
+        "Streamed JSON should equal the dumped serialized data"
+
+        sections = [(DivisionJSONSerializer(), Division.objects.all()), (AccountJSONSerializer(), Account.objects.all())]
+        data = {}
+        for serializer, queryset in sections:
+            data.update(serializer.serialize(queryset))
+        self.assertEqual(''.join(iterate_json(sections)), json.dumps(data))
@@ -1,5 +1,6 @@
 # Import HttpResponse
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseBadRequest
+from django.shortcuts import render
 # Import template loader.
 from django.template import loader
 # Import JSON
@@ -7,49 +8,127 @@ import json
 # Import Base64
 import base64
 
-from finance.models import Transaction
+from finance.models import NumberSequence
 import datetime
 from dynamic_preferences.registries import global_preferences_registry
-from django.db.models import Q, Max
 from django.views import generic
+from django.db import models
+from collections import defaultdict
 
-class DetailView(generic.DetailView):
+def get_display_value(obj):
+    """
+    Returns the string representation of a related object, or its primary key if the model defines none
+    """
+    if type(obj).__str__ is models.Model.__str__:
+        return obj.pk
+    return str(obj)
 
-    def get_context_data(self, **kwargs):
-        context = super(DetailView, self).get_context_data(**kwargs)
+def get_history(instance, page=1, paginate_by=20):
+    """
+    Returns one page of history entries of instance, newest first, and whether more pages exist.
+    The records of the page and their predecessor are loaded with one query and diffed pairwise.
+    Changed relations are resolved with one query per related model.
+    """
+    offset = (page - 1) * paginate_by
+    records = list(instance.history.select_related('history_user').order_by('-history_date', '-history_id')[offset:offset + paginate_by + 1])
+    excluded_fields = instance.history.model._history_excluded_fields
+    fields = [field for field in instance._meta.concrete_fields if field.name not in excluded_fields]
 
-        context['instance'] = self.object
+    history = []
+    related_ids = defaultdict(set)
+    for index, record in enumerate(records[:paginate_by]):
+        entry = {
+            'type': record.history_type,
+            'date': record.history_date,
+            'user': record.history_user.get_full_name() if record.history_user else None,
+            'changes': []
+        }
 
-        history = []
-        for record in self.object.history.all():
-            entry = {
-                'type': record.history_type,
-                'date': record.history_date,
-                'user': record.history_user.get_full_name() if record.history_user else None,
-                'changes': []
-            }
-            
-            if record.prev_record:
-                delta = record.diff_against(record.prev_record)
-                for change in delta.changes:
+        if index + 1 < len(records):
+            prev_record = records[index + 1]
+            for field in fields:
+                old = getattr(prev_record, field.attname)
+                new = getattr(record, field.attname)
+                if old != new:
                     entry['changes'].append({
-                        'field': change.field,
-                        'old': change.old,
-                        'new': change.new
+                        'field': field.name,
+                        'old': old,
+                        'new': new,
+                        'related_model': field.related_model if field.is_relation else None
                     })
+                    if field.is_relation:
+                        related_ids[field.related_model].update(value for value in (old, new) if value is not None)
+
+        history.append(entry)
+
+    # Related objects, which were deleted meanwhile, are shown by their primary key
+    related_objects = {model: model._default_manager.in_bulk(ids) for model, ids in related_ids.items()}
+    for entry in history:
+        for change in entry['changes']:
+            model = change.pop('related_model')
+            if model is not None:
+                for key in ('old', 'new'):
+                    if change[key] in related_objects[model]:
+                        change[key] = get_display_value(related_objects[model][change[key]])
+
+    return history, len(records) > paginate_by
+
+class HistoryMixin:
+    """
+    Serves the paginated history of the displayed object, if the history parameter is set
+    """
+    history_paginate_by = 20
+
+    def get_history_object(self):
+        return self.get_object()
+
+    def get(self, request, *args, **kwargs):
+        if 'history' not in request.GET:
+            return super(HistoryMixin, self).get(request, *args, **kwargs)
 
-            history.append(entry)
+        if not request.user.has_perm('utils.view_history'):
+            return HttpResponseForbidden()
+        try:
+            page = max(int(request.GET['history']), 1)
+        except ValueError:
+            return HttpResponseBadRequest()
 
-        context['history'] = history
+        history, has_more = get_history(self.get_history_object(), page, self.history_paginate_by)
+        return render(request, 'app/_history_records.html', {
+            'history': history,
+            'next_page': page + 1 if has_more else None
+        })
+
+class DetailView(HistoryMixin, generic.DetailView):
+
+    def get_context_data(self, **kwargs):
+        context = super(DetailView, self).get_context_data(**kwargs)
+
+        context['instance'] = self.object
 
         return context
 
 def generate_document_number():
+    return generate_document_numbers(1)[0]
+
+def generate_document_numbers(count):
+    """
+    Reserve count consecutive document numbers for the current accounting year
+    """
     global_preferences = global_preferences_registry.manager()
-    max_document_number = Transaction.objects.filter(Q(document_number_generated=True) & ~Q(document_number__startswith=global_preferences['Finance__reset_prefix']) & Q(accounting_year=global_preferences['Finance__accounting_year'])).aggregate(Max('document_number'))['document_number__max']
-    next_document_number =  '1' if max_document_number is None else str(int(max_document_number) + 1)[2:]
-    return global_preferences['Finance__accounting_year'][2:] + next_document_number.zfill(5)
+    accounting_year = global_preferences['Finance__accounting_year']
+    first_number = NumberSequence.objects.reserve(NumberSequence.DOCUMENT, int(accounting_year), count)
+    return [accounting_year[2:] + str(number).zfill(5) for number in range(first_number, first_number + count)]
 
 def generate_internal_number():
-    max_internal_number = Transaction.objects.all().aggregate(Max('internal_number'))['internal_number__max']
-    return 1 if max_internal_number is None else max_internal_number + 1
\ No newline at end of file
+    return generate_internal_numbers(1)[0]
+
+def generate_internal_numbers(count):
+    """
+    Reserve count consecutive internal numbers
+    """
+    first_number = NumberSequence.objects.reserve(NumberSequence.INTERNAL, count=count)
+    return list(range(first_number, first_number + count))
+
+def generate_clearing_number():
+    return NumberSequence.objects.reserve(NumberSequence.CLEARING)